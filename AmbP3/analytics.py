@@ -0,0 +1,257 @@
+"""
+Season-level lap analytics across heats.
+
+Lap times are derived from the laps table (consecutive passes of a
+transponder within a heat) and aggregated with vectorized NumPy group-bys:
+best, median, p90, mean, standard deviation and lap count per transponder,
+per transponder and heat, or per transponder and week.
+
+Finished heats never change, so their laps and per-heat statistics are
+computed once and cached; only the running heat is re-read, at most every
+refresh_interval seconds. Laps come from a source: DatabaseSource (MySQL)
+or ColumnarSource (a store written by amb_export.py).
+"""
+import threading
+from time import monotonic
+import numpy as np
+from .columnar import load
+from .logs import Logg
+
+logger = Logg.create_logger('analytics')
+
+DEFAULT_MIN_LAP_TIME = 10.0
+DEFAULT_MAX_LAP_TIME = 300.0
+DEFAULT_REFRESH_INTERVAL = 5.0
+US_PER_DAY = 86400 * 1000000
+PERIODS = ('day', 'week')
+STAT_COLUMNS = ('count', 'best', 'median', 'p90', 'mean', 'std')
+LAP_COLUMNS = ('heat_id', 'transponder_id', 'rtc_time', 'lap_time')
+
+
+def lap_times(heat_ids, transponder_ids, rtc_times, min_lap_time=DEFAULT_MIN_LAP_TIME,
+              max_lap_time=DEFAULT_MAX_LAP_TIME):
+    """
+    Laps between consecutive passes of the same transponder in the same heat,
+    as {column: array} with the rtc_time of the pass that completed each lap.
+    Laps outside (min_lap_time, max_lap_time) seconds are dropped, like web_app does.
+    """
+    order = np.lexsort((rtc_times, transponder_ids, heat_ids))
+    heat_ids, transponder_ids, rtc_times = heat_ids[order], transponder_ids[order], rtc_times[order]
+    laps = np.diff(rtc_times) / 1000000.0
+    valid = ((np.diff(heat_ids) == 0) & (np.diff(transponder_ids) == 0)
+             & (laps > min_lap_time) & (laps < max_lap_time))
+    return {'heat_id': heat_ids[1:][valid], 'transponder_id': transponder_ids[1:][valid],
+            'rtc_time': rtc_times[1:][valid], 'lap_time': laps[valid]}
+
+
+def _percentile(values, starts, counts, fraction):
+    """Linearly interpolated percentile of every sorted group (same as np.percentile)"""
+    position = starts + fraction * (counts - 1)
+    low = np.floor(position).astype(np.int64)
+    high = np.minimum(low + 1, starts + counts - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def group_stats(keys, values):
+    """
+    Statistics of values grouped by the key arrays in keys ({name: array}),
+    as {name: array} for the keys followed by STAT_COLUMNS, sorted by the keys in order.
+    """
+    names = list(keys)
+    if len(values) == 0:
+        empty = {name: np.empty(0, dtype=np.int64) for name in names}
+        empty.update({column: np.empty(0, dtype=np.int64 if column == 'count' else np.float64) for column in STAT_COLUMNS})
+        return empty
+    # np.lexsort sorts by its last key first; values last sorts every group for the percentiles.
+    order = np.lexsort((values,) + tuple(keys[name] for name in reversed(names)))
+    values = values[order]
+    sorted_keys = {name: keys[name][order] for name in names}
+    changed = np.zeros(len(values) - 1, dtype=bool)
+    for name in names:
+        changed |= np.diff(sorted_keys[name]) != 0
+    starts = np.r_[0, np.flatnonzero(changed) + 1]
+    counts = np.diff(np.r_[starts, len(values)])
+    means = np.add.reduceat(values, starts) / counts
+    squares = np.add.reduceat((values - np.repeat(means, counts)) ** 2, starts)
+    stats = {name: sorted_keys[name][starts] for name in names}
+    stats.update({'count': counts, 'best': values[starts], 'median': _percentile(values, starts, counts, 0.5),
+                  'p90': _percentile(values, starts, counts, 0.9), 'mean': means, 'std': np.sqrt(squares / counts)})
+    return stats
+
+
+def to_rows(columns):
+    """{column: array} as a list of JSON-ready dicts, lap times rounded to milliseconds"""
+    names = list(columns)
+    lists = [np.round(columns[name], 3).tolist() if columns[name].dtype.kind == 'f' else columns[name].tolist()
+             for name in names]
+    return [dict(zip(names, row)) for row in zip(*lists)]
+
+
+def week_start(days):
+    """First day (a Monday) of the ISO week of each day number since the epoch, a Thursday"""
+    return (days + 3) // 7 * 7 - 3
+
+
+def _concatenate(parts):
+    if not parts:
+        return {column: np.empty(0, dtype=np.float64 if column == 'lap_time' else np.int64) for column in LAP_COLUMNS}
+    return {column: np.concatenate([part[column] for part in parts]) for column in LAP_COLUMNS}
+
+
+def _select(laps, mask):
+    return {column: values[mask] for column, values in laps.items()}
+
+
+class DatabaseSource:
+    """Reads heats and laps from MySQL; connect() returns a new connection"""
+
+    def __init__(self, connect):
+        self.connect = connect
+
+    def _query(self, query, params=()):
+        connection = self.connect()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            cursor.close()
+        finally:
+            connection.close()
+        return np.array(rows, dtype=np.int64).reshape(-1, 3)
+
+    def heats(self):
+        """(heat_id, heat_finished, rtc_time_start) of every heat"""
+        return self._query("SELECT heat_id, heat_finished, rtc_time_start FROM heats ORDER BY heat_id")
+
+    def laps(self, heat_ids):
+        """(heat_id, transponder_id, rtc_time) of every lap pass in heat_ids"""
+        if not heat_ids:
+            return np.empty((0, 3), dtype=np.int64)
+        placeholders = ', '.join(['%s'] * len(heat_ids))
+        return self._query(f"SELECT heat_id, transponder_id, rtc_time FROM laps WHERE heat_id IN ({placeholders})",
+                           tuple(int(heat_id) for heat_id in heat_ids))
+
+
+class ColumnarSource:
+    """Reads heats and laps from a columnar store; it only holds finished heats"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def heats(self):
+        heats = load(self.root, 'heats', columns=('heat_id', 'heat_finished', 'rtc_time_start'))
+        return np.stack([heats['heat_id'], heats['heat_finished'], heats['rtc_time_start']], axis=1)
+
+    def laps(self, heat_ids):
+        laps = load(self.root, 'laps', heats=heat_ids, columns=('heat_id', 'transponder_id', 'rtc_time'))
+        return np.stack([laps['heat_id'], laps['transponder_id'], laps['rtc_time']], axis=1)
+
+
+class SeasonAnalytics:
+    """Cached lap aggregates over every heat of a source"""
+
+    def __init__(self, source, min_lap_time=DEFAULT_MIN_LAP_TIME, max_lap_time=DEFAULT_MAX_LAP_TIME,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        self.source = source
+        self.min_lap_time = min_lap_time
+        self.max_lap_time = max_lap_time
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._refreshed_at = None
+        self._heat_starts = {}       # heat_id -> rtc_time_start
+        self._finished_laps = {}     # heat_id -> laps of a finished heat, never invalidated
+        self._finished_stats = {}    # heat_id -> per-transponder statistics of a finished heat
+        self._season = _concatenate([])  # Laps of every cached finished heat
+        self._running_laps = _concatenate([])
+
+    def _laps_by_heat(self, heat_ids):
+        rows = self.source.laps(sorted(heat_ids))
+        laps = lap_times(rows[:, 0], rows[:, 1], rows[:, 2], self.min_lap_time, self.max_lap_time)
+        return {heat_id: _select(laps, laps['heat_id'] == heat_id) for heat_id in heat_ids}
+
+    def refresh(self, force=False):
+        """Cache newly finished heats and re-read the running ones"""
+        with self._lock:
+            if not force and self._refreshed_at is not None and \
+                    monotonic() - self._refreshed_at < self.refresh_interval:
+                return
+            heats = self.source.heats()
+            self._heat_starts = {int(heat_id): int(start) for heat_id, finished, start in heats}
+            new_finished = [int(heat_id) for heat_id, finished, start in heats
+                            if finished and int(heat_id) not in self._finished_laps]
+            running = [int(heat_id) for heat_id, finished, start in heats if not finished]
+            if new_finished:
+                for heat_id, laps in self._laps_by_heat(new_finished).items():
+                    self._finished_laps[heat_id] = laps
+                    self._finished_stats[heat_id] = group_stats({'transponder_id': laps['transponder_id']},
+                                                                laps['lap_time'])
+                self._season = _concatenate([self._finished_laps[heat_id] for heat_id in sorted(self._finished_laps)])
+                logger.debug(f"Cached {len(new_finished)} finished heats, {len(self._finished_laps)} in total")
+            self._running_laps = _concatenate(list(self._laps_by_heat(running).values()))
+            self._refreshed_at = monotonic()
+
+    def heat_ids(self):
+        self.refresh()
+        return sorted(self._heat_starts)
+
+    def laps(self, since=None, until=None, transponder_id=None):
+        """Every lap completed in [since, until) (rtc_time in microseconds), optionally of one transponder"""
+        self.refresh()
+        with self._lock:
+            laps = _concatenate([self._season, self._running_laps])
+        mask = np.ones(len(laps['lap_time']), dtype=bool)
+        if since is not None:
+            mask &= laps['rtc_time'] >= since
+        if until is not None:
+            mask &= laps['rtc_time'] < until
+        if transponder_id is not None:
+            mask &= laps['transponder_id'] == transponder_id
+        return _select(laps, mask)
+
+    def heat(self, heat_id):
+        """Per-transponder statistics of one heat, or None if there is no such heat"""
+        self.refresh()
+        with self._lock:
+            if heat_id in self._finished_stats:
+                return self._finished_stats[heat_id]
+            if heat_id not in self._heat_starts:
+                return None
+            laps = _select(self._running_laps, self._running_laps['heat_id'] == heat_id)
+        return group_stats({'transponder_id': laps['transponder_id']}, laps['lap_time'])
+
+    def drivers(self, since=None, until=None):
+        """Per-transponder statistics over all laps in [since, until)"""
+        laps = self.laps(since, until)
+        return group_stats({'transponder_id': laps['transponder_id']}, laps['lap_time'])
+
+    def best_by_heat(self, transponder_id=None):
+        """Per-transponder statistics of every heat, from the per-heat cache"""
+        self.refresh()
+        with self._lock:
+            running = self._running_laps
+            parts = [dict(stats, heat_id=np.full(len(stats['count']), heat_id, dtype=np.int64))
+                     for heat_id, stats in sorted(self._finished_stats.items())]
+        parts.append(group_stats({'heat_id': running['heat_id'], 'transponder_id': running['transponder_id']},
+                                 running['lap_time']))
+        columns = ('heat_id', 'transponder_id') + STAT_COLUMNS
+        stats = {column: np.concatenate([part[column] for part in parts]) for column in columns}
+        if transponder_id is not None:
+            stats = _select(stats, stats['transponder_id'] == transponder_id)
+        return stats
+
+    def progression(self, period='week', transponder_id=None, since=None, until=None):
+        """Per-transponder statistics by day or week; period_start is the first day's rtc_time"""
+        laps = self.laps(since, until, transponder_id)
+        days = laps['rtc_time'] // US_PER_DAY
+        starts = week_start(days) if period == 'week' else days
+        return group_stats({'transponder_id': laps['transponder_id'], 'period_start': starts * US_PER_DAY},
+                           laps['lap_time'])
+
+    def consistency(self, min_laps=10, since=None, until=None):
+        """Transponders with at least min_laps laps, most consistent (lowest std) first"""
+        stats = self.drivers(since, until)
+        stats = _select(stats, stats['count'] >= min_laps)
+        stats['cv'] = stats['std'] / stats['mean']
+        stats = _select(stats, np.argsort(stats['std'], kind='stable'))
+        stats['rank'] = np.arange(1, len(stats['std']) + 1)
+        return stats
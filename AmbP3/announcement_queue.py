@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+Bounded priority queue for voice announcements.
+
+Higher priorities (race start/finish, best laps) are spoken first. A pending
+announcement with the same key (e.g. a transponder id) is replaced by the newer
+one, so a car is never called out twice for stale laps, and announcements
+that waited longer than max_age are dropped instead of spoken late.
+"""
+import threading
+from time import monotonic
+from collections import namedtuple, deque
+
+PRIORITY_ROUTINE = 0
+PRIORITY_BEST_LAP = 1
+PRIORITY_RACE = 2  # Race start/finish
+
+DEFAULT_MAXSIZE = 16
+DEFAULT_MAX_AGE = 10.0  # Seconds
+LATENCY_WINDOW = 100    # Recent speech latencies kept for the metrics
+
+# trace is the tracing key of the pass the announcement is about, if any
+Announcement = namedtuple('Announcement', ['text', 'priority', 'key', 'queued_at', 'trace'], defaults=(None,))
+
+
+class AnnouncementQueue:
+    """Pending announcements, at most maxsize, newest per key"""
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, max_age=DEFAULT_MAX_AGE):
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self._pending = []  # Announcements in arrival order; short, so scanning is cheap
+        self._cond = threading.Condition()
+        self._closed = False
+        self.enqueued = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.expired = 0
+        self.spoken = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def put(self, text, priority=PRIORITY_ROUTINE, key=None, trace=None):
+        """Queue an announcement. Returns False if it was dropped because the queue is full of more important ones."""
+        item = Announcement(text, priority, key, monotonic(), trace)
+        with self._cond:
+            if key is not None:
+                for index, pending in enumerate(self._pending):
+                    if pending.key == key:
+                        del self._pending[index]
+                        self.coalesced += 1
+                        break
+            if len(self._pending) >= self.maxsize:
+                # Make room by dropping the oldest of the least important announcements.
+                lowest = min(range(len(self._pending)), key=lambda i: self._pending[i].priority)
+                if self._pending[lowest].priority > priority:
+                    self.dropped += 1
+                    return False
+                del self._pending[lowest]
+                self.dropped += 1
+            self._pending.append(item)
+            self.enqueued += 1
+            self._cond.notify()
+        return True
+
+    def get(self, timeout=None):
+        """
+        Remove and return the most important (then oldest) announcement that is not
+        older than max_age. Returns None on timeout or after close().
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._cond:
+            while True:
+                self._expire()
+                if self._closed:
+                    return None
+                if self._pending:
+                    best = max(range(len(self._pending)), key=lambda i: (self._pending[i].priority, -i))
+                    return self._pending.pop(best)
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def _expire(self):
+        oldest_allowed = monotonic() - self.max_age
+        fresh = [item for item in self._pending if item.queued_at >= oldest_allowed]
+        self.expired += len(self._pending) - len(fresh)
+        self._pending = fresh
+
+    def is_fresh(self, item):
+        """False (and counted as expired) if item waited longer than max_age, e.g. while the previous one played"""
+        if monotonic() - item.queued_at <= self.max_age:
+            return True
+        self.expired += 1
+        return False
+
+    def record_spoken(self, item):
+        """Record that speech for item started now, for the latency metrics"""
+        self.spoken += 1
+        self._latencies.append(monotonic() - item.queued_at)
+
+    def close(self):
+        """Wake up and stop every get()"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def metrics(self):
+        latencies = sorted(self._latencies)
+        return {
+            'depth': len(self._pending),
+            'enqueued': self.enqueued,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'expired': self.expired,
+            'spoken': self.spoken,
+            'latency_avg': sum(latencies) / len(latencies) if latencies else None,
+            'latency_p95': latencies[int(len(latencies) * 0.95)] if latencies else None,
+            'latency_max': latencies[-1] if latencies else None,
+        }
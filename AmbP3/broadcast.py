@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Fan-out of live events to many subscribers (e.g. Server-Sent Events clients).
+Every subscriber has its own bounded buffer so a slow client never holds up
+the publisher or the other clients.
+"""
+import threading
+from collections import deque
+
+DEFAULT_BUFFER_SIZE = 256
+
+RESYNC = object()  # Returned by Subscription.get() after the buffer overflowed
+
+
+class Subscription:
+    """Bounded message buffer for a single subscriber"""
+
+    def __init__(self, maxsize=DEFAULT_BUFFER_SIZE, topic=None):
+        self.maxsize = maxsize
+        self.topic = topic  # None receives every message
+        self.dropped = 0
+        self._messages = deque()
+        self._overflowed = False
+        self._cond = threading.Condition()
+
+    def put(self, message):
+        with self._cond:
+            if len(self._messages) >= self.maxsize:
+                # The client fell behind: drop its backlog and ask it to reload the full state.
+                self.dropped += len(self._messages)
+                self._messages.clear()
+                self._overflowed = True
+            self._messages.append(message)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Next message, RESYNC if messages were dropped, or None on timeout"""
+        with self._cond:
+            if not self._messages and not self._overflowed:
+                self._cond.wait(timeout)
+            if self._overflowed:
+                self._overflowed = False
+                return RESYNC
+            if self._messages:
+                return self._messages.popleft()
+            return None
+
+    def __len__(self):
+        return len(self._messages)
+
+
+class Broadcaster:
+    """Publishes messages to all current subscribers"""
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._subscribers = ()  # Replaced, never mutated, so publish() can iterate without locking
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic=None):
+        subscription = Subscription(self.buffer_size, topic)
+        with self._lock:
+            self._subscribers = self._subscribers + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers = tuple(s for s in self._subscribers if s is not subscription)
+
+    def publish(self, message, topic=None):
+        """Deliver message to every subscriber listening to all topics or to this topic"""
+        for subscription in self._subscribers:
+            if subscription.topic is None or subscription.topic == topic:
+                subscription.put(message)
+
+    def __len__(self):
+        return len(self._subscribers)
@@ -0,0 +1,182 @@
+"""
+Columnar store of passes, laps and heats for offline analysis.
+
+Rows exported from MySQL are kept as NumPy .npz files of int64 columns,
+partitioned by the UTC date of their rtc_time and by heat:
+
+    <root>/passes/date=2019-03-02/heat=12/part-00003-0000.npz
+    <root>/laps/date=2019-03-02/heat=12/part-00003-0000.npz
+    <root>/heats/date=2019-03-02/part-00003-0000.npz
+    <root>/manifest.json
+
+Every export run appends new part files and never rewrites old ones;
+manifest.json records how far each table has been exported. load() reads a
+table back as a dict of column arrays, optionally pruned to some dates and
+heats without opening the other partitions. NULL values are stored as -1,
+which is also what load() returns for a column added after a part was written.
+"""
+import io
+import os
+import json
+import numpy as np
+from .logs import Logg
+
+logger = Logg.create_logger('columnar')
+
+TABLE_COLUMNS = {
+    # heat_id of a pass comes from laps; 0 means the pass is not part of any heat
+    'passes': ('db_entry_id', 'pass_id', 'transponder_id', 'rtc_time', 'strength', 'hits', 'flags', 'decoder_id',
+               'heat_id'),
+    'laps': ('heat_id', 'pass_id', 'transponder_id', 'rtc_time', 'decoder_id'),
+    'heats': ('heat_id', 'heat_finished', 'first_pass_id', 'last_pass_id', 'rtc_time_start', 'rtc_time_end',
+              'race_flag', 'rtc_time_max_end'),
+}
+# Column giving the date partition, and whether the table is also partitioned by heat
+PARTITION_TIME = {'passes': 'rtc_time', 'laps': 'rtc_time', 'heats': 'rtc_time_start'}
+PARTITION_HEAT = {'passes': True, 'laps': True, 'heats': False}
+SORT_COLUMN = {'passes': 'rtc_time', 'laps': 'rtc_time', 'heats': 'heat_id'}
+NULL = -1
+MANIFEST = 'manifest.json'
+US_PER_DAY = 86400 * 1000000
+
+
+def rows_to_columns(rows, table):
+    """Turn DB rows (tuples in TABLE_COLUMNS order) into {column: int64 array}"""
+    columns = TABLE_COLUMNS[table]
+    if not rows:
+        return {column: np.empty(0, dtype=np.int64) for column in columns}
+    matrix = np.array([[NULL if value is None else value for value in row] for row in rows], dtype=np.int64)
+    return {column: matrix[:, index] for index, column in enumerate(columns)}
+
+
+def date_of(rtc_time):
+    """UTC date string of an rtc_time in microseconds"""
+    return str(np.datetime64(int(rtc_time), 'us').astype('datetime64[D]'))
+
+
+class ColumnarStore:
+    """Append-only partitioned .npz store rooted at root"""
+
+    def __init__(self, root):
+        self.root = root
+        self.manifest = self._read_manifest()
+        self._parts = 0
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.root, MANIFEST)) as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError:
+            return {'runs': 0, 'watermarks': {}, 'rows': {}}
+
+    def watermark(self, name, default=0):
+        """Value saved with set_watermark(), e.g. the last rtc_time exported"""
+        return self.manifest['watermarks'].get(name, default)
+
+    def set_watermark(self, name, value):
+        self.manifest['watermarks'][name] = int(value)
+
+    def begin(self):
+        """Start an export run; its part files are named after the run number"""
+        for table in TABLE_COLUMNS:
+            for path in partitions(self.root, table, committed_only=False):
+                if _part_run(path) > self.manifest['runs']:
+                    os.remove(path)  # Left behind by a run that failed before commit()
+        self.manifest['runs'] += 1
+        self._parts = 0
+
+    def commit(self):
+        """Save the manifest, which makes the run's parts visible to load()"""
+        os.makedirs(self.root, exist_ok=True)
+        _atomic_write(os.path.join(self.root, MANIFEST), json.dumps(self.manifest, indent=1).encode())
+
+    def append(self, table, columns):
+        """Write {column: array} as new part files, one per partition. Returns the number of rows written."""
+        rows = len(columns[TABLE_COLUMNS[table][0]])
+        if not rows:
+            return 0
+        days = columns[PARTITION_TIME[table]] // US_PER_DAY
+        heats = columns['heat_id'] if PARTITION_HEAT[table] else np.zeros(rows, dtype=np.int64)
+        keys, inverse = np.unique(np.stack([days, heats]), axis=1, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        for index in range(keys.shape[1]):
+            selected = inverse == index
+            directory = self._partition_dir(table, keys[0, index], keys[1, index])
+            os.makedirs(directory, exist_ok=True)
+            buffer = io.BytesIO()
+            np.savez(buffer, **{column: columns[column][selected] for column in TABLE_COLUMNS[table]})
+            name = f"part-{self.manifest['runs']:05d}-{self._parts:04d}.npz"
+            _atomic_write(os.path.join(directory, name), buffer.getvalue())
+            self._parts += 1
+        self.manifest['rows'][table] = self.manifest['rows'].get(table, 0) + rows
+        logger.debug(f"{table}: {rows} rows in {keys.shape[1]} partitions")
+        return rows
+
+    def _partition_dir(self, table, day, heat_id):
+        date = str(np.datetime64(int(day), 'D'))
+        directory = os.path.join(self.root, table, f"date={date}")
+        return os.path.join(directory, f"heat={heat_id}") if PARTITION_HEAT[table] else directory
+
+
+def _atomic_write(path, data):
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as output:
+        output.write(data)
+    os.replace(temporary, path)
+
+
+def _part_run(path):
+    return int(os.path.basename(path).split('-')[1])
+
+
+def committed_runs(root):
+    try:
+        with open(os.path.join(root, MANIFEST)) as manifest_file:
+            return json.load(manifest_file)['runs']
+    except FileNotFoundError:
+        return 0
+
+
+def partitions(root, table, dates=None, heats=None, committed_only=True):
+    """Part files of table, restricted to the given dates ('YYYY-MM-DD') and heat_ids"""
+    runs = committed_runs(root) if committed_only else None
+    dates = None if dates is None else {str(date) for date in dates}
+    heats = None if heats is None else {int(heat) for heat in heats}
+    table_dir = os.path.join(root, table)
+    if not os.path.isdir(table_dir):
+        return []
+    paths = []
+    for date_dir in sorted(os.listdir(table_dir)):
+        if not date_dir.startswith('date=') or (dates is not None and date_dir[5:] not in dates):
+            continue
+        directories = [os.path.join(table_dir, date_dir)]
+        if PARTITION_HEAT[table]:
+            directories = [os.path.join(directories[0], heat_dir) for heat_dir in os.listdir(directories[0])
+                           if heat_dir.startswith('heat=') and (heats is None or int(heat_dir[5:]) in heats)]
+        for directory in directories:
+            paths.extend(os.path.join(directory, name) for name in sorted(os.listdir(directory))
+                         if name.startswith('part-') and name.endswith('.npz')
+                         and (runs is None or _part_run(name) <= runs))
+    return paths
+
+
+def load(root, table, dates=None, heats=None, columns=None):
+    """
+    Read table from the store as {column: int64 array}, sorted by rtc_time
+    (heat_id for heats). dates and heats prune partitions; for heats, which
+    is only partitioned by date, heats filters rows instead.
+    """
+    columns = tuple(columns or TABLE_COLUMNS[table])
+    wanted = set(columns) | {SORT_COLUMN[table]} | ({'heat_id'} if heats is not None else set())
+    chunks = {column: [] for column in wanted}
+    for path in partitions(root, table, dates, heats):
+        with np.load(path) as part:
+            for column in wanted:
+                chunks[column].append(part[column] if column in part.files
+                                      else np.full(len(part[SORT_COLUMN[table]]), NULL, dtype=np.int64))
+    result = {column: np.concatenate(chunks[column]) if chunks[column] else np.empty(0, dtype=np.int64)
+              for column in wanted}
+    order = np.argsort(result[SORT_COLUMN[table]], kind='stable')
+    if heats is not None and not PARTITION_HEAT[table]:
+        order = order[np.isin(result['heat_id'][order], [int(heat) for heat in heats])]
+    return {column: result[column][order] for column in columns}
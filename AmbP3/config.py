@@ -42,6 +42,11 @@ def get_args(PORT=DEFAULT_PORT, IP=DEFAULT_IP, config_file=DEFAULT_CONFIG_FILE):
     args.add_argument("-i", "--ip", help="AMB decoder IP")
     args.add_argument("-p", "--port",  dest='port', type=int, help="AMB decoder PORT")
     args.add_argument("-l", "--log-file", dest='file', help="amb msgs log file")
+    args.add_argument("--metrics-port", dest='metrics_port', type=int, help="serve Prometheus metrics on this port")
+    args.add_argument("--dedup-window-ms", dest='dedup_window_ms', type=int,
+                      help="merge passes of a transponder within this many ms into the best one (0 disables)")
+    args.add_argument("--track", dest='track', help="track layout YAML mapping decoder IDs to finish, sector and pit loops")
+    args.add_argument("--trace-dump", dest='trace_dump', help="write pass latency traces here on exit and SIGUSR1")
     cli_args = args.parse_args()
     config = Config(cli_args)
     return config
@@ -3,17 +3,28 @@ import codecs
 
 
 from sys import exit
+from time import perf_counter, time
 from . import records
+from . import metrics
 from .logs import Logg
 
 logger = Logg.create_logger('decoder')
 
+RECORDS_RECEIVED = metrics.counter('amb_records_received_total', 'P3 records read from the decoder socket')
+BYTES_RECEIVED = metrics.counter('amb_bytes_received_total', 'Bytes read from the decoder socket')
+RECORDS_DECODED = metrics.counter('amb_records_decoded_total', 'P3 records decoded, by type of record',
+                                   labelnames=('tor',))
+DECODE_ERRORS = metrics.counter('amb_decode_errors_total', 'P3 records with an unknown type or undecodable body')
+DECODE_SECONDS = metrics.histogram('amb_decode_seconds', 'Time spent in p3decode per record',
+                                   buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.01))
+
 
 class Connection:
     def __init__(self, ip, port):
         self.ip = ip
         self.port = port
         self.socket = socket.socket()
+        self.last_read_time = None  # Wall-clock time the last read() returned, for tracing
 
     def close(self):
         self.socket.close()
@@ -57,7 +68,11 @@ class Connection:
             logger.info("{}".format(msg))
             self.socket.close()
             exit(1)
-        return self.split_records(data)
+        self.last_read_time = time()
+        split_data = self.split_records(data)
+        BYTES_RECEIVED.inc(len(data))
+        RECORDS_RECEIVED.inc(len(split_data))
+        return split_data
 
     def write(self, data):
         try:
@@ -163,6 +178,7 @@ def p3decode(data):
             DECODED = {'TOR': tor_name}
         else:
             logger.error("{} record_type uknown".format(hex_tor))
+            DECODE_ERRORS.inc()
             return {'undecoded_tor_body': tor_body}
 
         general_fields = records.GENERAL
@@ -187,6 +203,7 @@ def p3decode(data):
                 hex_tor = codecs.encode(tor, 'hex')
                 hex_tor_body = tor_body.hex()
                 logger.error("DECODE FAILED. TOR: {}, TOR_BODY: {}".format(hex_tor, hex_tor_body))
+                DECODE_ERRORS.inc()
                 record_attr = "UNDECODED_"+one_byte_hex.decode()
 
             """record type is always followed by 1 byte representing the record length"""
@@ -205,17 +222,21 @@ def p3decode(data):
             hex_tor = codecs.encode(tor, 'hex')
             hex_tor_body = tor_body.hex()
             logger.error("DECODE FAILED. TOR: {}, TOR_BODY: {}".format(hex_tor, hex_tor_body))
+            DECODE_ERRORS.inc()
             return {'RESULT': {}}
 
     def _get_tor_body(data):
         tor_body = data[10:]
         return tor_body
 
+    started = perf_counter()
     data = _validate(data)
     if data is not None:
         decoded_header = _get_header(data)
         tor = decoded_header['TOR']
         decoded_body = _decode_body(tor, data)
+        DECODE_SECONDS.observe(perf_counter() - started)
+        RECORDS_DECODED.inc(tor=decoded_body['RESULT'].get('TOR', 'UNKNOWN'))
         return decoded_header, decoded_body
     else:
         return data, data
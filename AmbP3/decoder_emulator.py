@@ -0,0 +1,175 @@
+"""
+Emulated P3 decoder for offline and end-to-end testing.
+
+DecoderEmulator runs a simulated RTC clock, feeds TrafficGenerator records to
+every connected client as they become due, keeps the sent passings in a
+buffer by passing number and answers the commands of records.py: GET_TIME,
+PING, RESEND and CLEAR_PASSING. Responses can be delayed and connections
+dropped to exercise client reconnect and resend handling.
+"""
+import queue
+import random
+import socket
+import threading
+from time import sleep, monotonic
+from collections import OrderedDict
+from . import encoder
+from .decoder import p3decode
+from .logs import Logg
+
+logger = Logg.create_logger('decoder_emulator')
+
+DEFAULT_BUFFER_SIZE = 100000  # Passings kept for RESEND, like the decoder's passing memory
+RECV_SIZE = 4096
+
+
+class DecoderEmulator:
+    """
+    Serves generator (a TrafficGenerator) on ADDR:PORT. speed scales the RTC
+    clock, latency (+ up to jitter) seconds delays each command response, and
+    disconnect_after closes every connection that many seconds after it was
+    accepted.
+    """
+
+    def __init__(self, generator, ADDR='127.0.0.1', PORT=5403, speed=1.0, latency=0.0, jitter=0.0,
+                 disconnect_after=None, buffer_size=DEFAULT_BUFFER_SIZE, seed=None):
+        self.generator = generator
+        self.ADDR = ADDR
+        self.PORT = PORT
+        self.speed = speed
+        self.latency = latency
+        self.jitter = jitter
+        self.disconnect_after = disconnect_after
+        self.buffer_size = buffer_size
+        self.decoder_id = generator.decoder_id
+        self.start_rtc = generator.start_rtc
+        self.rng = random.Random(seed)
+        self.passings = OrderedDict()  # passing_number -> record, oldest first
+        self.clients = []  # Send queues of connected clients
+        self.lock = threading.Lock()
+        self.started = None
+        self.stopped = threading.Event()
+        self.socket = None
+
+    def rtc_time(self):
+        """Current decoder clock in microseconds"""
+        return self.start_rtc + int((monotonic() - self.started) * self.speed * 1_000_000)
+
+    def start(self):
+        """Bind, then accept clients and produce records in background threads"""
+        self.socket = socket.socket()
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.ADDR, self.PORT))
+        self.socket.listen(5)
+        self.PORT = self.socket.getsockname()[1]
+        self.started = monotonic()
+        for target in (self._produce, self._accept):
+            threading.Thread(target=target, daemon=True).start()
+        logger.info(f"Decoder emulator listening on {self.ADDR}:{self.PORT}")
+
+    def stop(self):
+        self.stopped.set()
+        self.socket.close()
+        with self.lock:
+            for client in self.clients:
+                client.put(None)
+
+    def _produce(self):
+        for frame in self.generator.frames():
+            delay = (frame.rtc_time - self.rtc_time()) / 1_000_000 / self.speed if self.speed > 0 else 0
+            if delay > 0 and self.stopped.wait(delay):
+                return
+            if self.stopped.is_set():
+                return
+            with self.lock:
+                if frame.kind == 'passing':
+                    self.passings[frame.passing_number] = frame.data
+                    if len(self.passings) > self.buffer_size:
+                        self.passings.popitem(last=False)
+                for client in self.clients:
+                    client.put(frame.data)
+
+    def _accept(self):
+        while not self.stopped.is_set():
+            try:
+                conn, addr = self.socket.accept()
+            except OSError:
+                return
+            logger.info(f"Accepted connection from {addr}")
+            client = queue.Queue()
+            with self.lock:
+                self.clients.append(client)
+            threading.Thread(target=self._send, args=(conn, addr, client), daemon=True).start()
+            threading.Thread(target=self._receive, args=(conn, client), daemon=True).start()
+
+    def _send(self, conn, addr, client):
+        deadline = None if self.disconnect_after is None else monotonic() + self.disconnect_after
+        try:
+            while True:
+                timeout = None if deadline is None else deadline - monotonic()
+                if timeout is not None and timeout <= 0:
+                    logger.info(f"Dropping connection from {addr}")
+                    break
+                try:
+                    data = client.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+                if data is None:
+                    break
+                conn.sendall(data)
+        except OSError as error:
+            logger.info(f"Connection from {addr} closed: {error}")
+        finally:
+            with self.lock:
+                self.clients.remove(client)
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.close()
+
+    def _receive(self, conn, client):
+        pending = b''
+        while True:
+            try:
+                data = conn.recv(RECV_SIZE)
+            except OSError:
+                return
+            if not data:
+                client.put(None)
+                return
+            pending += data
+            # EOR is always escaped inside a record, so every 0x8f ends one.
+            *records, pending = pending.split(bytes([encoder.EOR]))
+            for record in records:
+                start = record.find(bytes([encoder.SOR]))
+                if start >= 0:
+                    self._respond(record[start:] + bytes([encoder.EOR]), client)
+
+    def _respond(self, record, client):
+        decoded_header, decoded_body = p3decode(record)
+        result = decoded_body['RESULT'] if decoded_body else {}
+        tor = result.get('TOR')
+        if self.latency or self.jitter:
+            sleep(self.latency + self.rng.uniform(0, self.jitter))
+        if tor == 'GET_TIME':
+            responses = [encoder.get_time(self.rtc_time(), self.decoder_id)]
+        elif tor == 'PING':
+            responses = [encoder.reply(encoder.TOR_PING, self.decoder_id)]
+        elif tor == 'CLEAR_PASSING':
+            with self.lock:
+                self.passings.clear()
+            responses = [encoder.reply(encoder.TOR_CLEAR_PASSING, self.decoder_id)]
+        elif tor == 'RESEND':
+            if not result.get('FROM') or not result.get('UNTIL'):
+                responses = [encoder.error(encoder.ERROR_PARAMETERS_MISSING, self.decoder_id)]
+            else:
+                first, last = int(result['FROM'], 16), int(result['UNTIL'], 16)
+                with self.lock:
+                    responses = [data for number, data in self.passings.items() if first <= number <= last]
+        else:
+            logger.error(f"Unsupported command {tor}: {record.hex()}")
+            responses = [encoder.error(encoder.ERROR_TOR_UNKNOWN, self.decoder_id)]
+        logger.debug(f"{tor}: {len(responses)} records")
+        for response in responses:
+            client.put(response)
@@ -0,0 +1,112 @@
+"""
+Ingest-time merging of multi-hit passes.
+
+A transponder crossing the loop is often reported by several PASSING
+records a few milliseconds apart. PassDeduplicator groups the passes of a
+transponder that start within window_ms of the group's first pass and keeps
+the best one (highest STRENGTH, then HITS), so only one pass per crossing
+reaches the passes table. The others are returned for the discarded_passes
+side table. Each decoder reports its own passes, so groups are kept per
+(transponder, decoder): a crossing of another loop is never merged away.
+
+A group is closed when a pass of the same transponder falls outside its
+window, when any pass arrives more than window_ms later in decoder time, or
+when window_ms of wall-clock time passed without either (call expire()).
+
+Closed crossings are released in rtc_time order of their kept pass: a
+crossing is held while an open group could still keep an earlier pass, so
+readers that follow the passes table with an rtc_time watermark never skip
+a row that is committed late.
+"""
+import heapq
+from time import monotonic
+from itertools import count
+from collections import namedtuple, OrderedDict
+
+DEFAULT_WINDOW_MS = 500
+
+# kept: passes columns of the pass to insert; discarded: columns of the other passes of the crossing
+Crossing = namedtuple('Crossing', ['kept', 'discarded', 'trace'])
+
+
+def pass_quality(columns):
+    return columns.get('strength') or 0, columns.get('hits') or 0
+
+
+class _Group:
+    __slots__ = ('first_rtc', 'deadline', 'passes', 'traces')
+
+    def __init__(self, columns, trace, deadline):
+        self.first_rtc = columns['rtc_time']
+        self.deadline = deadline
+        self.passes = [columns]
+        self.traces = [trace]
+
+    def close(self):
+        best = max(range(len(self.passes)), key=lambda index: pass_quality(self.passes[index]))
+        discarded = [columns for index, columns in enumerate(self.passes) if index != best]
+        return Crossing(self.passes[best], discarded, self.traces[best])
+
+
+class PassDeduplicator:
+    """Per-transponder and decoder multi-hit window; a window_ms of 0 passes every pass through"""
+
+    def __init__(self, window_ms=DEFAULT_WINDOW_MS):
+        self.window_us = int(window_ms * 1000)
+        self.window_seconds = window_ms / 1000.0
+        self._open = OrderedDict()  # (transponder_id, decoder_id) -> _Group, oldest first
+        self._closed = []  # Heap of (kept rtc_time, sequence, Crossing) not released yet
+        self._sequence = count()
+
+    def add(self, columns, trace=None, now=None):
+        """
+        Feed the passes columns of one PASSING (see write.passing_columns).
+        Returns the Crossings released by it; trace is handed back with the kept pass.
+        """
+        if not self.window_us or 'transponder_id' not in columns or 'rtc_time' not in columns:
+            return [Crossing(columns, [], trace)]
+        now = monotonic() if now is None else now
+        rtc_time = columns['rtc_time']
+        closed = self._close(lambda key, group: rtc_time - group.first_rtc > self.window_us)
+        key = (columns['transponder_id'], columns.get('decoder_id'))
+        group = self._open.get(key)
+        if group is None:
+            self._open[key] = _Group(columns, trace, now + self.window_seconds)
+        else:
+            group.passes.append(columns)
+            group.traces.append(trace)
+        return self._release(closed)
+
+    def expire(self, now=None):
+        """Close groups whose window ran out in wall-clock time"""
+        if not self._open:
+            return self._release([])
+        now = monotonic() if now is None else now
+        return self._release(self._close(lambda key, group: now >= group.deadline))
+
+    def flush(self):
+        """Close every open group and release every crossing, e.g. on shutdown"""
+        return self._release(self._close(lambda key, group: True))
+
+    def _close(self, done):
+        closed = []
+        for key, group in list(self._open.items()):
+            if done(key, group):
+                del self._open[key]
+                closed.append(group.close())
+        return closed
+
+    def _release(self, closed):
+        """Crossings whose kept pass no open group can precede any more, oldest first"""
+        for crossing in closed:
+            heapq.heappush(self._closed, (crossing.kept['rtc_time'], next(self._sequence), crossing))
+        # An open group can only keep a pass at or after its first one.
+        horizon = min((group.first_rtc for group in self._open.values()), default=None)
+        released = []
+        while self._closed and (horizon is None or self._closed[0][0] < horizon):
+            released.append(heapq.heappop(self._closed)[2])
+        return released
+
+    def __len__(self):
+        """Open groups plus closed crossings held back for ordering"""
+        return len(self._open) + len(self._closed)
@@ -0,0 +1,160 @@
+"""
+P3 record encoding, the counterpart of decoder.p3decode.
+
+A record is SOR (0x8e), version, length (2 bytes), CRC (2 bytes), flags (2
+bytes), TOR (2 bytes), fields and EOR (0x8f). Every multi-byte value is little
+endian except the CRC. Fields are a tag byte, a length byte and the value.
+"""
+from . import crc16
+
+SOR = 0x8e
+EOR = 0x8f
+ESCAPE = 0x8d
+VERSION = 0x02
+HEADER_LENGTH = 10
+
+TOR_PASSING = 0x0001
+TOR_STATUS = 0x0002
+TOR_RESEND = 0x0004
+TOR_CLEAR_PASSING = 0x0005
+TOR_PING = 0x0020
+TOR_GET_TIME = 0x0024
+TOR_ERROR = 0xffff
+
+DECODER_ID = 0x81
+
+# PASSING fields: tag, value size in bytes
+PASSING_FIELDS = {
+    'PASSING_NUMBER': (0x01, 4),
+    'TRANSPONDER': (0x03, 4),
+    'RTC_TIME': (0x04, 8),
+    'STRENGTH': (0x05, 2),
+    'HITS': (0x06, 2),
+    'FLAGS': (0x08, 2),
+    'DECODER_ID': (DECODER_ID, 4),
+}
+
+STATUS_FIELDS = {
+    'NOISE': (0x01, 2),
+    'TEMPERATURE': (0x07, 2),
+    'INPUT_VOLTAGE': (0x0c, 1),
+    'GPS': (0x06, 1),
+    'DECODER_ID': (DECODER_ID, 4),
+}
+
+GET_TIME_FIELDS = {
+    'RTC_TIME': (0x01, 8),
+    'DECODER_ID': (DECODER_ID, 4),
+}
+
+RESEND_FIELDS = {
+    'FROM': (0x01, 4),
+    'UNTIL': (0x02, 4),
+    'DECODER_ID': (DECODER_ID, 4),
+}
+
+ERROR_FIELDS = {
+    'CODE': (0x01, 2),
+    'DECODER_ID': (DECODER_ID, 4),
+}
+
+ERROR_TOR_UNKNOWN = 0x0004
+ERROR_PARAMETERS_MISSING = 0x0005
+
+CRC_TABLE = crc16.table()
+
+
+def escape(frame):
+    "Escape 0x8d, 0x8e and 0x8f between SOR and EOR as 0x8d followed by the byte value plus 0x20"
+    escaped = bytearray([frame[0]])
+    for byte in frame[1:-1]:
+        if byte in (ESCAPE, SOR, EOR):
+            escaped.append(ESCAPE)
+            escaped.append(byte + 0x20)
+        else:
+            escaped.append(byte)
+    escaped.append(frame[-1])
+    return bytes(escaped)
+
+
+def unescape(frame):
+    "Reverse escape()"
+    unescaped = bytearray([frame[0]])
+    escaped = False
+    for byte in frame[1:-1]:
+        if escaped:
+            unescaped.append(byte - 0x20)
+            escaped = False
+        elif byte == ESCAPE:
+            escaped = True
+        else:
+            unescaped.append(byte)
+    unescaped.append(frame[-1])
+    return bytes(unescaped)
+
+
+def encode_fields(values, fields):
+    "Encode values (a dict of field name to int) in the order of fields, skipping missing ones"
+    body = bytearray()
+    for name, (tag, size) in fields.items():
+        if values.get(name) is not None:
+            body.append(tag)
+            body.append(size)
+            body += values[name].to_bytes(size, 'little')
+    return bytes(body)
+
+
+def crc(frame):
+    "CRC of an unescaped frame, computed with the CRC bytes zeroed"
+    frame = bytearray(frame)
+    frame[4:6] = b'\x00\x00'
+    return crc16.calc(frame.hex(), CRC_TABLE)
+
+
+def crc_ok(frame):
+    "True if the CRC in the header of an escaped frame matches its content"
+    frame = unescape(frame)
+    return len(frame) > HEADER_LENGTH and crc(frame) == int.from_bytes(frame[4:6], 'big')
+
+
+def p3encode(tor, body=b'', flags=0):
+    "Build an escaped record of type tor around an encoded body"
+    frame = bytearray([SOR, VERSION])
+    frame += (HEADER_LENGTH + len(body) + 1).to_bytes(2, 'little')
+    frame += b'\x00\x00'
+    frame += flags.to_bytes(2, 'little')
+    frame += tor.to_bytes(2, 'little')
+    frame += body
+    frame.append(EOR)
+    frame[4:6] = crc(frame).to_bytes(2, 'big')
+    return escape(frame)
+
+
+def passing(passing_number, transponder, rtc_time, strength=100, hits=20, flags=0, decoder_id=None):
+    values = {'PASSING_NUMBER': passing_number, 'TRANSPONDER': transponder, 'RTC_TIME': rtc_time,
+              'STRENGTH': strength, 'HITS': hits, 'FLAGS': flags, 'DECODER_ID': decoder_id}
+    return p3encode(TOR_PASSING, encode_fields(values, PASSING_FIELDS))
+
+
+def status(noise, temperature=22, input_voltage=118, gps=0, decoder_id=None):
+    values = {'NOISE': noise, 'TEMPERATURE': temperature, 'INPUT_VOLTAGE': input_voltage, 'GPS': gps,
+              'DECODER_ID': decoder_id}
+    return p3encode(TOR_STATUS, encode_fields(values, STATUS_FIELDS))
+
+
+def get_time(rtc_time, decoder_id=None):
+    return p3encode(TOR_GET_TIME, encode_fields({'RTC_TIME': rtc_time, 'DECODER_ID': decoder_id}, GET_TIME_FIELDS))
+
+
+def resend(first, last, decoder_id=None):
+    "Request the passings numbered first..last again"
+    return p3encode(TOR_RESEND, encode_fields({'FROM': first, 'UNTIL': last, 'DECODER_ID': decoder_id}, RESEND_FIELDS))
+
+
+def reply(tor, decoder_id=None):
+    "Acknowledge a command without data (PING, CLEAR_PASSING)"
+    return p3encode(tor, encode_fields({'DECODER_ID': decoder_id}, {'DECODER_ID': (DECODER_ID, 4)}))
+
+
+def error(code, decoder_id=None):
+    return p3encode(TOR_ERROR, encode_fields({'CODE': code, 'DECODER_ID': decoder_id}, ERROR_FIELDS))
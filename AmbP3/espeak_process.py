@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Long-lived espeak process for the voice announcer.
+
+espeak started without text reads its text from stdin and exits once it has
+spoken all of it. The next process is started while the current utterance is
+spoken, so its voice is already loaded when the next announcement comes, and
+say() returns when the process exits, i.e. when the speech has finished.
+Text is passed through a pipe, never through a shell.
+"""
+import subprocess
+from .logs import Logg
+
+SAY_TIMEOUT = 30.0  # Seconds an utterance may take before espeak is killed
+
+logger = Logg.create_logger('espeak_process')
+
+
+class EspeakProcess:
+    """Speaks one text per espeak process, keeping the next process started and ready"""
+
+    def __init__(self, voice='ja', command='espeak', timeout=SAY_TIMEOUT):
+        self.voice = voice
+        self.command = command
+        self.timeout = timeout
+        self._process = None
+
+    def _start(self):
+        self._process = subprocess.Popen(
+            [self.command, '-v', self.voice], stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            text=True, encoding='utf-8', bufsize=1)
+        logger.info(f"Started {self.command} (voice {self.voice}, pid {self._process.pid})")
+
+    def say(self, text):
+        """Speak text and wait until the speech has finished"""
+        line = ' '.join(text.split()) + '\n'
+        for attempt in range(2):
+            if self._process is None or self._process.poll() is not None:
+                self._start()
+            process, self._process = self._process, None
+            try:
+                process.stdin.write(line)
+                process.stdin.close()
+                break
+            except (BrokenPipeError, OSError) as e:
+                if attempt:
+                    raise
+                logger.warning(f"{self.command} exited ({e}), restarting")
+        # Load the voice for the next announcement while this one is spoken.
+        self._start()
+        try:
+            process.wait(timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"{self.command} did not finish speaking in {self.timeout}s, killing it")
+            process.kill()
+            process.wait()
+
+    def close(self):
+        if self._process is not None and self._process.poll() is None:
+            try:
+                self._process.stdin.close()
+                self._process.wait(timeout=5.0)
+            except (OSError, subprocess.TimeoutExpired):
+                self._process.kill()
+        self._process = None
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Compact, append-only lap history for a single transponder.
+Laps are stored column-wise in typed arrays (16 bytes per lap); the dict view
+used by the API is materialized only when a lap is actually requested.
+"""
+import json
+import threading
+from array import array
+from datetime import datetime, timezone
+from email.utils import format_datetime
+
+BLOCK_SIZE = 256  # Laps per serialized JSON block
+
+
+def _json_default(value):
+    """Serialize datetimes as HTTP dates (naive ones taken as UTC), like Flask's JSON provider"""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    """JSON exactly as flask.json.dumps writes it for the API"""
+    return json.dumps(value, default=_json_default, sort_keys=True)
+
+
+class LapHistory:
+    """Columns of lap time (seconds) and RTC time (microseconds) for one ponder"""
+
+    def __init__(self, ponder_id, car_number, dumps=dumps, block_size=BLOCK_SIZE):
+        self.ponder_id = ponder_id
+        self.car_number = car_number
+        self.dumps = dumps
+        self.block_size = block_size
+        self.lap_times = array('d')
+        self.rtc_times = array('q')
+        # JSON of every completed block. History never changes, so a block is serialized at most once.
+        self._json_blocks = []
+        self._json_lock = threading.Lock()
+
+    def append(self, lap_time, rtc_time):
+        """Add a lap and return its lap number"""
+        self.lap_times.append(lap_time)
+        self.rtc_times.append(rtc_time)
+        return len(self.lap_times)
+
+    def extend(self, lap_times, rtc_times):
+        """Add many laps at once, e.g. from NumPy arrays"""
+        self.lap_times.extend(array('d', lap_times))
+        self.rtc_times.extend(array('q', rtc_times))
+
+    def lap(self, index):
+        """Materialize the API dict for the lap at index (lap number index + 1)"""
+        return {
+            'lap_number': index + 1,
+            'lap_time': self.lap_times[index],
+            'timestamp': datetime.fromtimestamp(self.rtc_times[index] / 1000000.0),
+            'ponder_id': self.ponder_id,
+            'car_number': self.car_number
+        }
+
+    def __len__(self):
+        return len(self.lap_times)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self.lap(i) for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("lap index out of range")
+        return self.lap(item)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.lap(index)
+
+    def _block_json(self, block):
+        with self._json_lock:
+            while len(self._json_blocks) <= block:
+                first = len(self._json_blocks) * self.block_size
+                self._json_blocks.append(','.join(self.dumps(self.lap(i)) for i in range(first, first + self.block_size)))
+            return self._json_blocks[block]
+
+    def to_json(self, start=0, stop=None):
+        """JSON array of laps[start:stop], reusing the cached JSON of completed blocks.
+
+        Safe to call while another thread appends, as long as stop is at most the
+        length the caller observed.
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        parts = []
+        index = start
+        while index < stop:
+            block, offset = divmod(index, self.block_size)
+            block_end = (block + 1) * self.block_size
+            if offset == 0 and block_end <= stop:
+                parts.append(self._block_json(block))
+                index = block_end
+            else:
+                end = min(block_end, stop)
+                parts.extend(self.dumps(self.lap(i)) for i in range(index, end))
+                index = end
+        return '[' + ','.join(parts) + ']'
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Incremental lap statistics for a single transponder.
+Every update is O(1) regardless of how many laps were driven in the session.
+"""
+import math
+
+DEFAULT_WINDOW = 10
+
+
+class LapStats:
+    """Running mean/variance (Welford), moving average and best/worst lap"""
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # Sum of squared differences from the mean
+        self.best = float('inf')
+        self.worst = float('-inf')
+        self.latest = None
+        # Fixed-size ring buffer holding the last `window` laps for the moving average.
+        self._ring = [0.0] * window
+        self._ring_pos = 0
+        self._ring_len = 0
+        self._ring_sum = 0.0
+
+    @classmethod
+    def from_summary(cls, count, mean, m2, best, worst, recent, window=DEFAULT_WINDOW):
+        """Build statistics from precomputed aggregates, e.g. when loading history in bulk.
+
+        m2 is the sum of squared differences from the mean, recent the last laps in order.
+        """
+        stats = cls(window)
+        if count == 0:
+            return stats
+        stats.count = count
+        stats.mean = mean
+        stats.m2 = m2
+        stats.best = best
+        stats.worst = worst
+        recent = list(recent)[-window:]
+        stats.latest = recent[-1]
+        stats._ring[:len(recent)] = recent
+        stats._ring_len = len(recent)
+        stats._ring_pos = len(recent) % window
+        stats._ring_sum = sum(recent)
+        return stats
+
+    def update(self, lap_time):
+        """Add a lap time (seconds) to the statistics"""
+        self.count += 1
+        delta = lap_time - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (lap_time - self.mean)
+
+        if lap_time < self.best:
+            self.best = lap_time
+        if lap_time > self.worst:
+            self.worst = lap_time
+        self.latest = lap_time
+
+        if self._ring_len == self.window:
+            self._ring_sum -= self._ring[self._ring_pos]
+        else:
+            self._ring_len += 1
+        self._ring[self._ring_pos] = lap_time
+        self._ring_sum += lap_time
+        self._ring_pos = (self._ring_pos + 1) % self.window
+
+    @property
+    def std_dev(self):
+        """Population standard deviation of all laps (same as np.std)"""
+        if self.count == 0:
+            return None
+        if self.count == 1:
+            return 0.0
+        return math.sqrt(self.m2 / self.count)
+
+    @property
+    def moving_avg(self):
+        """Average of the last `window` laps, or of all laps if fewer"""
+        if self._ring_len == 0:
+            return None
+        return self._ring_sum / self._ring_len
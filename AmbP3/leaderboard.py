@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+Latest lap per transponder, ordered by recency.
+Updating a transponder moves it to the front in O(1).
+"""
+from collections import OrderedDict
+
+
+class LatestLaps:
+    """Ordered mapping of transponder id -> latest lap record, newest first"""
+
+    def __init__(self):
+        self._laps = OrderedDict()  # Oldest first, newest at the end
+        self._snapshot = ()
+
+    def update(self, ponder_id, lap_record):
+        """Store the ponder's latest lap and move it to the top"""
+        self._laps[ponder_id] = lap_record
+        self._laps.move_to_end(ponder_id)
+        self._snapshot = None
+
+    def remove(self, ponder_id):
+        if self._laps.pop(ponder_id, None) is not None:
+            self._snapshot = None
+
+    def clear(self):
+        self._laps.clear()
+        self._snapshot = ()
+
+    def snapshot(self):
+        """Immutable tuple of lap records, newest first.
+
+        The tuple is built once per change and shared by every reader until the
+        next update, so serving it does not copy the list on each request.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = tuple(reversed(self._laps.values()))
+            self._snapshot = snapshot
+        return snapshot
+
+    def get(self, ponder_id):
+        return self._laps.get(ponder_id)
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __len__(self):
+        return len(self._laps)
+
+    def __contains__(self, ponder_id):
+        return ponder_id in self._laps
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Durable per-transponder operator settings (voice toggle, nickname).
+Settings live in an append-only JSON-lines file that is loaded at startup
+independently of lap history. Writes are queued and flushed in batches by a
+background thread, so request handlers never wait for disk I/O.
+"""
+import os
+import json
+import queue
+import threading
+from time import sleep
+from .logs import Logg
+
+FLUSH_INTERVAL = 0.5  # Seconds a write may wait so that bursts are written together
+COMPACT_RATIO = 4     # Rewrite the file when it holds this many lines per transponder
+COMPACT_MIN_LINES = 1000  # ... and at least this many lines, so small files are not rewritten on every write
+
+logger = Logg.create_logger('operator_state')
+
+
+class OperatorState:
+    """Settings per transponder id, persisted to an append-only log"""
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.settings = {}
+        self._pending = queue.Queue()
+        self._lines = 0
+        self.load()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def load(self):
+        """Replay the log into self.settings; later lines override earlier ones"""
+        self.settings = {}
+        self._lines = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as log_file:
+                for line in log_file:
+                    try:
+                        entry = json.loads(line)
+                        transponder_id = int(entry.pop('transponder_id'))
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        # A torn last line from a crash is skipped, not fatal.
+                        logger.error(f"Skipping bad operator state line: {line!r}")
+                        continue
+                    self.settings.setdefault(transponder_id, {}).update(entry)
+                    self._lines += 1
+        except FileNotFoundError:
+            pass
+        if self._needs_compact():
+            self.compact()
+        return self.settings
+
+    def _needs_compact(self):
+        return self._lines > max(COMPACT_MIN_LINES, COMPACT_RATIO * len(self.settings))
+
+    def get(self, transponder_id):
+        return self.settings.get(transponder_id, {})
+
+    def set(self, transponder_id, **values):
+        """Update settings in memory and queue them for the next batched write"""
+        self.settings.setdefault(transponder_id, {}).update(values)
+        self._pending.put({'transponder_id': transponder_id, **values})
+
+    def compact(self):
+        """Rewrite the log with one line per transponder"""
+        tmp_path = f"{self.path}.tmp"
+        # set() may run meanwhile; whatever it changes is also queued and appended after this.
+        settings = [(transponder_id, dict(values)) for transponder_id, values in list(self.settings.items())]
+        with open(tmp_path, 'w', encoding='utf-8') as tmp_file:
+            for transponder_id, values in settings:
+                tmp_file.write(json.dumps({'transponder_id': transponder_id, **values}, ensure_ascii=False) + '\n')
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, self.path)
+        self._lines = len(settings)
+
+    def flush(self):
+        """Block until every queued write has reached the file"""
+        self._pending.join()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._pending.get()]
+            # Collect whatever else arrives shortly after, and write it all at once.
+            sleep(self.flush_interval)
+            while True:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, 'a', encoding='utf-8') as log_file:
+                    log_file.write(''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in batch))
+                    log_file.flush()
+                    os.fsync(log_file.fileno())
+                self._lines += len(batch)
+                if self._needs_compact():
+                    self.compact()
+            except OSError as e:
+                logger.error(f"Failed to write operator state to {self.path}: {e}")
+            finally:
+                for _ in batch:
+                    self._pending.task_done()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Cache of pre-serialized API responses keyed by data version.
+A body is serialized (and gzipped) once per version and then served as-is
+to every client until the underlying data changes.
+"""
+import gzip
+import os
+import threading
+from collections import namedtuple
+
+GZIP_MIN_SIZE = 1024  # Smaller bodies are not worth compressing
+GZIP_LEVEL = 6
+
+CachedResponse = namedtuple('CachedResponse', ['version', 'etag', 'body', 'gzip_body'])
+
+
+class ResponseCache:
+    """Stores one serialized body per key, rebuilt only when the version changes"""
+
+    def __init__(self, gzip_min_size=GZIP_MIN_SIZE):
+        self.gzip_min_size = gzip_min_size
+        # Different on every start so clients never match an ETag from a previous run.
+        self.boot_id = os.urandom(4).hex()
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version, build):
+        """Return the CachedResponse for key at version, calling build() -> bytes on a miss.
+
+        A key of None builds a one-off response (e.g. for ad-hoc query parameters) that
+        still carries a version ETag but is not stored.
+        """
+        etag = f"{self.boot_id}-{version}"
+        entry = self._entries.get(key) if key is not None else None
+        if entry is not None and entry.etag == etag:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        body = build()
+        gzip_body = gzip.compress(body, GZIP_LEVEL) if len(body) >= self.gzip_min_size else None
+        entry = CachedResponse(version, etag, body, gzip_body)
+        if key is None:
+            return entry
+        with self._lock:
+            current = self._entries.get(key)
+            # Never replace a newer entry built concurrently by another request,
+            # unless it was built before reset() adopted a different boot id.
+            if current is None or current.version <= version or not current.etag.startswith(f"{self.boot_id}-"):
+                self._entries[key] = entry
+        return entry
+
+    def reset(self, boot_id=None):
+        """Drop every entry, optionally adopting another process' boot id (e.g. the aggregator's)"""
+        with self._lock:
+            self._entries = {}
+            if boot_id is not None:
+                self.boot_id = boot_id
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
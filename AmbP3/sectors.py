@@ -0,0 +1,275 @@
+"""
+Multi-loop sector and split timing.
+
+A TrackLayout maps decoder IDs to loops: the start/finish line, sector
+loops in the order they are driven, and pit-in/pit-out loops. It is read
+from a YAML file:
+
+    loops:
+      - {decoder_id: 0x00041813, type: finish}
+      - {decoder_id: 0x00041814, type: sector, name: S1}
+      - {decoder_id: 0x00041815, type: sector, name: S2}
+      - {decoder_id: 0x00041816, type: pit_in}
+      - {decoder_id: 0x00041817, type: pit_out}
+
+Loop positions are 0 for the finish and 1..n for the sectors; split k runs
+from position k to position k + 1 (the finish again after the last sector).
+Crossings are interpreted with these rules:
+
+  - a crossing of the same loop as the car's previous one less than
+    min_lap_time later is a duplicate and ignored
+  - a lap runs from one finish crossing to the next; it is invalid if the
+    car went backwards in between (a sector at or before the previous one),
+    which means a finish crossing was missed
+  - a split is timed when the car crosses the next loop in order; skipped
+    loops leave the splits around them empty
+  - a lap during which the car crossed a pit loop, or that started in the
+    pit lane, is a pit lap and does not count for best laps and splits
+
+SectorTimer applies them live in O(1) per pass; recompute() applies the
+same rules to a whole heat with NumPy.
+"""
+from collections import namedtuple
+import numpy as np
+import yaml
+
+FINISH = 'finish'
+SECTOR = 'sector'
+PIT_IN = 'pit_in'
+PIT_OUT = 'pit_out'
+LOOP_TYPES = (FINISH, SECTOR, PIT_IN, PIT_OUT)
+DEFAULT_MIN_LAP_TIME = 10.0
+
+Split = namedtuple('Split', ['transponder_id', 'rtc_time', 'index', 'split_time', 'pit'])
+Lap = namedtuple('Lap', ['transponder_id', 'rtc_time', 'lap_time', 'splits', 'pit'])
+PitEvent = namedtuple('PitEvent', ['transponder_id', 'rtc_time', 'kind'])
+
+
+class TrackLayout:
+    def __init__(self, loops):
+        """loops: dicts with decoder_id, type and an optional name, sector loops in driving order"""
+        self.positions = {}  # decoder_id -> 0 for the finish, 1..n for sectors
+        self.pit_loops = {}  # decoder_id -> PIT_IN or PIT_OUT
+        loop_names = ['finish']
+        for loop in loops:
+            decoder_id, loop_type = int(loop['decoder_id']), loop['type']
+            if loop_type not in LOOP_TYPES:
+                raise ValueError(f"Unknown loop type {loop_type} for decoder {decoder_id}")
+            if decoder_id in self.positions or decoder_id in self.pit_loops:
+                raise ValueError(f"Decoder {decoder_id} is listed twice")
+            if loop_type == FINISH:
+                self.positions[decoder_id] = 0
+            elif loop_type == SECTOR:
+                self.positions[decoder_id] = len(loop_names)
+                loop_names.append(loop.get('name', f"S{len(loop_names)}"))
+            else:
+                self.pit_loops[decoder_id] = loop_type
+        if 0 not in self.positions.values():
+            raise ValueError("The track layout needs a finish loop")
+        self.sectors = len(loop_names) - 1
+        self.split_names = [f"{loop_names[index]}-{loop_names[(index + 1) % len(loop_names)]}"
+                            for index in range(len(loop_names))]
+        self.finish_decoder_ids = sorted(decoder_id for decoder_id, position in self.positions.items()
+                                         if position == 0)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as layout_file:
+            return cls(yaml.safe_load(layout_file)['loops'])
+
+    @property
+    def splits(self):
+        return self.sectors + 1
+
+
+class _Car:
+    __slots__ = ('raw_position', 'raw_time', 'position', 'position_time', 'lap_start', 'valid', 'splits', 'pit',
+                 'in_pit', 'last_lap', 'best_lap', 'best_splits')
+
+    def __init__(self, splits):
+        self.raw_position = self.raw_time = None  # Previous crossing, duplicates included
+        self.position = self.position_time = None  # Previous crossing that counted
+        self.lap_start = None
+        self.valid = False
+        self.splits = [None] * splits
+        self.pit = False
+        self.in_pit = False
+        self.last_lap = None
+        self.best_lap = None
+        self.best_splits = [None] * splits
+
+
+class SectorTimer:
+    """Per-transponder state machine over the crossings of every loop"""
+
+    def __init__(self, layout, min_lap_time=DEFAULT_MIN_LAP_TIME):
+        self.layout = layout
+        self.min_lap_us = int(min_lap_time * 1000000)
+        self.cars = {}
+
+    def update(self, transponder_id, decoder_id, rtc_time):
+        """Feed one pass in RTC order; returns the Split, Lap and PitEvent it produced"""
+        car = self.cars.get(transponder_id)
+        if car is None:
+            car = self.cars[transponder_id] = _Car(self.layout.splits)
+        pit_kind = self.layout.pit_loops.get(decoder_id)
+        if pit_kind is not None:
+            car.in_pit = pit_kind == PIT_IN
+            car.pit = True
+            return [PitEvent(transponder_id, rtc_time, pit_kind)]
+        position = self.layout.positions.get(decoder_id)
+        if position is None:
+            return []
+        duplicate = position == car.raw_position and rtc_time - car.raw_time < self.min_lap_us
+        car.raw_position, car.raw_time = position, rtc_time
+        if duplicate:
+            return []
+
+        events = []
+        if car.position is not None:
+            if position == (car.position + 1) % self.layout.splits:
+                split_time = (rtc_time - car.position_time) / 1000000.0
+                car.splits[car.position] = split_time
+                events.append(Split(transponder_id, rtc_time, car.position, split_time, car.pit))
+            elif position != 0 and position <= car.position:
+                car.valid = False
+        if position == 0:
+            if car.lap_start is not None and car.valid:
+                events.append(self._complete_lap(transponder_id, car, rtc_time))
+            car.lap_start, car.valid, car.pit = rtc_time, True, car.in_pit
+            car.splits = [None] * self.layout.splits
+        car.position, car.position_time = position, rtc_time
+        return events
+
+    def _complete_lap(self, transponder_id, car, rtc_time):
+        lap = Lap(transponder_id, rtc_time, (rtc_time - car.lap_start) / 1000000.0, tuple(car.splits), car.pit)
+        car.last_lap = lap
+        if not lap.pit:
+            if car.best_lap is None or lap.lap_time < car.best_lap:
+                car.best_lap = lap.lap_time
+            for index, split_time in enumerate(lap.splits):
+                if split_time is not None and (car.best_splits[index] is None or split_time < car.best_splits[index]):
+                    car.best_splits[index] = split_time
+        return lap
+
+    def theoretical_best(self, transponder_id):
+        """Sum of the car's best splits, or None until every split was timed on a non-pit lap"""
+        car = self.cars.get(transponder_id)
+        if car is None or None in car.best_splits:
+            return None
+        return sum(car.best_splits)
+
+    def summary(self, transponder_id):
+        """JSON-ready state of one car, or None if it was never seen"""
+        car = self.cars.get(transponder_id)
+        if car is None:
+            return None
+        names = self.layout.split_names
+        return {
+            'transponder_id': transponder_id,
+            'in_pit': car.in_pit,
+            'current_splits': dict(zip(names, car.splits)),
+            'last_lap': None if car.last_lap is None else {
+                'lap_time': car.last_lap.lap_time, 'pit': car.last_lap.pit,
+                'splits': dict(zip(names, car.last_lap.splits))},
+            'best_lap': car.best_lap,
+            'best_splits': dict(zip(names, car.best_splits)),
+            'theoretical_best': self.theoretical_best(transponder_id),
+        }
+
+
+def _previous(values, same_car):
+    """values shifted by one row; rows starting a car get -1"""
+    previous = np.r_[-1, values[:-1]]
+    previous[~same_car] = -1
+    return previous
+
+
+def _fill_forward(rows, count):
+    """Index of the latest row in rows at or before every position, -1 before the first"""
+    marks = np.full(count, -1, dtype=np.int64)
+    marks[rows] = rows
+    return np.maximum.accumulate(marks)
+
+
+def recompute(layout, transponder_ids, decoder_ids, rtc_times, min_lap_time=DEFAULT_MIN_LAP_TIME):
+    """
+    Laps of a whole heat with the same rules as SectorTimer, without a Python loop per pass.
+    Returns {column: array}: transponder_id, rtc_time, lap_time, pit and splits
+    (one row per lap, one column per split, NaN where not timed).
+    """
+    transponder_ids, decoder_ids, rtc_times = (np.asarray(values, dtype=np.int64)
+                                               for values in (transponder_ids, decoder_ids, rtc_times))
+    known_ids = np.array(sorted(layout.positions) + sorted(layout.pit_loops), dtype=np.int64)
+    kinds = np.array([layout.positions[decoder_id] for decoder_id in sorted(layout.positions)]
+                     + [-1 if layout.pit_loops[decoder_id] == PIT_IN else -2 for decoder_id in sorted(layout.pit_loops)],
+                     dtype=np.int64)  # Position, -1 for pit in and -2 for pit out
+    order = np.argsort(known_ids)
+    known_ids, kinds = known_ids[order], kinds[order]
+    index = np.minimum(np.searchsorted(known_ids, decoder_ids), len(known_ids) - 1)
+    known = known_ids[index] == decoder_ids
+    order = np.lexsort((rtc_times[known], transponder_ids[known]))
+    cars, times, kinds = transponder_ids[known][order], rtc_times[known][order], kinds[index[known]][order]
+    count = len(cars)
+    same_car = np.r_[False, cars[1:] == cars[:-1]]
+
+    # Duplicates are judged against the previous loop crossing, ignoring pit loops.
+    loop_rows = np.flatnonzero(kinds >= 0)
+    loop_same_car = np.r_[False, cars[loop_rows][1:] == cars[loop_rows][:-1]]
+    previous_kind = _previous(kinds[loop_rows], loop_same_car)
+    previous_time = np.r_[0, times[loop_rows][:-1]]
+    duplicate = (kinds[loop_rows] == previous_kind) & (times[loop_rows] - previous_time < min_lap_time * 1000000)
+    rows = loop_rows[~duplicate]  # Crossings that count, in (car, time) order
+    positions, row_times, row_cars = kinds[rows], times[rows], cars[rows]
+    row_same_car = np.r_[False, row_cars[1:] == row_cars[:-1]]
+    previous_position = _previous(positions, row_same_car)
+
+    # A segment starts at every finish crossing and at the first crossing of every car.
+    finish = positions == 0
+    segments = np.cumsum(finish | ~row_same_car) - 1
+    segment_count = segments[-1] + 1 if len(segments) else 0
+    segment_first = np.flatnonzero(finish | ~row_same_car)
+    backward = (positions != 0) & (previous_position >= 0) & (positions <= previous_position)
+    segment_valid = finish[segment_first] & (np.bincount(segments[backward], minlength=segment_count) == 0)
+
+    # Pit crossings mark the segment they fall into; a finish crossed in the pit lane marks the new one.
+    segment_of_row = np.full(count, -1, dtype=np.int64)
+    segment_of_row[rows] = segments
+    last_row = _fill_forward(rows, count)
+    pit_rows = np.flatnonzero(kinds < 0)
+    segment_pit = np.zeros(segment_count, dtype=bool)
+    in_segment = (last_row[pit_rows] >= 0) & (cars[np.maximum(last_row[pit_rows], 0)] == cars[pit_rows])
+    segment_pit[segment_of_row[last_row[pit_rows[in_segment]]]] = True
+    last_pit = _fill_forward(pit_rows, count)[rows[finish]]
+    in_pit = (last_pit >= 0) & (cars[np.maximum(last_pit, 0)] == row_cars[finish]) & (kinds[last_pit] == -1)
+    segment_pit[segments[finish]] |= in_pit
+
+    # Splits between consecutive loops in order belong to the segment of the earlier crossing.
+    split_rows = np.flatnonzero((previous_position >= 0) & (positions == (previous_position + 1) % layout.splits))
+    splits = np.full((segment_count, layout.splits), np.nan)
+    splits[segments[split_rows - 1], previous_position[split_rows]] = \
+        (row_times[split_rows] - row_times[split_rows - 1]) / 1000000.0
+
+    # A lap ends at a finish crossing and covers the segment of the crossing before it.
+    lap_ends = np.flatnonzero(finish & row_same_car)
+    lap_segments = segments[lap_ends - 1]
+    lap_ends, lap_segments = lap_ends[segment_valid[lap_segments]], lap_segments[segment_valid[lap_segments]]
+    return {'transponder_id': row_cars[lap_ends], 'rtc_time': row_times[lap_ends],
+            'lap_time': (row_times[lap_ends] - row_times[segment_first[lap_segments]]) / 1000000.0,
+            'pit': segment_pit[lap_segments], 'splits': splits[lap_segments]}
+
+
+def best_times(layout, laps):
+    """
+    Best lap, best splits and theoretical best (sum of the best splits) per
+    transponder from recompute() laps, pit laps excluded: {column: array}.
+    """
+    clean = ~laps['pit']
+    transponder_ids, groups = np.unique(laps['transponder_id'][clean], return_inverse=True)
+    best_lap = np.full(len(transponder_ids), np.inf)
+    np.minimum.at(best_lap, groups, laps['lap_time'][clean])
+    best_splits = np.full((len(transponder_ids), layout.splits), np.inf)
+    np.fmin.at(best_splits, groups, laps['splits'][clean])
+    best_splits[np.isinf(best_splits)] = np.nan
+    return {'transponder_id': transponder_ids, 'best_lap': best_lap, 'best_splits': best_splits,
+            'theoretical_best': best_splits.sum(axis=1)}
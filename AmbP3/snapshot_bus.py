@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+"""
+Local message bus between the web_app aggregator and its serving workers.
+
+The aggregator (BusPublisher) owns the lap computation. Every worker
+(BusSubscriber) receives a full state message when it connects and then
+the stream of deltas, so it can serve the API from its own copy of the data.
+Workers send operator commands (e.g. nickname changes) back to the aggregator.
+
+Messages are length-prefixed pickles, so anyone who can connect can run code
+in the aggregator and its workers. The bus is meant for processes on the same
+host that trust each other: use a Unix socket path or a loopback TCP address.
+Other TCP addresses are refused unless allow_remote is set.
+"""
+import os
+import ipaddress
+import pickle
+import queue
+import socket
+import struct
+import threading
+from time import sleep
+from .logs import Logg
+
+HEADER = struct.Struct('!I')
+DEFAULT_PEER_QUEUE = 1024  # Messages buffered per worker before it is dropped and has to resync
+RECONNECT_DELAY = 1.0
+
+logger = Logg.create_logger('snapshot_bus')
+
+
+def parse_address(address, allow_remote=False):
+    """
+    'host:port' is a TCP address, anything else a Unix socket path.
+    Raises ValueError for a TCP host that is not loopback, unless allow_remote.
+    """
+    host, sep, port = address.rpartition(':')
+    if not (sep and port.isdigit()):
+        return socket.AF_UNIX, address
+    host = host or '127.0.0.1'
+    if not allow_remote:
+        resolved = {info[4][0] for info in socket.getaddrinfo(host, int(port), socket.AF_INET, socket.SOCK_STREAM)}
+        if not all(ipaddress.ip_address(ip).is_loopback for ip in resolved):
+            raise ValueError(f"bus address {address} is not loopback; the bus unpickles what it receives, "
+                             "so remote addresses must be allowed explicitly")
+    return socket.AF_INET, (host, int(port))
+
+
+def send_frame(sock, payload):
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("bus connection closed")
+        data.extend(chunk)
+    return bytes(data)
+
+
+def recv_frame(sock):
+    size, = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+    return _recv_exactly(sock, size)
+
+
+class _Peer:
+    """A connected worker: a bounded send queue drained by its own thread"""
+
+    def __init__(self, sock, queue_size):
+        self.sock = sock
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.closed = False
+
+    def put(self, payload):
+        try:
+            self.queue.put_nowait(payload)
+        except queue.Full:
+            logger.error("Bus worker fell behind, dropping it so it resyncs")
+            self.close()
+
+    def send_loop(self):
+        try:
+            while not self.closed:
+                payload = self.queue.get()
+                if payload is None:
+                    break
+                send_frame(self.sock, payload)
+        except OSError:
+            pass
+        self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+            try:
+                self.queue.put_nowait(None)  # Wake up the send loop
+            except queue.Full:
+                pass
+
+
+class BusPublisher:
+    """
+    Aggregator side of the bus.
+
+    initial_message() builds the full state for a newly connected worker. It is called
+    with state_lock held, and publish() must also be called with state_lock held, so a
+    worker never misses or double-applies a delta around its initial state.
+    """
+
+    def __init__(self, address, initial_message, state_lock, on_command=None, queue_size=DEFAULT_PEER_QUEUE,
+                 allow_remote=False):
+        self.address = address
+        self.allow_remote = allow_remote
+        self.initial_message = initial_message
+        self.state_lock = state_lock
+        self.on_command = on_command
+        self.queue_size = queue_size
+        self._peers = ()  # Replaced, never mutated, so publish() can iterate without locking
+        self._peers_lock = threading.Lock()
+
+    def start(self):
+        family, bind_address = parse_address(self.address, self.allow_remote)
+        if family == socket.AF_UNIX and os.path.exists(bind_address):
+            os.unlink(bind_address)
+        self._server = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(bind_address)
+        self._server.listen()
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        logger.info(f"Bus publisher listening on {self.address}")
+
+    def publish(self, message):
+        """Send message to every connected worker. Pickled once, queued per worker."""
+        peers = self._peers
+        if not peers:
+            return
+        payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+        for peer in peers:
+            peer.put(payload)
+
+    def _accept_loop(self):
+        while True:
+            sock, _ = self._server.accept()
+            peer = _Peer(sock, self.queue_size)
+            with self.state_lock:
+                peer.put(pickle.dumps(self.initial_message(), protocol=pickle.HIGHEST_PROTOCOL))
+                with self._peers_lock:
+                    self._peers = self._peers + (peer,)
+            threading.Thread(target=peer.send_loop, daemon=True).start()
+            threading.Thread(target=self._read_loop, args=(peer,), daemon=True).start()
+
+    def _read_loop(self, peer):
+        try:
+            while not peer.closed:
+                command = pickle.loads(recv_frame(peer.sock))
+                if self.on_command is not None:
+                    self.on_command(command)
+        except (OSError, ConnectionError, pickle.UnpicklingError):
+            pass
+        except Exception as e:
+            logger.error(f"Error handling bus command: {e}")
+        peer.close()
+        with self._peers_lock:
+            self._peers = tuple(p for p in self._peers if p is not peer)
+
+    def __len__(self):
+        return len(self._peers)
+
+
+class BusSubscriber:
+    """Worker side of the bus: applies every received message via on_message, reconnecting as needed"""
+
+    def __init__(self, address, on_message, reconnect_delay=RECONNECT_DELAY, allow_remote=False):
+        self.address = address
+        self.family, self.connect_address = parse_address(address, allow_remote)
+        self.on_message = on_message
+        self.reconnect_delay = reconnect_delay
+        self.connected = False
+        self._sock = None
+        self._send_lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def send(self, command):
+        """Send a command to the aggregator. Returns False if it is not reachable right now."""
+        payload = pickle.dumps(command, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._send_lock:
+            if self._sock is None:
+                return False
+            try:
+                send_frame(self._sock, payload)
+                return True
+            except OSError:
+                return False
+
+    def _run(self):
+        while True:
+            sock = socket.socket(self.family, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.connect_address)
+                self._sock = sock
+                self.connected = True
+                logger.info(f"Connected to bus {self.address}")
+                while True:
+                    self.on_message(pickle.loads(recv_frame(sock)))
+            except (OSError, ConnectionError) as e:
+                if self.connected:
+                    logger.error(f"Lost bus connection {self.address}: {e}")
+            except Exception as e:
+                logger.error(f"Error applying bus message: {e}")
+            with self._send_lock:
+                self._sock = None
+            self.connected = False
+            sock.close()
+            sleep(self.reconnect_delay)
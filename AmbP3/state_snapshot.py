@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""
+On-disk snapshots of the web_app lap store for fast warm starts.
+A snapshot holds the per-transponder lap columns plus the watermark (last
+processed RTC time); on startup only passes after the watermark are read from
+the database.
+"""
+import os
+import pickle
+import tempfile
+from .logs import Logg
+
+SNAPSHOT_FORMAT = 1
+
+logger = Logg.create_logger('state_snapshot')
+
+
+def write_snapshot(path, state):
+    """Atomically write state (a dict) to path, so a crash never leaves a torn snapshot"""
+    state = {'format': SNAPSHOT_FORMAT, **state}
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            pickle.dump(state, tmp_file, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_snapshot(path):
+    """Return the snapshot dict, or None if it is missing, unreadable or of another format"""
+    try:
+        with open(path, 'rb') as snapshot_file:
+            state = pickle.load(snapshot_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+        logger.error(f"Ignoring unreadable snapshot {path}: {e}")
+        return None
+    if not isinstance(state, dict) or state.get('format') != SNAPSHOT_FORMAT:
+        logger.error(f"Ignoring snapshot {path} with unknown format")
+        return None
+    return state
@@ -0,0 +1,158 @@
+"""
+Per-pass latency tracing.
+
+Every pass is traced under the key (transponder_id, rtc_time), which both
+amb_client and web_app know, and each process stamps the stages it handles
+with wall-clock time:
+
+    receive    Connection.read returned the record (amb_client)
+    decode     p3decode finished (amb_client)
+    db_commit  the pass was inserted into MySQL (amb_client)
+    updater    web_app's updater picked the pass up
+    api_serve  the first API response containing the lap was sent
+    voice      playback of the lap's announcement started
+
+Traces are kept in a bounded ring buffer per process. dump() writes them as
+JSON lines; amb_trace.py merges the dumps of both processes and reports
+per-stage latency percentiles.
+"""
+import json
+import atexit
+import signal
+import threading
+from time import time
+from collections import OrderedDict
+
+STAGES = ('receive', 'decode', 'db_commit', 'updater', 'api_serve', 'voice')
+# The stage each one follows; the dashboard and the voice are parallel branches after the updater.
+PREVIOUS_STAGE = {'decode': 'receive', 'db_commit': 'decode', 'updater': 'db_commit', 'api_serve': 'updater',
+                  'voice': 'updater'}
+DEFAULT_CAPACITY = 10000
+MAX_UNSERVED = 1000  # Published versions waiting for an API response; older ones are forgotten
+
+
+class Tracer:
+    """Stage timestamps of the most recent capacity passes"""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._traces = OrderedDict()  # (transponder_id, rtc_time) -> {stage: timestamp}
+        self._lock = threading.Lock()
+        self._unserved = []  # (data version, keys) published but not yet in an API response
+
+    def mark(self, key, stage, timestamp=None):
+        """Record stage for key; only the first time a stage is reached counts"""
+        timestamp = time() if timestamp is None else timestamp
+        with self._lock:
+            self._stamp(key, stage, timestamp)
+
+    def _stamp(self, key, stage, timestamp):
+        trace = self._traces.get(key)
+        if trace is None:
+            trace = self._traces[key] = {}
+            if len(self._traces) > self.capacity:
+                self._traces.popitem(last=False)
+        trace.setdefault(stage, timestamp)
+
+    def published(self, version, keys):
+        """keys became visible in data version; the next response serving that version marks api_serve"""
+        if keys:
+            with self._lock:
+                self._unserved.append((version, list(keys)))
+                del self._unserved[:-MAX_UNSERVED]
+
+    def served(self, version):
+        """An API response for data version was sent"""
+        if not self._unserved:  # Checked without the lock; the common case costs nothing
+            return
+        timestamp = time()
+        with self._lock:
+            still_unserved = []
+            for published_version, keys in self._unserved:
+                if published_version > version:
+                    still_unserved.append((published_version, keys))
+                    continue
+                for key in keys:
+                    self._stamp(key, 'api_serve', timestamp)
+            self._unserved = still_unserved
+
+    def traces(self):
+        with self._lock:
+            return [{'key': list(key), 'stages': dict(stages)} for key, stages in self._traces.items()]
+
+    def dump(self, path):
+        traces = self.traces()
+        with open(path, 'w') as dump_file:
+            for trace in traces:
+                dump_file.write(json.dumps(trace) + '\n')
+        return len(traces)
+
+
+TRACER = Tracer()
+
+
+def mark(key, stage, timestamp=None):
+    TRACER.mark(key, stage, timestamp)
+
+
+def dump_on_exit(path):
+    """Dump TRACER to path when the process exits and whenever it receives SIGUSR1"""
+    atexit.register(TRACER.dump, path)
+    if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+        # The handler runs on the main thread, possibly inside mark() holding the lock, so dump elsewhere.
+        signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(
+            target=TRACER.dump, args=(path,), name='trace-dump', daemon=True).start())
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def merge(trace_lists):
+    """Combine traces of the same pass from several processes"""
+    merged = {}
+    for traces in trace_lists:
+        for trace in traces:
+            stages = merged.setdefault(tuple(trace['key']), {})
+            for stage, timestamp in trace['stages'].items():
+                stages[stage] = min(timestamp, stages.get(stage, timestamp))
+    return merged
+
+
+def stage_latencies(merged):
+    """
+    Seconds from the closest earlier stage present in the same trace to each
+    stage, and from receive to every later stage: ({(from, to): [seconds]}, {to: [seconds]})
+    """
+    hops, from_receive = {}, {}
+    for stages in merged.values():
+        for stage in STAGES[1:]:
+            if stage not in stages:
+                continue
+            previous = PREVIOUS_STAGE[stage]
+            while previous is not None and previous not in stages:
+                previous = PREVIOUS_STAGE.get(previous)
+            if previous is not None:
+                hops.setdefault((previous, stage), []).append(stages[stage] - stages[previous])
+            if 'receive' in stages:
+                from_receive.setdefault(stage, []).append(stages[stage] - stages['receive'])
+    return hops, from_receive
+
+
+def _row(label, values):
+    values = sorted(values)
+    cells = [percentile(values, fraction) * 1000 for fraction in (0.5, 0.95, 0.99)] + [values[-1] * 1000]
+    return f"{label:<24} {len(values):>7} " + ' '.join(f"{cell:>9.1f}" for cell in cells)
+
+
+def report(merged):
+    """Lines of a per-stage latency table, in milliseconds"""
+    hops, from_receive = stage_latencies(merged)
+    order = {stage: index for index, stage in enumerate(STAGES)}
+    lines = [f"{len(merged)} passes traced",
+             f"{'stage':<24} {'count':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  (ms)"]
+    for previous, stage in sorted(hops, key=lambda hop: (order[hop[1]], order[hop[0]])):
+        lines.append(_row(f"{previous} > {stage}", hops[(previous, stage)]))
+    for stage in sorted(from_receive, key=order.get):
+        lines.append(_row(f"receive >> {stage}", from_receive[stage]))
+    return lines
@@ -0,0 +1,134 @@
+"""
+Synthetic P3 decoder traffic for load testing.
+
+TrafficGenerator simulates cars lapping a single loop and yields the PASSING
+and STATUS records a decoder would send, in decoder (RTC) time order. It is
+seeded, so the same settings always produce the same stream.
+"""
+import heapq
+import random
+from collections import namedtuple
+from . import encoder
+
+DEFAULT_FIRST_TRANSPONDER = 4000000
+DEFAULT_DECODER_ID = 0x00041813
+DEFAULT_START_RTC = 1_700_000_000_000_000  # Microseconds
+MIN_LAP_TIME = 0.5  # Seconds; sampled lap times are clamped to this
+HIT_SPREAD_US = 20_000  # Repeated detections of one crossing arrive within this many microseconds
+
+# kind is 'passing', 'status' or 'corrupt'; passing_number is None for STATUS records
+Frame = namedtuple('Frame', ['rtc_time', 'data', 'kind', 'passing_number'])
+
+_CROSSING, _STATUS = 0, 1
+
+
+class TrafficGenerator:
+    """
+    transponders cars lap in lap_mean seconds (gauss, lap_sd) plus a fixed
+    per-car pace offset of up to pace_spread seconds. Each loop crossing is
+    reported by 1..hits PASSING records (multi-hit duplicates). A STATUS record
+    with a noise level around noise is sent every status_interval seconds. A
+    corrupt_rate fraction of the records has a damaged body so its CRC fails.
+    """
+
+    def __init__(self, transponders=10, lap_mean=30.0, lap_sd=1.0, pace_spread=2.0, hits=1, noise=40,
+                 status_interval=5.0, corrupt_rate=0.0, first_transponder=DEFAULT_FIRST_TRANSPONDER,
+                 decoder_id=DEFAULT_DECODER_ID, start_rtc=DEFAULT_START_RTC, seed=None):
+        self.transponders = [first_transponder + n for n in range(transponders)]
+        self.lap_mean = lap_mean
+        self.lap_sd = lap_sd
+        self.hits = max(1, hits)
+        self.noise = noise
+        self.status_interval = status_interval
+        self.corrupt_rate = corrupt_rate
+        self.decoder_id = decoder_id
+        self.start_rtc = start_rtc
+        self.rng = random.Random(seed)
+        self.pace = {transponder: self.rng.uniform(0, pace_spread) for transponder in self.transponders}
+        self.passing_number = 0
+
+    def lap_time_us(self, transponder):
+        lap_time = self.rng.gauss(self.lap_mean + self.pace[transponder], self.lap_sd)
+        return int(max(MIN_LAP_TIME, lap_time) * 1_000_000)
+
+    def _passings(self, transponder, rtc_time):
+        """The PASSING records of one crossing: the first detection plus multi-hit duplicates"""
+        offsets = [0] + sorted(self.rng.randint(1, HIT_SPREAD_US) for _ in range(self.rng.randint(1, self.hits) - 1))
+        for offset in offsets:
+            self.passing_number += 1
+            strength = self.rng.randint(80, 180)
+            hits = self.rng.randint(5, 60)
+            yield (rtc_time + offset, encoder.passing(self.passing_number, transponder, rtc_time + offset,
+                                                      strength, hits, 0, self.decoder_id), self.passing_number)
+
+    def _status(self):
+        noise = max(0, int(self.rng.gauss(self.noise, self.noise * 0.1)))
+        return encoder.status(noise, decoder_id=self.decoder_id)
+
+    def corrupt(self, data):
+        """Flip a bit in the body of an escaped record. SOR, EOR and escape bytes are left alone so framing survives."""
+        data = bytearray(data)
+        candidates = [i for i in range(encoder.HEADER_LENGTH, len(data) - 1)
+                      if data[i] not in (encoder.ESCAPE, encoder.SOR, encoder.EOR) and data[i - 1] != encoder.ESCAPE]
+        index = self.rng.choice(candidates)
+        data[index] ^= 1 << self.rng.randrange(8)
+        if data[index] in (encoder.ESCAPE, encoder.SOR, encoder.EOR):
+            data[index] ^= 0x40
+        return bytes(data)
+
+    def frames(self, duration=None, count=None):
+        """
+        Yield Frames in RTC order until duration seconds of decoder time or count
+        records (whichever comes first); forever if neither is given.
+        """
+        end_rtc = None if duration is None else self.start_rtc + int(duration * 1_000_000)
+        events = [(self.start_rtc + self.rng.randint(0, int(self.lap_mean * 1_000_000)), _CROSSING, transponder)
+                  for transponder in self.transponders]
+        if self.status_interval:
+            events.append((self.start_rtc, _STATUS, 0))
+        heapq.heapify(events)
+        pending = []  # Multi-hit duplicates not yet due, as (rtc_time, data, passing_number)
+        sent = 0
+        while events or pending:
+            if pending and (not events or pending[0][0] <= events[0][0]):
+                (rtc_time, data, passing_number), kind = heapq.heappop(pending), 'passing'
+            else:
+                rtc_time, event, transponder = heapq.heappop(events)
+                if end_rtc is not None and rtc_time > end_rtc:
+                    events = []  # Every later event is past the end too; only flush the duplicates
+                    continue
+                if event == _STATUS:
+                    data, kind, passing_number = self._status(), 'status', None
+                    heapq.heappush(events, (rtc_time + int(self.status_interval * 1_000_000), _STATUS, 0))
+                else:
+                    passings = list(self._passings(transponder, rtc_time))
+                    (rtc_time, data, passing_number), kind = passings[0], 'passing'
+                    for duplicate in passings[1:]:
+                        heapq.heappush(pending, duplicate)
+                    heapq.heappush(events, (rtc_time + self.lap_time_us(transponder), _CROSSING, transponder))
+            if self.corrupt_rate and self.rng.random() < self.corrupt_rate:
+                data, kind = self.corrupt(data), 'corrupt'
+            yield Frame(rtc_time, data, kind, passing_number)
+            sent += 1
+            if count is not None and sent >= count:
+                return
+
+
+def add_traffic_args(parser):
+    """Command line options of TrafficGenerator, shared by amb_generate.py and amb_emulator.py"""
+    parser.add_argument("-n", "--transponders", help="number of cars", default=10, type=int)
+    parser.add_argument("--lap-mean", help="mean lap time in seconds", default=30.0, type=float)
+    parser.add_argument("--lap-sd", help="lap time standard deviation in seconds", default=1.0, type=float)
+    parser.add_argument("--pace-spread", help="largest per-car pace offset in seconds", default=2.0, type=float)
+    parser.add_argument("--hits", help="up to this many PASSING records per crossing", default=1, type=int)
+    parser.add_argument("--noise", help="mean loop noise reported in STATUS records", default=40, type=int)
+    parser.add_argument("--status-interval", help="seconds between STATUS records, 0 for none", default=5.0, type=float)
+    parser.add_argument("--corrupt-rate", help="fraction of records with a damaged body", default=0.0, type=float)
+    parser.add_argument("--seed", help="random seed, for repeatable output", default=1, type=int)
+
+
+def traffic_generator(args, **kwargs):
+    return TrafficGenerator(transponders=args.transponders, lap_mean=args.lap_mean, lap_sd=args.lap_sd,
+                            pace_spread=args.pace_spread, hits=args.hits, noise=args.noise,
+                            status_interval=args.status_interval, corrupt_rate=args.corrupt_rate,
+                            seed=args.seed, **kwargs)
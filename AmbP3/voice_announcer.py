@@ -9,9 +9,15 @@ import threading
 import queue
 import time
 import os
-import tempfile
-from datetime import datetime
+import io
+import bisect
+from collections import namedtuple
 from .logs import Logg
+from .espeak_process import EspeakProcess
+from . import tracing
+from .voice_cache import PhraseCache, COMMON_PHRASES, DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES
+from .announcement_queue import (AnnouncementQueue, PRIORITY_ROUTINE, PRIORITY_BEST_LAP, PRIORITY_RACE,
+                                 DEFAULT_MAXSIZE, DEFAULT_MAX_AGE)
 
 # Import TTS engines with fallbacks
 try:
@@ -29,15 +35,33 @@ except ImportError:
 
 logger = Logg.create_logger('voice_announcer')
 
+PLAYBACK_POLL_INTERVAL = 0.01  # Seconds between checks whether a clip finished playing
+NO_LAP_US = 2 ** 63 - 1  # Ranks cars without a valid lap behind every car with one
+
+# One completed lap. lap_us is the lap time in microseconds; car_number is optional, and
+# is_best is decided by the monitor (lap not slower than the car's previous best) when None.
+LapEvent = namedtuple('LapEvent', ['transponder_id', 'lap_number', 'lap_us', 'is_best', 'car_number'],
+                      defaults=(None, None))
+
 class VoiceAnnouncer:
     """Handles voice announcements for lap timing events"""
     
-    def __init__(self, enabled=True, engine='auto'):
+    def __init__(self, enabled=True, engine='auto', cache_dir=DEFAULT_CACHE_DIR, cache_max_bytes=DEFAULT_MAX_BYTES,
+                 queue_size=DEFAULT_MAXSIZE, max_age=DEFAULT_MAX_AGE):
         self.enabled = enabled
         self.engine_type = engine  # 'auto', 'pyttsx3', 'gtts', 'espeak'
         self.engine = None
-        self.announcement_queue = queue.Queue()
+        self.cache_dir = cache_dir  # None disables the gTTS phrase cache
+        self.cache_max_bytes = cache_max_bytes
+        self.phrase_cache = None
+        # Bounded, prioritized and coalesced per key: stale callouts are dropped, not spoken late.
+        self.announcement_queue = AnnouncementQueue(maxsize=queue_size, max_age=max_age)
+        # Synthesized clips waiting for playback. One slot: the next clip is synthesized while the
+        # current one plays, but later announcements stay in the priority queue where they can coalesce.
+        self.playback_queue = queue.Queue(maxsize=1)
         self.worker_thread = None
+        self.playback_thread = None
+        self.espeak = None
         self.running = False
         self.pygame_initialized = False
         
@@ -79,6 +103,10 @@ class VoiceAnnouncer:
             self.pygame_initialized = True
             self.engine = 'gtts'
             logger.info("Using Google TTS engine (gTTS) for Japanese speech")
+            if self.cache_dir:
+                self.phrase_cache = PhraseCache(self._render_gtts, 'gtts', voice='ja', rate='normal',
+                                                directory=self.cache_dir, max_bytes=self.cache_max_bytes)
+                self.prerender(COMMON_PHRASES)
         except Exception as e:
             logger.error(f"Failed to initialize gTTS/pygame: {e}")
             raise
@@ -115,38 +143,77 @@ class VoiceAnnouncer:
             os.system('sudo apt-get update && sudo apt-get install -y espeak espeak-data')
         
         self.engine = 'espeak'
+        # The next espeak process is kept started, so its voice is loaded before each announcement.
+        self.espeak = EspeakProcess(voice='ja')
         logger.info("Using espeak TTS engine")
     
     def _start_worker(self):
-        """Start the background worker thread for announcements"""
+        """Start the background worker threads for announcements"""
         self.running = True
         self.worker_thread = threading.Thread(target=self._worker, daemon=True)
         self.worker_thread.start()
+        self.playback_thread = threading.Thread(target=self._player, daemon=True)
+        self.playback_thread.start()
         logger.info("Voice announcer worker thread started")
     
     def _worker(self):
-        """Background worker that processes announcement queue"""
+        """
+        Background worker that processes announcement queue.
+        With gTTS this is the synthesis stage: it prepares the next clip while the player plays the current one.
+        """
         while self.running:
             try:
-                # Get announcement from queue (blocking with timeout)
-                announcement = self.announcement_queue.get(timeout=1.0)
+                # Get the most important fresh announcement (blocking with timeout)
+                item = self.announcement_queue.get(timeout=1.0)
                 
-                if announcement is None:  # Shutdown signal
-                    break
+                if item is None:  # Timeout or shutdown
+                    continue
                 
-                # Speak the announcement
-                logger.info(f"🔊 VOICE: {announcement}")
-                if self.engine:
-                    self._speak_text(announcement)
+                if self.engine == 'gtts':
+                    try:
+                        clip = self._synthesize_gtts(item.text)
+                    except Exception as e:
+                        logger.error(f"Error with gTTS speech: {e}")
+                        # Fallback to espeak if gTTS fails; the player speaks it after the current clip.
+                        clip = None
+                    self.playback_queue.put((item, clip))
                 else:
-                    logger.info("(Voice engine not available - announcement logged only)")
-                
-                self.announcement_queue.task_done()
+                    self._speak_now(item, self._speak_text)
                 
+            except Exception as e:
+                logger.error(f"Error in voice announcer worker: {e}")
+    
+    def _player(self):
+        """
+        Background worker that plays synthesized clips (playback stage of the gTTS pipeline).
+        A clip of None is spoken with espeak instead, so the fallback never talks over a clip.
+        """
+        while self.running:
+            try:
+                item, clip = self.playback_queue.get(timeout=1.0)
             except queue.Empty:
                 continue
+            try:
+                if not self.announcement_queue.is_fresh(item):
+                    logger.info(f"Dropping stale announcement: {item.text}")
+                    continue
+                if clip is None:
+                    self._speak_now(item, self._speak_espeak)
+                else:
+                    self._speak_now(item, lambda text: self._play_clip(clip))
             except Exception as e:
-                logger.error(f"Error in voice announcer worker: {e}")
+                logger.error(f"Error playing announcement '{item.text}': {e}")
+    
+    def _speak_now(self, item, speak):
+        """Log and speak an announcement taken from the queue"""
+        self.announcement_queue.record_spoken(item)
+        if item.trace is not None:
+            tracing.mark(item.trace, 'voice')
+        logger.info(f"🔊 VOICE: {item.text}")
+        if self.engine:
+            speak(item.text)
+        else:
+            logger.info("(Voice engine not available - announcement logged only)")
     
     def _speak_text(self, text):
         """Speak text using the configured engine"""
@@ -163,27 +230,37 @@ class VoiceAnnouncer:
         except Exception as e:
             logger.error(f"Error speaking text '{text}': {e}")
     
+    def _render_gtts(self, text):
+        """Synthesize text with Google TTS and return the MP3 bytes"""
+        clip = io.BytesIO()
+        gTTS(text=text, lang='ja', slow=False).write_to_fp(clip)
+        return clip.getvalue()
+
+    def prerender(self, phrases):
+        """Render phrases (e.g. nicknames) into the phrase cache in the background"""
+        if self.phrase_cache is None:
+            return
+        phrases = list(phrases)
+        threading.Thread(target=self.phrase_cache.prerender, args=(phrases,), daemon=True).start()
+
+    def _synthesize_gtts(self, text):
+        """MP3 bytes for text; assembled from cached clips when the phrase cache is enabled"""
+        if self.phrase_cache is not None:
+            # Only fragments that are not cached yet go to the network.
+            return self.phrase_cache.assemble(text)
+        return self._render_gtts(text)
+    
+    def _play_clip(self, clip):
+        """Play MP3 bytes and wait until playback is complete"""
+        pygame.mixer.music.load(io.BytesIO(clip), 'mp3')
+        pygame.mixer.music.play()
+        while pygame.mixer.music.get_busy():
+            time.sleep(PLAYBACK_POLL_INTERVAL)
+    
     def _speak_gtts(self, text):
         """Speak text using Google TTS"""
         try:
-            # Create TTS object
-            tts = gTTS(text=text, lang='ja', slow=False)
-            
-            # Save to temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as tmp_file:
-                tts.save(tmp_file.name)
-                
-                # Play audio file
-                pygame.mixer.music.load(tmp_file.name)
-                pygame.mixer.music.play()
-                
-                # Wait for playback to complete
-                while pygame.mixer.music.get_busy():
-                    time.sleep(0.1)
-                
-                # Clean up
-                os.unlink(tmp_file.name)
-                
+            self._play_clip(self._synthesize_gtts(text))
         except Exception as e:
             logger.error(f"Error with gTTS speech: {e}")
             # Fallback to espeak if gTTS fails
@@ -192,26 +269,31 @@ class VoiceAnnouncer:
     def _speak_espeak(self, text):
         """Speak text using espeak"""
         try:
-            # Use espeak with Japanese phonemes if possible
-            # Escape quotes in text
-            safe_text = text.replace('"', '\"')
-            cmd = f'espeak -v ja "{safe_text}"'
-            os.system(cmd)
+            if self.espeak is None:
+                self.espeak = EspeakProcess(voice='ja')
+            self.espeak.say(text)
         except Exception as e:
             logger.error(f"Error with espeak speech: {e}")
     
-    def announce(self, text):
-        """Add an announcement to the queue"""
+    def announce(self, text, priority=PRIORITY_ROUTINE, key=None, trace=None):
+        """
+        Add an announcement to the queue.
+        A pending announcement with the same key (e.g. transponder id) is replaced by this one.
+        trace is the tracing key of the pass being announced; playback start is recorded under it.
+        """
         if not self.enabled:
             return
         
-        try:
-            # Add to queue (non-blocking)
-            self.announcement_queue.put_nowait(text)
+        # Add to queue (non-blocking)
+        if self.announcement_queue.put(text, priority, key, trace):
             logger.debug(f"Queued announcement: {text}")
-        except queue.Full:
+        else:
             logger.warning("Announcement queue is full, skipping announcement")
     
+    def get_metrics(self):
+        """Queue depth, dropped/expired counts and speech latency (seconds from queueing to speaking)"""
+        return self.announcement_queue.metrics()
+    
     def announce_lap_time(self, car_number, lap_number, lap_time_seconds, is_best=False, simple_mode=True):
         """Announce a lap time completion"""
         try:
@@ -238,18 +320,18 @@ class VoiceAnnouncer:
                 else:
                     announcement = f"{lap_number}ラップ、{time_text}"
             
-            self.announce(announcement)
+            self.announce(announcement, PRIORITY_BEST_LAP if is_best else PRIORITY_ROUTINE, key=car_number)
             
         except Exception as e:
             logger.error(f"Error creating lap time announcement: {e}")
     
     def announce_race_start(self):
         """Announce race start"""
-        self.announce("レース開始！")
+        self.announce("レース開始！", PRIORITY_RACE)
     
     def announce_race_finish(self):
         """Announce race finish"""
-        self.announce("レース終了！")
+        self.announce("レース終了！", PRIORITY_RACE)
     
     def announce_best_lap(self, car_number, lap_time_seconds):
         """Announce new best lap"""
@@ -263,7 +345,7 @@ class VoiceAnnouncer:
                 time_text = f"{seconds:.3f}秒"
             
             announcement = f"新記録！{time_text}"
-            self.announce(announcement)
+            self.announce(announcement, PRIORITY_BEST_LAP, key=car_number)
             
         except Exception as e:
             logger.error(f"Error creating best lap announcement: {e}")
@@ -316,8 +398,12 @@ class VoiceAnnouncer:
         
         if self.worker_thread and self.worker_thread.is_alive():
             # Send shutdown signal
-            self.announcement_queue.put(None)
+            self.announcement_queue.close()
             self.worker_thread.join(timeout=5.0)
+        if self.playback_thread and self.playback_thread.is_alive():
+            self.playback_thread.join(timeout=5.0)
+        if self.espeak is not None:
+            self.espeak.close()
         
         if self.engine:
             try:
@@ -330,15 +416,25 @@ class VoiceAnnouncer:
 
 
 class LapTimeMonitor:
-    """Monitors lap times and triggers voice announcements"""
+    """
+    Monitors lap times and triggers voice announcements.
+    Consumes one LapEvent per completed lap. The ranking is a sorted list: finding a car's
+    place is O(log n) in the number of cars, moving it is an O(n) list insert.
+    """
     
-    def __init__(self, announcer, min_lap_time=10.0, max_lap_time=300.0):
+    def __init__(self, announcer, min_lap_time=10.0, max_lap_time=300.0, announce_laps=True):
         self.announcer = announcer
         self.min_lap_time = min_lap_time  # Minimum valid lap time (seconds)
         self.max_lap_time = max_lap_time  # Maximum valid lap time (seconds)
+        self.min_lap_us = int(min_lap_time * 1000000)
+        self.max_lap_us = int(max_lap_time * 1000000)
+        # False when the caller announces laps itself (web_app); the monitor then only keeps the standings.
+        self.announce_laps = announce_laps
         
         # Track previous state for each car
         self.car_states = {}
+        # Standings as sorted (-lap_count, best_lap_us, transponder_id) keys, updated per event.
+        self.ranking = []
         self.race_started = False
         self.last_all_times_announcement = 0  # Track when we last announced all times
         self.all_times_interval = 30  # Announce all times every 30 seconds
@@ -350,14 +446,107 @@ class LapTimeMonitor:
         
         logger.info(f"Lap time monitor initialized (min: {min_lap_time}s, max: {max_lap_time}s)")
     
-    def update_lap_data(self, lap_data):
-        """Update with new lap data and trigger announcements"""
+    def _rank_key(self, transponder_id, state):
+        best = state['best_lap_us'] if state['best_lap_us'] is not None else NO_LAP_US
+        return (-state['lap_count'], best, transponder_id)
+    
+    def _set_state(self, transponder_id, state):
+        """Store a car's state and move it to its new place in the standings"""
+        old_state = self.car_states.get(transponder_id)
+        if old_state is not None:
+            old_key = self._rank_key(transponder_id, old_state)
+            index = bisect.bisect_left(self.ranking, old_key)
+            if index < len(self.ranking) and self.ranking[index] == old_key:
+                del self.ranking[index]
+        self.car_states[transponder_id] = state
+        bisect.insort(self.ranking, self._rank_key(transponder_id, state))
+    
+    def seed(self, transponder_id, lap_count, best_lap_us=None, car_number=None):
+        """Set a car's state without announcing, e.g. from history loaded at startup"""
+        self._set_state(transponder_id, {
+            'car_number': car_number,
+            'lap_count': lap_count,
+            'last_lap_us': None,
+            'best_lap_us': best_lap_us
+        })
+    
+    def on_lap(self, event):
+        """Handle one completed lap (LapEvent). Returns whether it is a new personal best."""
+        is_best = False
         try:
             # Check if this is the start of a race
-            if not self.race_started and lap_data:
+            if not self.race_started:
                 self.race_started = True
-                self.announcer.announce_race_start()
+                if self.announce_laps:
+                    self.announcer.announce_race_start()
+            
+            prev_state = self.car_states.get(event.transponder_id, {})
+            car_number = event.car_number if event.car_number is not None else prev_state.get('car_number')
+            best_lap_us = prev_state.get('best_lap_us')
+            
+            if self.min_lap_us <= event.lap_us <= self.max_lap_us:
+                if event.is_best is not None:
+                    is_best = event.is_best
+                else:
+                    is_best = best_lap_us is not None and event.lap_us <= best_lap_us
+                if best_lap_us is None or event.lap_us < best_lap_us:
+                    best_lap_us = event.lap_us
+                if self.announce_laps and car_number not in (None, 'Unknown'):
+                    lap_time_seconds = event.lap_us / 1000000.0
+                    # Announce the lap (using simple mode by default)
+                    self.announcer.announce_lap_time(
+                        car_number, event.lap_number, lap_time_seconds, is_best, simple_mode=True
+                    )
+                    logger.info(f"Car {car_number} completed lap {event.lap_number}: {lap_time_seconds:.3f}s")
             
+            # Update state
+            self._set_state(event.transponder_id, {
+                'car_number': car_number,
+                'lap_count': max(event.lap_number, prev_state.get('lap_count', 0)),
+                'last_lap_us': event.lap_us,
+                'best_lap_us': best_lap_us
+            })
+            
+            # Check if it's time to announce all cars' times (only if enabled)
+            current_time = time.time()
+            if (self.announce_all_times_enabled and 
+                current_time - self.last_all_times_announcement > self.all_times_interval):
+                self._announce_all_times()
+                self.last_all_times_announcement = current_time
+                
+        except Exception as e:
+            logger.error(f"Error in lap time monitor update: {e}")
+        return is_best
+    
+    def position(self, transponder_id):
+        """1-based position of a car in the standings, or None if unknown"""
+        state = self.car_states.get(transponder_id)
+        if state is None:
+            return None
+        return bisect.bisect_left(self.ranking, self._rank_key(transponder_id, state)) + 1
+    
+    def standings(self, limit=None):
+        """Transponder ids ordered by lap count (desc), then best lap (asc)"""
+        keys = self.ranking if limit is None else self.ranking[:limit]
+        return [transponder_id for _, _, transponder_id in keys]
+    
+    def standings_table(self, limit=None):
+        """Standings as dicts with position, transponder_id, car_number, lap_count and best_lap_us"""
+        keys = self.ranking if limit is None else self.ranking[:limit]
+        return [{
+            'position': position,
+            'transponder_id': transponder_id,
+            'car_number': self.car_states[transponder_id]['car_number'],
+            'lap_count': self.car_states[transponder_id]['lap_count'],
+            'best_lap_us': self.car_states[transponder_id]['best_lap_us'],
+        } for position, (_, _, transponder_id) in enumerate(keys, 1)]
+    
+    def update_lap_data(self, lap_data):
+        """
+        Update with a full list of car dicts (compatibility wrapper).
+        Cars whose lap_count increased are turned into LapEvents; prefer calling on_lap directly.
+        """
+        try:
             for car_info in lap_data:
                 car_number = car_info.get('car_number', 'Unknown')
                 transponder_id = car_info.get('transponder_id')
@@ -365,94 +554,57 @@ class LapTimeMonitor:
                 if car_number == 'Unknown' or not transponder_id:
                     continue
                 
-                # Get current state
                 lap_count = car_info.get('lap_count', 0)
                 last_lap_time = car_info.get('last_lap_time', '-')
                 best_lap_time = car_info.get('best_lap_time', '-')
-                
-                # Get previous state
                 prev_state = self.car_states.get(transponder_id, {})
-                prev_lap_count = prev_state.get('lap_count', 0)
-                prev_best_lap = prev_state.get('best_lap_time', '-')
                 
                 # Check for new lap completion
-                if lap_count > prev_lap_count and last_lap_time != '-':
+                if lap_count > prev_state.get('lap_count', 0) and last_lap_time != '-':
                     try:
-                        # Parse lap time
-                        lap_time_seconds = self._parse_lap_time(last_lap_time)
-                        
-                        if self.min_lap_time <= lap_time_seconds <= self.max_lap_time:
-                            # Check if this is a new best lap
-                            is_best = (best_lap_time != '-' and 
-                                      prev_best_lap != best_lap_time and 
-                                      best_lap_time == last_lap_time)
-                            
-                            # Announce the lap (using simple mode by default)
-                            self.announcer.announce_lap_time(
-                                car_number, lap_count, lap_time_seconds, is_best, simple_mode=True
-                            )
-                            
-                            logger.info(f"Car {car_number} completed lap {lap_count}: {lap_time_seconds:.3f}s")
-                        
+                        lap_us = int(round(self._parse_lap_time(last_lap_time) * 1000000))
                     except ValueError as e:
                         logger.warning(f"Could not parse lap time '{last_lap_time}': {e}")
-                
-                # Update state
-                self.car_states[transponder_id] = {
-                    'car_number': car_number,
-                    'lap_count': lap_count,
-                    'last_lap_time': last_lap_time,
-                    'best_lap_time': best_lap_time
-                }
-            
-            # Check if it's time to announce all cars' times (only if enabled)
-            current_time = time.time()
-            if (self.announce_all_times_enabled and 
-                current_time - self.last_all_times_announcement > self.all_times_interval and 
-                len(lap_data) > 0 and self.race_started):
-                self._announce_all_times(lap_data)
-                self.last_all_times_announcement = current_time
+                        continue
+                    # Check if this is a new best lap
+                    is_best = (best_lap_time != '-' and
+                               prev_state.get('best_lap_time', '-') != best_lap_time and
+                               best_lap_time == last_lap_time)
+                    self.on_lap(LapEvent(transponder_id, lap_count, lap_us, is_best, car_number))
+                    self.car_states[transponder_id]['best_lap_time'] = best_lap_time
                 
         except Exception as e:
             logger.error(f"Error in lap time monitor update: {e}")
     
-    def _announce_all_times(self, lap_data):
-        """Announce all cars' current times"""
+    def _announce_all_times(self):
+        """Announce all cars' current times from the maintained standings"""
         try:
-            # Filter cars that have completed at least one lap and sort by position
-            active_cars = [car for car in lap_data if car.get('lap_count', 0) > 0]
+            # Cars that have completed at least one lap, already in position order
+            active_cars = [transponder_id for lap_count, _, transponder_id in self.ranking[:8] if lap_count < 0]
             
             if not active_cars:
                 return
             
-            # Sort by lap count (desc) then by best lap time (asc)
-            active_cars.sort(key=lambda x: (
-                -x.get('lap_count', 0),
-                999999 if x.get('best_lap_time', '-') == '-' else self._parse_lap_time_safe(x.get('best_lap_time', '-'))
-            ))
-            
             # Create announcement for all cars
             announcements = []
-            for i, car in enumerate(active_cars[:8]):  # Announce top 8 cars
+            for i, transponder_id in enumerate(active_cars):  # Announce top 8 cars
                 position = i + 1
-                lap_count = car.get('lap_count', 0)
-                best_lap = car.get('best_lap_time', '-')
+                car = self.car_states[transponder_id]
+                lap_count = car['lap_count']
+                best_lap_us = car['best_lap_us']
                 
-                if best_lap != '-':
+                if best_lap_us is not None:
                     # Format the time nicely for speech
-                    try:
-                        lap_seconds = self._parse_lap_time(best_lap)
-                        minutes = int(lap_seconds // 60)
-                        seconds = lap_seconds % 60
-                        
-                        if minutes > 0:
-                            time_text = f"{minutes}分{seconds:.1f}秒"
-                        else:
-                            time_text = f"{seconds:.1f}秒"
-                        
-                        announcements.append(f"{position}位、{lap_count}ラップ、ベスト{time_text}")
-                    except:
-                        announcements.append(f"{position}位、{lap_count}ラップ")
+                    lap_seconds = best_lap_us / 1000000.0
+                    minutes = int(lap_seconds // 60)
+                    seconds = lap_seconds % 60
+                    
+                    if minutes > 0:
+                        time_text = f"{minutes}分{seconds:.1f}秒"
+                    else:
+                        time_text = f"{seconds:.1f}秒"
+                    
+                    announcements.append(f"{position}位、{lap_count}ラップ、ベスト{time_text}")
                 else:
                     announcements.append(f"{position}位、{lap_count}ラップ")
             
@@ -487,6 +639,7 @@ class LapTimeMonitor:
     def reset_race(self):
         """Reset race state"""
         self.car_states.clear()
+        self.ranking.clear()
         self.race_started = False
         self.last_all_times_announcement = 0  # Reset timer
         logger.info("Race state reset")
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+On-disk cache of synthesized speech clips for the voice announcer.
+
+Clips are content-addressed by (engine, voice, rate, text) and evicted least
+recently used once the cache exceeds its size cap. Announcements are split into
+fragments (names, numbers, "秒") so that a lap callout such as "3号車、12秒34" is
+assembled from cached clips without a network call. MP3 streams can simply be
+concatenated frame by frame.
+"""
+import os
+import re
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from .logs import Logg
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'amb_lap_speak', 'phrases')
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+CLIP_SUFFIX = '.mp3'
+SEPARATOR = '、'  # Pauses between fragments are not synthesized on their own
+FRAGMENT_PATTERN = re.compile(r'\d+|秒|[^\d秒]+')
+# Fragments of every lap callout: seconds 0-99, hundredths "00"-"99" and the unit.
+COMMON_PHRASES = ('秒',) + tuple(str(n) for n in range(100)) + tuple(f"{n:02d}" for n in range(10))
+
+logger = Logg.create_logger('voice_cache')
+
+
+def split_phrases(text):
+    """Split an announcement into cacheable fragments, e.g. "3号車、12秒34" -> ["3", "号車", "12", "秒", "34"]"""
+    fragments = []
+    for part in text.split(SEPARATOR):
+        fragments.extend(fragment for fragment in FRAGMENT_PATTERN.findall(part.strip()) if fragment.strip())
+    return fragments
+
+
+class PhraseCache:
+    """
+    LRU cache of clips rendered by render(text) -> bytes.
+    engine, voice and rate become part of every key, so changing any of them never plays a stale clip.
+    """
+
+    def __init__(self, render, engine, voice='', rate='', directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.render = render
+        self.key_prefix = f"{engine}\0{voice}\0{rate}\0"
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._sizes = OrderedDict()  # File name -> size, least recently used first
+        self._total = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        """Rebuild the LRU order from the clips' modification times"""
+        clips = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(CLIP_SUFFIX) and entry.is_file():
+                stat = entry.stat()
+                clips.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(clips):
+            self._sizes[name] = size
+            self._total += size
+        logger.info(f"Phrase cache {self.directory}: {len(self._sizes)} clips, {self._total // 1024} KiB")
+
+    def _file_name(self, text):
+        return hashlib.sha256((self.key_prefix + text).encode('utf-8')).hexdigest() + CLIP_SUFFIX
+
+    def __contains__(self, text):
+        return self._file_name(text) in self._sizes
+
+    def get(self, text):
+        """Return the clip for text, rendering and storing it on a miss"""
+        name = self._file_name(text)
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            cached = name in self._sizes
+            if cached:
+                self._sizes.move_to_end(name)
+        if cached:
+            try:
+                with open(path, 'rb') as clip_file:
+                    clip = clip_file.read()
+                os.utime(path)  # Keeps the LRU order across restarts
+                self.hits += 1
+                return clip
+            except OSError:
+                with self._lock:
+                    self._total -= self._sizes.pop(name, 0)
+
+        self.misses += 1
+        clip = self.render(text)
+        self._store(name, clip)
+        return clip
+
+    def _store(self, name, clip):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.clip-')
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(clip)
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        with self._lock:
+            self._total += len(clip) - self._sizes.pop(name, 0)
+            self._sizes[name] = len(clip)
+            while self._total > self.max_bytes and len(self._sizes) > 1:
+                old_name, size = self._sizes.popitem(last=False)
+                self._total -= size
+                try:
+                    os.unlink(os.path.join(self.directory, old_name))
+                except OSError:
+                    pass
+
+    def assemble(self, text):
+        """Clip for a whole announcement, concatenated from its fragments' clips"""
+        return b''.join(self.get(fragment) for fragment in split_phrases(text))
+
+    def prerender(self, phrases):
+        """Render every fragment not cached yet. Stops at the first failure (e.g. offline); returns the number rendered."""
+        rendered = 0
+        for phrase in phrases:
+            for fragment in split_phrases(phrase):
+                if fragment in self:
+                    continue
+                try:
+                    self.get(fragment)
+                    rendered += 1
+                except Exception as e:
+                    logger.warning(f"Could not pre-render '{fragment}': {e}")
+                    return rendered
+        return rendered
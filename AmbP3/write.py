@@ -1,8 +1,16 @@
 from time import time
 from sys import exit
 from .decoder import bin_to_decimal
+from . import metrics
 from mysql import connector as mysqlconnector
 
+PASS_INSERTS = metrics.counter('amb_pass_inserts_total', 'PASSING inserts sent to MySQL, failed ones included')
+DB_INSERT_SECONDS = metrics.histogram('amb_db_insert_seconds', 'Time to insert one pass into MySQL')
+DB_ERRORS = metrics.counter('amb_db_errors_total', 'MySQL errors seen by the client, by exception type',
+                            labelnames=('error',))
+DB_RECONNECTS = metrics.counter('amb_db_reconnects_total', 'MySQL reconnect attempts')
+PASSES_DISCARDED = metrics.counter('amb_passes_discarded_total', 'Multi-hit passes merged into a better pass')
+
 
 def open_mysql_connection(user, db, password, autocommit=True, host='127.0.0.1', port=3306):
     try:
@@ -21,6 +29,29 @@ def dict_to_sqlquery(data_dict, table):
     return sql
 
 
+# passes column -> PASSING field
+MYSQL_P3_MAP = {
+    'pass_id': 'PASSING_NUMBER',
+    'transponder_id': 'TRANSPONDER',
+    'rtc_time': 'RTC_TIME',
+    'strength': 'STRENGTH',
+    'hits': 'HITS',
+    'flags': 'FLAGS',
+    'decoder_id': 'DECODER_ID'
+}
+
+
+def passing_columns(result):
+    "passes columns and values of a decoded PASSING record (p3decode body); empty for other records"
+    result = result['RESULT']
+    mysql_insert = {}
+    if 'TOR' in result and result['TOR'] == 'PASSING':
+        for key, value in MYSQL_P3_MAP.items():
+            if value in result:
+                mysql_insert[key] = bin_to_decimal(result[value])
+    return mysql_insert
+
+
 class Write:
     def to_file(data, file_handler):
         if not file_handler.closed:
@@ -33,26 +64,28 @@ class Write:
             print("{} is not a filehandler".format(file_handler))
 
     def passing_to_mysql(my_cursor, result, table='passes'):
-        result = result['RESULT']
-        mysql_p3_map = {
-            'pass_id': 'PASSING_NUMBER',
-            'transponder_id': 'TRANSPONDER',
-            'rtc_time': 'RTC_TIME',
-            'strength': 'STRENGTH',
-            'hits': 'HITS',
-            'flags': 'FLAGS',
-            'decoder_id': 'DECODER_ID'
-        }
-        mysql_insert = {}
-        if 'TOR' in result and result['TOR'] == 'PASSING':
-            for key, value in mysql_p3_map.items():
-                if value in result:
-                    my_key = key
-                    my_value = bin_to_decimal(result[value])
-                    mysql_insert[my_key] = my_value
+        Write.columns_to_mysql(my_cursor, passing_columns(result), table)
+
+    def columns_to_mysql(my_cursor, mysql_insert, table='passes'):
         query = dict_to_sqlquery(mysql_insert, table)
         print("inserting: {}:".format(list(mysql_insert.values())))
-        my_cursor.execute(query, list(mysql_insert.values()))
+        with DB_INSERT_SECONDS.time():
+            my_cursor.execute(query, list(mysql_insert.values()))
+        PASS_INSERTS.inc()
+
+    def discarded_to_mysql(my_cursor, kept, discarded, table='discarded_passes'):
+        "record the passes merged into kept (same decoder), with their RTC time relative to it"
+        if not discarded:
+            return
+        row_values = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(discarded))
+        query = f"INSERT IGNORE INTO {table} (decoder_id, pass_id, kept_pass_id, rtc_offset, strength, hits) " \
+                f"VALUES {row_values}"
+        values = []
+        for columns in discarded:
+            values += [columns.get('decoder_id'), columns['pass_id'], kept['pass_id'], columns['rtc_time'] - kept['rtc_time'],
+                       columns.get('strength'), columns.get('hits')]
+        my_cursor.execute(query, values)
+        PASSES_DISCARDED.inc(len(discarded))
 
 
 class Cursor(object):
@@ -64,6 +97,7 @@ class Cursor(object):
 
     def reconnect(self):
         self.reconnect_counter += 1
+        DB_RECONNECTS.inc()
         if self.reconnect_counter < 10:
             print("Reconnecting to DB. Attempt: {}".format(self.reconnect_counter))
             try:
@@ -97,10 +131,12 @@ class Cursor(object):
                 return result
         except mysqlconnector.errors.OperationalError as e:
             print("ERROR: {}. RECONNECTING".format(e))
+            DB_ERRORS.inc(error=type(e).__name__)
             self.reconnect()
             return self.cursor.execute(*args, **kwargs)
         except (mysqlconnector.errors.IntegrityError, mysqlconnector.errors.InterfaceError) as e:
             print("ERROR: {}".format(e))
+            DB_ERRORS.inc(error=type(e).__name__)
 
     def fetchone(self):
         return self.cursor.fetchone()
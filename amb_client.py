@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-from time import sleep
+from time import sleep, time
 from sys import exit
 
 from AmbP3.config import get_args
@@ -8,11 +8,29 @@ from AmbP3.decoder import p3decode
 from AmbP3.decoder import bin_data_to_ascii as data_to_ascii
 from AmbP3.decoder import bin_dict_to_ascii as dict_to_ascii
 from AmbP3.write import Write
+from AmbP3.write import passing_columns
 from AmbP3.write import open_mysql_connection
 from AmbP3.write import Cursor
 from AmbP3.time_server import TimeServer
 from AmbP3.time_server import DecoderTime
 from AmbP3.time_server import RefreshTime
+from AmbP3.dedup import PassDeduplicator, DEFAULT_WINDOW_MS
+from AmbP3 import metrics
+from AmbP3 import tracing
+
+
+def pass_trace_key(decoded_body):
+    """(transponder_id, rtc_time) of a decoded PASSING, the key web_app traces the same pass under"""
+    result = decoded_body['RESULT']
+    return int(result.get('TRANSPONDER', '0'), 16), int(result.get('RTC_TIME', '0'), 16)
+
+
+def write_crossings(my_cursor, crossings):
+    """Insert the kept pass of every closed crossing and record the hits merged into it"""
+    for crossing in crossings:
+        Write.columns_to_mysql(my_cursor, crossing.kept)
+        tracing.mark(crossing.trace, 'db_commit')
+        Write.discarded_to_mysql(my_cursor, crossing.kept, crossing.discarded)
 
 
 def main():
@@ -23,6 +41,10 @@ def main():
     if not mysql_enabled:
         print("ERROR, please configure MySQL")
         exit(1)
+    if conf.get('metrics_port'):
+        metrics.start_http_server(conf['metrics_port'])
+    if conf.get('trace_dump'):
+        tracing.dump_on_exit(conf['trace_dump'])
     mysql_con = open_mysql_connection(user=conf['mysql_user'],
                                       db=conf['mysql_db'],
                                       password=conf['mysql_password'],
@@ -55,6 +77,8 @@ def main():
                 break
 
     TimeServer(decoder_time)
+    dedup_window_ms = conf.get('dedup_window_ms')
+    deduplicator = PassDeduplicator(DEFAULT_WINDOW_MS if dedup_window_ms is None else dedup_window_ms)
 
     try:
         log_file = config.file
@@ -66,18 +90,25 @@ def main():
                     decoded_data = data_to_ascii(data)
                     Write.to_file(decoded_data, amb_raw)  # REPLACE BY LOGGING
                     decoded_header, decoded_body = p3decode(data)  # NEED OT REPLACE WITH LOGGING
+                    decoded_at = time()
                     header_msg = ("Decoded Header: {}\n".format(dict_to_ascii(decoded_header)))
                     raw_log = f"{raw_log_delim}\n{header_msg}\n{decoded_body}\n"
                     Write.to_file(raw_log, amb_debug)
                     if 'TOR' in decoded_body['RESULT']:
                         if 'PASSING' in decoded_body['RESULT']['TOR']:
-                            Write.passing_to_mysql(my_cursor, decoded_body)
+                            trace = pass_trace_key(decoded_body)
+                            tracing.mark(trace, 'receive', connection.last_read_time)
+                            tracing.mark(trace, 'decode', decoded_at)
+                            columns = passing_columns(decoded_body)
+                            write_crossings(my_cursor, deduplicator.add(columns, trace))
                         elif 'RTC_TIME' in decoded_body['RESULT']['TOR']:
                             decoder_time.set_decoder_time(int(decoded_body['RESULT']['RTC_TIME'], 16))
+                    write_crossings(my_cursor, deduplicator.expire())
                     sleep(0.1)
                 sleep(0.1)
     except KeyboardInterrupt:
         print("Closing")
+        write_crossings(my_cursor, deduplicator.flush())
         exit(0)
     except IOError as e:
         print("error writing to file. Reason: {}".format(e))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""
+Emulated AMB decoder: streams synthetic passings and answers GET_TIME, PING,
+RESEND and CLEAR_PASSING like the hardware, so amb_client.py can run offline.
+
+    ./amb_emulator.py -n 20 -p 5403
+    ./amb_emulator.py -n 120 --lap-mean 12 --speed 10 --latency 0.05 --disconnect-after 60
+"""
+from time import sleep
+from argparse import ArgumentParser
+from AmbP3.traffic import add_traffic_args, traffic_generator
+from AmbP3.decoder_emulator import DecoderEmulator, DEFAULT_BUFFER_SIZE
+
+ADDR = '127.0.0.1'
+PORT = 5403
+
+
+def get_args():
+    parser = ArgumentParser()
+    add_traffic_args(parser)
+    parser.add_argument("-l", "--listen-address", help="IP address to bind on", default=ADDR, dest='ADDR')
+    parser.add_argument("-p", "--listen-port", help="PORT to bind on", default=PORT, dest='PORT', type=int)
+    parser.add_argument("--speed", help="decoder clock speed factor", default=1.0, type=float)
+    parser.add_argument("--latency", help="seconds before answering a command", default=0.0, type=float)
+    parser.add_argument("--jitter", help="up to this many extra seconds of command latency", default=0.0, type=float)
+    parser.add_argument("--disconnect-after", help="drop each connection after this many seconds", type=float)
+    parser.add_argument("--buffer-size", help="passings kept for RESEND", default=DEFAULT_BUFFER_SIZE, type=int)
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = get_args()
+    emulator = DecoderEmulator(traffic_generator(args), args.ADDR, args.PORT, speed=args.speed,
+                               latency=args.latency, jitter=args.jitter, disconnect_after=args.disconnect_after,
+                               buffer_size=args.buffer_size, seed=args.seed)
+    emulator.start()
+    print(f"Decoder emulator listening on {args.ADDR}:{emulator.PORT}")
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        print("Closing")
+        emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Incremental export of passes, laps and heats to a columnar NumPy store.
+
+Only settled data is exported: finished heats, their laps, and passes up to
+the start of the oldest running heat (or the end of the last finished heat
+when none is running), so a pass never changes heat after it was written.
+Each run appends what is new since the previous one.
+
+    ./amb_export.py -o export/
+    python -c "from AmbP3.columnar import load; print(load('export', 'laps', heats=[12]))"
+"""
+from time import perf_counter
+from argparse import ArgumentParser
+
+import mysql.connector
+from AmbP3.config import Config, DEFAULT_CONFIG_FILE
+from AmbP3.columnar import ColumnarStore, TABLE_COLUMNS, rows_to_columns, date_of
+
+DEFAULT_CHUNK_ROWS = 100000
+
+
+def get_args():
+    parser = ArgumentParser()
+    parser.add_argument("-o", "--output", help="store directory", required=True)
+    parser.add_argument("-f", "--config", dest='config_file', default=DEFAULT_CONFIG_FILE)
+    parser.add_argument("--chunk-rows", help="rows per fetch and per part file", default=DEFAULT_CHUNK_ROWS, type=int)
+    return parser.parse_args()
+
+
+def export_query(connection, store, table, query, params, chunk_rows):
+    """Append the rows of query to table chunk by chunk; returns (rows, last row)"""
+    cursor = connection.cursor(buffered=False)
+    cursor.execute(query, params)
+    exported, last = 0, None
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            break
+        exported += store.append(table, rows_to_columns(rows, table))
+        last = rows[-1]
+    cursor.close()
+    return exported, last
+
+
+def settled_until(connection):
+    """rtc_time up to which every pass has its final heat, or None if no heat has finished"""
+    cursor = connection.cursor()
+    cursor.execute("SELECT MIN(rtc_time_start) FROM heats WHERE heat_finished = 0")
+    running_start = cursor.fetchone()[0]
+    cursor.execute("SELECT MAX(rtc_time_max_end) FROM heats WHERE heat_finished = 1")
+    finished_end = cursor.fetchone()[0]
+    cursor.close()
+    return running_start - 1 if running_start is not None else finished_end
+
+
+def export(connection, store, chunk_rows):
+    """One incremental run; returns {table: rows exported}"""
+    store.begin()
+    exported = {}
+    last_heat = store.watermark('heat_id')
+    heats, last = export_query(connection, store, 'heats',
+                               f"SELECT {', '.join(TABLE_COLUMNS['heats'])} FROM heats "
+                               "WHERE heat_finished = 1 AND heat_id > %s ORDER BY heat_id", (last_heat,), chunk_rows)
+    exported['heats'] = heats
+    if last is not None:
+        exported['laps'], _ = export_query(connection, store, 'laps',
+                                           f"SELECT {', '.join(TABLE_COLUMNS['laps'])} FROM laps "
+                                           "WHERE heat_id > %s AND heat_id <= %s ORDER BY rtc_time",
+                                           (last_heat, last[0]), chunk_rows)
+        store.set_watermark('heat_id', last[0])
+    until = settled_until(connection)
+    if until is not None:
+        pass_columns = ', '.join(f"p.{column}" for column in TABLE_COLUMNS['passes'][:-1])
+        exported['passes'], last = export_query(
+            connection, store, 'passes',
+            f"SELECT {pass_columns}, COALESCE(l.heat_id, 0) FROM passes p LEFT JOIN laps l "
+            "ON l.decoder_id = p.decoder_id AND l.pass_id = p.pass_id "
+            "WHERE p.rtc_time > %s AND p.rtc_time <= %s ORDER BY p.rtc_time",
+            (store.watermark('rtc_time'), until), chunk_rows)
+        if last is not None:
+            store.set_watermark('rtc_time', last[TABLE_COLUMNS['passes'].index('rtc_time')])
+    store.commit()
+    return exported
+
+
+def main():
+    args = get_args()
+    conf = Config(args).conf
+    connection = mysql.connector.connect(user=conf['mysql_user'], db=conf['mysql_db'], password=conf['mysql_password'],
+                                         host=conf['mysql_host'], port=conf['mysql_port'])
+    store = ColumnarStore(args.output)
+    started = perf_counter()
+    try:
+        exported = export(connection, store, args.chunk_rows)
+    finally:
+        connection.close()
+    counts = ', '.join(f"{rows} {table}" for table, rows in exported.items())
+    settled = store.watermark('rtc_time', None)
+    print(f"Run {store.manifest['runs']}: exported {counts or 'nothing'} in {perf_counter() - started:.1f}s"
+          + (f"; passes settled up to {date_of(settled)}" if settled else ''))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Generate synthetic P3 decoder traffic for load testing.
+
+Writes the records as hex lines (the test_server/amb.out format) to a file, or
+acts as a decoder and streams them to a client such as amb_client.py over TCP.
+
+    ./amb_generate.py -n 120 --hits 3 -d 600 -o load.out
+    ./amb_generate.py -n 120 --lap-mean 10 --speed 0 -p 5403
+"""
+import socket
+from sys import exit
+from time import sleep, monotonic
+from argparse import ArgumentParser
+from AmbP3.traffic import add_traffic_args, traffic_generator
+
+ADDR = '127.0.0.1'
+PORT = 5403
+
+
+def get_args():
+    parser = ArgumentParser()
+    add_traffic_args(parser)
+    parser.add_argument("-d", "--duration", help="seconds of decoder time to generate", type=float)
+    parser.add_argument("-c", "--count", help="number of records to generate", type=int)
+    parser.add_argument("-o", "--output", help="write hex lines to this file instead of serving them")
+    parser.add_argument("-l", "--listen-address", help="IP address to bind on", default=ADDR, dest='ADDR')
+    parser.add_argument("-p", "--listen-port", help="PORT to bind on", default=PORT, dest='PORT', type=int)
+    parser.add_argument("--speed", help="playback speed factor when serving, 0 sends as fast as possible",
+                        default=1.0, type=float)
+    args = parser.parse_args()
+    return args
+
+
+def write_file(frames, output):
+    written = 0
+    with open(output, "w") as fd:
+        for frame in frames:
+            fd.write(frame.data.hex() + "\n")
+            written += 1
+    print(f"Wrote {written} records to {output}")
+
+
+def serve(frames, ADDR, PORT, speed=1.0):
+    """Wait for one client, then send frames paced by their RTC time divided by speed"""
+    s = socket.socket()
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind((ADDR, PORT))
+    s.listen(1)
+    print(f"Listening on {ADDR}:{PORT}, waiting for connection")
+    conn, addr = s.accept()
+    print(f"Accepted connection from {addr}")
+    sent = 0
+    started = monotonic()
+    first_rtc = None
+    try:
+        for frame in frames:
+            if first_rtc is None:
+                first_rtc = frame.rtc_time
+            if speed > 0:
+                delay = (frame.rtc_time - first_rtc) / 1_000_000 / speed - (monotonic() - started)
+                if delay > 0:
+                    sleep(delay)
+            conn.sendall(frame.data)
+            sent += 1
+    except (ConnectionResetError, BrokenPipeError) as error:
+        print(f"socket connection error: {error}")
+    except KeyboardInterrupt:
+        print("Closing")
+    finally:
+        elapsed = monotonic() - started
+        print(f"Sent {sent} records in {elapsed:.1f}s ({sent / elapsed if elapsed else 0:.0f} records/s)")
+        conn.close()
+        s.close()
+
+
+def main():
+    args = get_args()
+    if args.output and args.duration is None and args.count is None:
+        print("--duration or --count is required with --output")
+        exit(1)
+    generator = traffic_generator(args)
+    frames = generator.frames(duration=args.duration, count=args.count)
+    if args.output:
+        write_file(frames, args.output)
+    else:
+        serve(frames, args.ADDR, args.PORT, args.speed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""
+Bulk import of archived hex captures (amb.out / out.log) into the passes table.
+
+Captures are split into chunks of lines that a process pool decodes in
+parallel. Passes are deduplicated by (decoder_id, pass_id), the unique key
+of the passes table, sorted by RTC time and merged into crossings by the same multi-hit
+window as amb_client.py (the other hits go to discarded_passes). They are
+loaded with multi-row INSERT IGNORE statements (or LOAD DATA LOCAL INFILE
+with --load-data), so passes already in the DB are skipped and a season can
+be re-imported safely.
+
+    ./amb_import.py archive/*.out
+    ./amb_import.py -w 8 --load-data archive/*.out
+    ./amb_import.py --dry-run archive/*.out
+"""
+import os
+import logging
+import tempfile
+from time import perf_counter
+from argparse import ArgumentParser
+from multiprocessing import Pool
+
+import mysql.connector
+from AmbP3.config import Config, DEFAULT_CONFIG_FILE
+from AmbP3.decoder import p3decode
+from AmbP3.encoder import crc_ok
+from AmbP3.write import passing_columns
+from AmbP3.dedup import PassDeduplicator, DEFAULT_WINDOW_MS
+
+PASS_COLUMNS = ('pass_id', 'transponder_id', 'rtc_time', 'strength', 'hits', 'flags', 'decoder_id')
+DISCARDED_COLUMNS = ('decoder_id', 'pass_id', 'kept_pass_id', 'rtc_offset', 'strength', 'hits')
+REQUIRED_COLUMNS = ('pass_id', 'transponder_id', 'rtc_time', 'decoder_id')  # NOT NULL in schema
+STATUS_TOR = b'\x02\x00'
+ESCAPE = 0x8d
+DEFAULT_CHUNK_LINES = 20000
+DEFAULT_BATCH_ROWS = 1000
+
+
+def get_args():
+    parser = ArgumentParser()
+    parser.add_argument("FILES", help="hex capture files, one record per line", nargs='+')
+    parser.add_argument("-f", "--config", dest='config_file', default=DEFAULT_CONFIG_FILE)
+    parser.add_argument("-w", "--workers", help="decoding processes", default=os.cpu_count(), type=int)
+    parser.add_argument("--chunk-lines", help="lines per decoding task", default=DEFAULT_CHUNK_LINES, type=int)
+    parser.add_argument("--batch-rows", help="rows per INSERT statement", default=DEFAULT_BATCH_ROWS, type=int)
+    parser.add_argument("--load-data", help="load with LOAD DATA LOCAL INFILE instead of INSERT", action='store_true')
+    parser.add_argument("--dry-run", help="decode and deduplicate only, do not touch the DB", action='store_true')
+    parser.add_argument("--dedup-window-ms", dest='dedup_window_ms', type=int,
+                        help="merge passes of a transponder within this many ms into the best one (0 disables)")
+    return parser.parse_args()
+
+
+def read_chunks(files, chunk_lines):
+    """Yield lists of at most chunk_lines non-empty lines across all files"""
+    chunk = []
+    for path in files:
+        with open(path, 'r', errors='replace') as capture:
+            for line in capture:
+                line = line.strip()
+                if line:
+                    chunk.append(line)
+                    if len(chunk) >= chunk_lines:
+                        yield chunk
+                        chunk = []
+    if chunk:
+        yield chunk
+
+
+def decode_chunk(lines):
+    """
+    Decode one chunk in a worker. Returns (pass rows, frames, undecodable lines or bad CRCs).
+    STATUS records, the bulk of a capture, are recognized from the header and skipped without decoding.
+    """
+    rows = []
+    frames = errors = 0
+    for line in lines:
+        try:
+            data = bytes.fromhex(line)
+        except ValueError:
+            errors += 1  # Not a hex record, e.g. a debug log line
+            continue
+        frames += 1
+        if data[8:10] == STATUS_TOR and ESCAPE not in data[1:10]:
+            continue
+        if not crc_ok(data):
+            errors += 1
+            continue
+        try:
+            decoded_header, decoded_body = p3decode(data)
+            columns = passing_columns(decoded_body)
+        except (ValueError, IndexError, KeyError):
+            errors += 1
+            continue
+        if columns and all(column in columns for column in REQUIRED_COLUMNS):
+            rows.append(tuple(columns.get(column) for column in PASS_COLUMNS))
+    return rows, frames, errors
+
+
+def decode_files(files, workers, chunk_lines):
+    """Decode every capture in parallel and return ({(decoder_id, pass_id): row}, frames, errors, duplicates)"""
+    passes = {}
+    frames = errors = duplicates = 0
+    decoder_index = PASS_COLUMNS.index('decoder_id')
+    with Pool(workers, initializer=logging.disable, initargs=(logging.CRITICAL,)) as pool:
+        for rows, chunk_frames, chunk_errors in pool.imap_unordered(decode_chunk, read_chunks(files, chunk_lines)):
+            frames += chunk_frames
+            errors += chunk_errors
+            for row in rows:
+                key = (row[decoder_index], row[0])
+                if key in passes:
+                    duplicates += 1
+                else:
+                    passes[key] = row
+    return passes, frames, errors, duplicates
+
+
+def merge_crossings(rows, window_ms):
+    """
+    Merge the multi-hit passes of RTC-ordered rows like amb_client.py does.
+    Returns (kept pass rows, discarded_passes rows), both in RTC order.
+    """
+    deduplicator = PassDeduplicator(window_ms)
+    crossings = []
+    for row in rows:
+        # Decoder time drives the windows; there is no wall clock to expire them by.
+        crossings.extend(deduplicator.add(dict(zip(PASS_COLUMNS, row)), now=0))
+    crossings.extend(deduplicator.flush())
+    kept = [tuple(crossing.kept[column] for column in PASS_COLUMNS) for crossing in crossings]
+    discarded = [(columns['decoder_id'], columns['pass_id'], crossing.kept['pass_id'],
+                  columns['rtc_time'] - crossing.kept['rtc_time'], columns['strength'], columns['hits'])
+                 for crossing in crossings for columns in crossing.discarded]
+    return kept, discarded
+
+
+def insert_rows(connection, rows, batch_rows, table='passes', columns=PASS_COLUMNS):
+    """Multi-row INSERT IGNORE in batches; returns the number of rows inserted"""
+    cursor = connection.cursor()
+    row_values = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    inserted = 0
+    for start in range(0, len(rows), batch_rows):
+        batch = rows[start:start + batch_rows]
+        query = f"INSERT IGNORE INTO {table} ({', '.join(columns)}) VALUES {', '.join([row_values] * len(batch))}"
+        cursor.execute(query, [value for row in batch for value in row])
+        inserted += cursor.rowcount
+        connection.commit()
+    cursor.close()
+    return inserted
+
+
+def load_data(connection, rows):
+    """LOAD DATA LOCAL INFILE from a temporary TSV file; returns the number of rows inserted"""
+    with tempfile.NamedTemporaryFile('w', suffix='.tsv', delete=False) as tsv:
+        for row in rows:
+            tsv.write('\t'.join(r'\N' if value is None else str(value) for value in row) + '\n')
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f"LOAD DATA LOCAL INFILE '{tsv.name}' IGNORE INTO TABLE passes ({', '.join(PASS_COLUMNS)})")
+        inserted = cursor.rowcount
+        connection.commit()
+        cursor.close()
+    finally:
+        os.unlink(tsv.name)
+    return inserted
+
+
+def open_connection(conf, local_infile=False):
+    return mysql.connector.connect(user=conf['mysql_user'], db=conf['mysql_db'], password=conf['mysql_password'],
+                                   host=conf['mysql_host'], port=conf['mysql_port'], allow_local_infile=local_infile)
+
+
+def main():
+    args = get_args()
+    conf = Config(args).conf
+    dedup_window_ms = conf.get('dedup_window_ms')
+    started = perf_counter()
+    passes, frames, errors, duplicates = decode_files(args.FILES, args.workers, args.chunk_lines)
+    decoded_at = perf_counter()
+    decode_seconds = decoded_at - started
+    print(f"Decoded {frames} records from {len(args.FILES)} files with {args.workers} workers in {decode_seconds:.1f}s "
+          f"({frames / decode_seconds if decode_seconds else 0:,.0f} records/s): {len(passes)} passes, "
+          f"{duplicates} duplicates, {errors} undecodable or corrupt records")
+    rows = sorted(passes.values(), key=lambda row: row[PASS_COLUMNS.index('rtc_time')])
+    rows, discarded = merge_crossings(rows, DEFAULT_WINDOW_MS if dedup_window_ms is None else dedup_window_ms)
+    print(f"Merged {len(discarded)} multi-hit passes, {len(rows)} crossings remain")
+    if args.dry_run or not rows:
+        return
+    connection = open_connection(conf, local_infile=args.load_data)
+    try:
+        inserted = load_data(connection, rows) if args.load_data else insert_rows(connection, rows, args.batch_rows)
+        insert_rows(connection, discarded, args.batch_rows, 'discarded_passes', DISCARDED_COLUMNS)
+    finally:
+        connection.close()
+    load_seconds = perf_counter() - decoded_at
+    print(f"Loaded {inserted} new passes ({len(rows) - inserted} already in the DB) in {load_seconds:.1f}s "
+          f"({len(rows) / load_seconds if load_seconds else 0:,.0f} rows/s); total {perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 from mysql.connector import Error as MysqlError
-from time import sleep
+from time import sleep, perf_counter
 import logging
 
 from amb_client import open_mysql_connection
@@ -9,6 +9,8 @@ from AmbP3.time_server import DecoderTime
 from AmbP3.time_client import TimeClient
 from AmbP3.time_server import TIME_IP
 from AmbP3.time_server import TIME_PORT
+from AmbP3.sectors import TrackLayout
+from AmbP3 import metrics
 
 # PASSES = [ "db_entry_id", "pass_id", "transponder_id", "rtc_time", "strength", "hits", "flags", "decoder_id" ]
 DEFAULT_HEAT_DURATION = 590
@@ -18,6 +20,12 @@ DEFAULT_MINIMUM_LAP_TIME = 10
 DEFAULT_HEAT_SETTINGS = ["heat_duration", "heat_cooldown"]
 MAX_GET_TIME_ATTEMPTS = 30
 
+HEAT_PROCESS_SECONDS = metrics.histogram('amb_heat_process_seconds', 'Duration of one heat pass-processing run')
+HEAT_PENDING_PASSES = metrics.gauge('amb_heat_pending_passes', 'Passes not yet turned into laps at the last run')
+HEAT_ID = metrics.gauge('amb_heat_id', 'heat_id of the running heat')
+LAPS_INSERTED = metrics.counter('amb_laps_inserted_total', 'Passes recorded as laps')
+PASSES_REJECTED = metrics.counter('amb_passes_rejected_total', 'Passes deleted for beating the minimum lap time')
+
 
 def IsInt(string):
     try:
@@ -71,6 +79,14 @@ def sql_select(cursor, query):
     return results
 
 
+def lap_pass_filter(conf):
+    "SQL condition keeping only finish line passes when a track layout with sector or pit loops is configured"
+    if not conf.get('track'):
+        return ""
+    decoder_ids = ", ".join(str(decoder_id) for decoder_id in TrackLayout.load(conf['track']).finish_decoder_ids)
+    return f" and decoder_id in ({decoder_ids})"
+
+
 class Pass():
     def __init__(self, db_entry_id, pass_id, transponder_id, rtc_time, strength, hits, flags, decoder_id):
         self.db_entry_id = db_entry_id
@@ -93,6 +109,7 @@ class Heat():
         self.heat_cooldown = heat_cooldown
         self.race_flag = race_flag
         self.minimum_lap_time = minimum_lap_time
+        self.lap_pass_filter = lap_pass_filter(conf)
         self.cursor = self.mysql.cursor()
         self.mycon = (self.mysql, self.cursor)
         " GET HEAT SETTINGS BEFORE POTENTIALLY CREATING NEW HEAT,"
@@ -117,7 +134,7 @@ class Heat():
         if self.rtc_max_duration is None:
                 self.rtc_max_duration = self.rtc_time_start + ((self.heat_duration + self.heat_cooldown) * 1000000)
         if bool(self.first_pass_id) is True:
-            self.first_transponder = self.get_transponder(self.first_pass_id)
+            self.first_transponder = self.get_transponder(self.rtc_time_start)
 
     def get_heat(self):
         """ get's current running heat, if no heat is running will create one """
@@ -144,11 +161,14 @@ class Heat():
         else:
             return True
 
-    def get_pass_timestamp(self, pass_id):
-        return sql_select(self.cursor, "select rtc_time from passes where pass_id={}".format(pass_id))[0][0]
+    def get_pass_timestamp(self, decoder_id, pass_id):
+        "pass numbers are counted per decoder, so a pass is identified by both"
+        query = f"select rtc_time from passes where decoder_id={decoder_id} and pass_id={pass_id}"
+        return sql_select(self.cursor, query)[0][0]
 
-    def get_transponder(self, pass_id):
-        query = "select transponder_id from passes where pass_id={}".format(pass_id)
+    def get_transponder(self, rtc_time):
+        "transponder of the heat's first pass, found by its RTC time"
+        query = f"select transponder_id from passes where rtc_time={rtc_time}{self.lap_pass_filter} limit 1"
         result = sql_select(self.cursor, query)[0][0]
         transponder_id = result
         return transponder_id
@@ -157,15 +177,21 @@ class Heat():
         "process heat_passes"
         if bool(self.first_pass_id):
             sleep(0.5)
+            started = perf_counter()
+            HEAT_ID.set(self.heat_id)
             self.rtc_max_duration = self.rtc_time_start + ((self.heat_duration + self.heat_cooldown) * 1000000)
-            self.first_transponder = self.get_transponder(self.first_pass_id)
+            self.first_transponder = self.get_transponder(self.rtc_time_start)
             """ FIX ME heat_not_processed_passes_query MUST BE MORE SIMPLE """
-            all_heat_passes_query = f"""select * from passes where pass_id >= {self.first_pass_id} and rtc_time <=
-{self.rtc_max_duration} union all ( select * from passes where rtc_time > {self.rtc_max_duration} limit 1 )"""
+            # Heats are scanned by RTC time: pass numbers are per decoder and say nothing about order.
+            all_heat_passes_query = f"""select * from passes where rtc_time >= {self.rtc_time_start} and rtc_time <=
+{self.rtc_max_duration}{self.lap_pass_filter} union all ( select * from passes where rtc_time > {self.rtc_max_duration}
+{self.lap_pass_filter} order by rtc_time limit 1 )"""
             heat_not_processed_passes_query = f"""select passes.* from ( {all_heat_passes_query} ) as passes left join laps on
-passes.pass_id = laps.pass_id where laps.heat_id is NULL"""
+passes.decoder_id = laps.decoder_id and passes.pass_id = laps.pass_id where laps.heat_id is NULL
+order by passes.rtc_time"""
             #  print(heat_not_processed_passes_query)
             not_processed_passes = sql_select(self.cursor, heat_not_processed_passes_query)
+            HEAT_PENDING_PASSES.set(len(not_processed_passes))
             if self.dt.decoder_time > self.rtc_time_end:
                 self.wave_finish_flag()
             if self.dt.decoder_time > self.rtc_max_duration:
@@ -180,9 +206,10 @@ passes.pass_id = laps.pass_id where laps.heat_id is NULL"""
                     self.add_pass_to_laps(self.heat_id, pas)
                     if not self.finish_heat and pas.rtc_time > self.rtc_time_end:
                         self.wave_finish_flag()
+            HEAT_PROCESS_SECONDS.observe(perf_counter() - started)
 
     def finish_heat(self):
-        query = f"select pass_id from laps where heat_id={self.heat_id} order by pass_id desc limit 1"
+        query = f"select pass_id from laps where heat_id={self.heat_id} order by rtc_time desc limit 1"
         result = sql_select(self.cursor, query)
         pass_id = result[0][0] if len(result) > 0 else "NULL"
         logging.debug(f"finish heat_id {self.heat_id}, with pass_id: {pass_id}")
@@ -194,7 +221,7 @@ passes.pass_id = laps.pass_id where laps.heat_id is NULL"""
     def valid_lap_time(self, pas):
         self.previous_lap_times = {}
         previous_lap_query = f"""select rtc_time from laps where heat_id={self.heat_id}
- and transponder_id={pas.transponder_id} and pass_id<{pas.pass_id} order by pass_id desc limit 1"""
+ and transponder_id={pas.transponder_id} and rtc_time<{pas.rtc_time} order by rtc_time desc limit 1"""
 
         if pas.transponder_id not in self.previous_lap_times:
             qresult = sql_select(self.cursor, previous_lap_query)
@@ -206,8 +233,9 @@ passes.pass_id = laps.pass_id where laps.heat_id is NULL"""
         if pas.rtc_time - self.previous_lap_times[pas.transponder_id] > self.minimum_lap_time * 1000000:
             return True
         else:
-            query = f"delete from passes where pass_id = {pas.pass_id}"
+            query = f"delete from passes where decoder_id = {pas.decoder_id} and pass_id = {pas.pass_id}"
             sql_write(self.mycon, query)
+            PASSES_REJECTED.inc()
             return False
 
     def wave_finish_flag(self):
@@ -219,12 +247,14 @@ passes.pass_id = laps.pass_id where laps.heat_id is NULL"""
         lap = {"heat_id": heat_id,
                "pass_id": pas.pass_id,
                "transponder_id": pas.transponder_id,
-               "rtc_time": pas.rtc_time}
+               "rtc_time": pas.rtc_time,
+               "decoder_id": pas.decoder_id}
         keys = ", ".join(lap.keys())
         values = tuple(lap.values())
         if self.valid_lap_time(pas):
             query = "insert into laps ({}) values {}".format(keys, values)
             sql_write(self.mycon, query)
+            LAPS_INSERTED.inc()
         else:
             pass
 
@@ -255,8 +285,8 @@ passes.pass_id = laps.pass_id where laps.heat_id is NULL"""
             sleep(SLEEP_TIME)
 
         while True:
-            query = f"""select * from passes where pass_id > ( select pass_id from laps order by pass_id desc limit 1 )
-and rtc_time > {green_flag_time} limit 1"""
+            query = f"""select * from passes where rtc_time > ( select coalesce(max(rtc_time), 0) from laps )
+and rtc_time > {green_flag_time}{self.lap_pass_filter} order by rtc_time limit 1"""
             result = sql_select(cursor, query)
 
             if not len(result) > 0:
@@ -340,6 +370,8 @@ def main():
     config = get_args()
     conf = config.conf
     logging.basicConfig(level=logging.DEBUG)
+    if conf.get('metrics_port'):
+        metrics.start_http_server(conf['metrics_port'])
     dt = DecoderTime(0)
     TimeClient(dt, TIME_IP, TIME_PORT)
     while True:
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+"""
+Per-stage latency report of pass traces.
+
+Merges trace dumps (--trace-dump files of amb_client.py and web_app.py) and
+/api/traces URLs of running web_app processes by pass, then prints latency
+percentiles between consecutive stages and from socket receive to each stage.
+
+    ./amb_trace.py /tmp/client.trace /tmp/web.trace
+    ./amb_trace.py /tmp/client.trace http://localhost:5000/api/traces
+"""
+import json
+from urllib.request import urlopen
+from argparse import ArgumentParser
+from AmbP3 import tracing
+
+
+def get_args():
+    parser = ArgumentParser()
+    parser.add_argument("SOURCES", help="trace dump files or /api/traces URLs", nargs='+')
+    parser.add_argument("-o", "--output", help="also write the merged traces to this file")
+    args = parser.parse_args()
+    return args
+
+
+def read_traces(source):
+    if source.startswith(('http://', 'https://')):
+        with urlopen(source) as response:
+            return json.load(response)
+    with open(source) as dump_file:
+        return [json.loads(line) for line in dump_file if line.strip()]
+
+
+def main():
+    args = get_args()
+    merged = tracing.merge(read_traces(source) for source in args.SOURCES)
+    if args.output:
+        with open(args.output, 'w') as output:
+            for key, stages in merged.items():
+                output.write(json.dumps({'key': list(key), 'stages': stages}) + '\n')
+    print('\n'.join(tracing.report(merged)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Minimal benchmark harness used by benchmarks/run.py.
+
+Each benchmark is a setup function returning a zero-argument callable, or
+(callable, ops) when the number of operations depends on its fixture. The
+callable is timed in rounds of at least --min-time seconds and the best round
+is reported as ops/sec; one extra call runs under tracemalloc to report the
+peak memory it allocates. Results can be saved as a JSON baseline and later
+runs compared against it.
+"""
+import gc
+import json
+import platform
+import tracemalloc
+from time import perf_counter
+
+REGRESSION_THRESHOLD = 0.10  # Slower (or bigger) than the baseline by more than this is flagged
+
+BENCHMARKS = {}
+
+
+def benchmark(name, ops=1):
+    """
+    Register a setup function. ops is the number of operations one call of the returned callable
+    performs; a setup returning (callable, ops) overrides it, so fixtures are only built when run.
+    """
+    def register(setup):
+        BENCHMARKS[name] = (setup, ops)
+        return setup
+    return register
+
+
+def time_callable(func, min_time, rounds):
+    """Best ops/sec over rounds, each calling func repeatedly for at least min_time seconds"""
+    func()  # Warm up caches and lazy imports
+    best = 0.0
+    for _ in range(rounds):
+        calls = 0
+        gc.disable()
+        start = perf_counter()
+        elapsed = 0.0
+        while elapsed < min_time:
+            func()
+            calls += 1
+            elapsed = perf_counter() - start
+        gc.enable()
+        best = max(best, calls / elapsed)
+    return best
+
+
+def peak_memory(func):
+    """Peak bytes allocated by one call of func"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def run(names, min_time=0.5, rounds=3):
+    results = {}
+    for name in names:
+        setup, ops = BENCHMARKS[name]
+        func = setup()
+        if isinstance(func, tuple):
+            func, ops = func
+        calls_per_sec = time_callable(func, min_time, rounds)
+        results[name] = {'ops_per_sec': calls_per_sec * ops, 'peak_bytes': peak_memory(func)}
+        print(f"{name:<36} {results[name]['ops_per_sec']:>14,.0f} ops/s {results[name]['peak_bytes'] / 1024:>10,.1f} KiB",
+              flush=True)
+    return results
+
+
+def save_baseline(path, results):
+    baseline = {'python': platform.python_version(), 'machine': platform.machine(), 'results': results}
+    with open(path, 'w') as baseline_file:
+        json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+    print(f"Saved baseline to {path}")
+
+
+def compare(path, results, threshold=REGRESSION_THRESHOLD):
+    """Print the change against a saved baseline. Returns the names of regressed benchmarks."""
+    with open(path) as baseline_file:
+        baseline = json.load(baseline_file)['results']
+    regressions = []
+    print(f"\n{'benchmark':<36} {'ops/s':>10} {'memory':>10}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<36} {'new':>10} {'new':>10}")
+            continue
+        speed = result['ops_per_sec'] / base['ops_per_sec'] - 1
+        memory = result['peak_bytes'] / base['peak_bytes'] - 1 if base['peak_bytes'] else 0.0
+        regressed = speed < -threshold or memory > threshold
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<36} {speed:>+10.1%} {memory:>+10.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
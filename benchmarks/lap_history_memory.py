@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Memory used by the per-transponder lap history of an all-day session.
+
+Compares the columnar LapHistory with the previous layout (a float list plus
+one dict per lap holding a datetime), and with every history served once as
+JSON, which leaves the bounded cache of serialized blocks behind.
+
+    python benchmarks/lap_history_memory.py --ponders 100 --laps 5000
+"""
+import os
+import sys
+import random
+import tracemalloc
+from datetime import datetime
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from AmbP3.lap_history import LapHistory  # noqa: E402
+
+START_RTC = 1700000000000000
+
+
+def get_args():
+    parser = ArgumentParser()
+    parser.add_argument("-t", "--ponders", help="number of transponders", default=100, type=int)
+    parser.add_argument("-n", "--laps", help="laps per transponder", default=5000, type=int)
+    return parser.parse_args()
+
+
+def session(n_laps):
+    random.seed(1)
+    rtc_time = START_RTC
+    for _ in range(n_laps):
+        lap_time = random.gauss(32.0, 1.5)
+        rtc_time += int(lap_time * 1000000)
+        yield lap_time, rtc_time
+
+
+def build_dicts(n_ponders, n_laps):
+    """The previous layout: pd['laps'] float list plus pd['lap_history'] dict list"""
+    ponders = {}
+    for ponder_id in range(n_ponders):
+        laps, history = [], []
+        for lap_time, rtc_time in session(n_laps):
+            laps.append(lap_time)
+            history.append({'lap_number': len(laps), 'lap_time': lap_time,
+                            'timestamp': datetime.fromtimestamp(rtc_time / 1000000.0),
+                            'ponder_id': ponder_id, 'car_number': 'Unknown'})
+        ponders[ponder_id] = (laps, history)
+    return ponders
+
+
+def build_columnar(n_ponders, n_laps):
+    ponders = {}
+    for ponder_id in range(n_ponders):
+        history = LapHistory(ponder_id, 'Unknown')
+        for lap_time, rtc_time in session(n_laps):
+            history.append(lap_time, rtc_time)
+        ponders[ponder_id] = history
+    return ponders
+
+
+def build_served(n_ponders, n_laps):
+    ponders = build_columnar(n_ponders, n_laps)
+    for history in ponders.values():
+        history.to_json()
+    return ponders
+
+
+def measure(build, n_ponders, n_laps):
+    tracemalloc.start()
+    data = build(n_ponders, n_laps)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return current, peak
+
+
+def main():
+    args = get_args()
+    total = args.ponders * args.laps
+    print(f"{args.ponders} transponders x {args.laps} laps = {total} laps")
+    print(f"{'layout':>12} {'retained MiB':>14} {'bytes/lap':>10} {'peak MiB':>10}")
+    for name, build in (('dicts', build_dicts), ('columnar', build_columnar), ('served', build_served)):
+        current, peak = measure(build, args.ponders, args.laps)
+        print(f"{name:>12} {current / 2 ** 20:>14.1f} {current / total:>10.1f} {peak / 2 ** 20:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
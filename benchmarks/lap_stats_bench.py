@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Per-lap cost of the dashboard statistics over a long endurance session.
+
+Compares the incremental LapStats object with the old approach of recomputing
+std/mean over the whole lap list on every lap. The incremental cost should stay
+flat while the recompute cost grows with the number of laps.
+
+    python benchmarks/lap_stats_bench.py --laps 2000
+"""
+import os
+import sys
+import random
+from time import perf_counter
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from AmbP3.lap_stats import LapStats  # noqa: E402
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def get_args():
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--laps", help="laps in the session", default=2000, type=int)
+    parser.add_argument("-b", "--bucket", help="laps per reported bucket", default=250, type=int)
+    return parser.parse_args()
+
+
+def recompute_stats(laps):
+    """The pre-LapStats calculation: full std plus mean over the last 10 laps."""
+    if np is not None:
+        std_dev = np.std(laps) if len(laps) > 1 else 0.0
+        moving_avg = np.mean(laps[-10:])
+    else:
+        mean = sum(laps) / len(laps)
+        std_dev = (sum((lap - mean) ** 2 for lap in laps) / len(laps)) ** 0.5
+        moving_avg = sum(laps[-10:]) / len(laps[-10:])
+    return std_dev, moving_avg
+
+
+def run(n_laps, bucket):
+    random.seed(1)
+    lap_times = [random.gauss(32.0, 1.5) for _ in range(n_laps)]
+
+    stats = LapStats()
+    laps = []
+    incremental = []
+    recompute = []
+    for lap_time in lap_times:
+        start = perf_counter()
+        stats.update(lap_time)
+        stats.std_dev, stats.moving_avg
+        incremental.append(perf_counter() - start)
+
+        laps.append(lap_time)
+        start = perf_counter()
+        recompute_stats(laps)
+        recompute.append(perf_counter() - start)
+
+    print(f"{'laps':>12} {'incremental us/lap':>20} {'recompute us/lap':>18}")
+    for first in range(0, n_laps, bucket):
+        last = min(first + bucket, n_laps)
+        inc = sum(incremental[first:last]) / (last - first) * 1e6
+        rec = sum(recompute[first:last]) / (last - first) * 1e6
+        print(f"{first + 1:>5}-{last:<6} {inc:>20.2f} {rec:>18.2f}")
+
+    expected_std, expected_avg = recompute_stats(laps)
+    print(f"std_dev: {stats.std_dev:.6f} (recompute {float(expected_std):.6f}), "
+          f"moving_avg: {stats.moving_avg:.6f} (recompute {float(expected_avg):.6f})")
+
+
+def main():
+    args = get_args()
+    run(args.laps, args.bucket)
+
+
+if __name__ == "__main__":
+    main()
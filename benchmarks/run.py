@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+"""
+Benchmark suite for the decode, framing, CRC, heat and web paths.
+
+Fixtures come from test_server/amb.out and from synthetic data built here, so
+no decoder, MySQL server or network is needed. Heat processing runs the real
+Heat.process_heat_passes queries against an in-memory SQLite database.
+
+    python benchmarks/run.py                  # run everything
+    python benchmarks/run.py -k decode        # only benchmarks whose name contains "decode"
+    python benchmarks/run.py --save           # store results as the local baseline
+    python benchmarks/run.py --compare        # compare against the local baseline
+
+Exits with status 1 when --compare finds a benchmark more than 10% slower or bigger.
+Logging is disabled while benchmarking so log output does not skew the timings.
+"""
+import os
+import re
+import sys
+import logging
+import random
+import sqlite3
+from argparse import ArgumentParser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+import harness  # noqa: E402
+from harness import benchmark  # noqa: E402
+from AmbP3 import crc16  # noqa: E402
+from AmbP3.decoder import Connection, p3decode  # noqa: E402
+from AmbP3.lap_stats import LapStats  # noqa: E402
+from AmbP3.traffic import TrafficGenerator  # noqa: E402
+
+CAPTURE = os.path.join(REPO_DIR, 'test_server', 'amb.out')
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, '.baseline.json')
+BASE_RTC = 1_700_000_000_000_000
+PASSING_TOR = b'\x01\x00'
+
+# Synthetic session used by the heat and web benchmarks.
+N_TRANSPONDERS = 20
+N_LAPS = 19  # Fits a 590 s heat at ~30 s laps
+
+
+def get_args():
+    parser = ArgumentParser()
+    parser.add_argument("-k", "--filter", help="only run benchmarks whose name contains this", default='')
+    parser.add_argument("-t", "--min-time", help="seconds per timing round", default=0.5, type=float)
+    parser.add_argument("-r", "--rounds", help="timing rounds per benchmark (best is reported)", default=3, type=int)
+    parser.add_argument("-s", "--scale", help="copies of the capture in the large framing fixture", default=20, type=int)
+    parser.add_argument("--save", help="save results as baseline", nargs='?', const=DEFAULT_BASELINE)
+    parser.add_argument("--compare", help="compare results with a baseline", nargs='?', const=DEFAULT_BASELINE)
+    parser.add_argument("-l", "--list", help="list benchmarks and exit", action='store_true')
+    return parser.parse_args()
+
+
+# --- Fixtures ---
+def capture_frames():
+    """Frames of test_server/amb.out as bytes"""
+    with open(CAPTURE) as capture:
+        return [bytes.fromhex(line.strip()) for line in capture if line.strip()]
+
+
+def synthetic_frames():
+    """Ten minutes of 120 cars with multi-hit duplicates"""
+    generator = TrafficGenerator(transponders=120, lap_mean=12.0, hits=3, seed=1)
+    return [frame.data for frame in generator.frames(duration=600)]
+
+
+def passing_frames():
+    return [frame for frame in capture_frames() if frame[8:10] == PASSING_TOR]
+
+
+def synthetic_passes(n_transponders=N_TRANSPONDERS, n_laps=N_LAPS, seed=1):
+    """(pass_id, transponder_id, rtc_time) of a heat, in RTC order"""
+    rng = random.Random(seed)
+    passes = []
+    for transponder_id in range(4000000, 4000000 + n_transponders):
+        rtc_time = BASE_RTC + rng.randint(0, 5_000_000)
+        for _ in range(n_laps + 1):
+            passes.append((transponder_id, rtc_time))
+            rtc_time += int(rng.gauss(30.0, 0.8) * 1_000_000)
+    passes.sort(key=lambda p: p[1])
+    return [(pass_id, transponder_id, rtc_time) for pass_id, (transponder_id, rtc_time) in enumerate(passes, 1)]
+
+
+# --- Decode / framing / CRC ---
+@benchmark('decode.p3decode_passing')
+def bench_p3decode_passing():
+    frames = passing_frames()
+    return lambda: [p3decode(frame) for frame in frames], len(frames)
+
+
+@benchmark('decode.p3decode_capture')
+def bench_p3decode_capture():
+    frames = capture_frames()
+    return lambda: [p3decode(frame) for frame in frames], len(frames)
+
+
+@benchmark('framing.split_records')
+def bench_split_records():
+    connection = Connection('127.0.0.1', 0)
+    frames = capture_frames()
+    data = b''.join(frames)
+    return lambda: connection.split_records(data), len(frames)
+
+
+def bench_split_records_large():
+    connection = Connection('127.0.0.1', 0)
+    frames = capture_frames()
+    data = b''.join(frames) * ARGS.scale
+    return lambda: connection.split_records(data), len(frames) * ARGS.scale
+
+
+@benchmark('framing.split_records_synthetic')
+def bench_split_records_synthetic():
+    connection = Connection('127.0.0.1', 0)
+    frames = synthetic_frames()
+    data = b''.join(frames)
+    return lambda: connection.split_records(data), len(frames)
+
+
+@benchmark('crc.crc16_calc')
+def bench_crc16():
+    table = crc16.table()
+    messages = []
+    for frame in capture_frames():
+        frame = bytearray(frame)
+        frame[4:6] = b'\x00\x00'
+        messages.append(frame.hex())
+    return lambda: [crc16.calc(message, table) for message in messages], len(messages)
+
+
+# --- Heat processing ---
+def heat_database(passes):
+    """In-memory SQLite with the schema's passes/laps/heats tables"""
+    db = sqlite3.connect(':memory:', check_same_thread=False)
+    db.executescript("""
+        CREATE TABLE passes (db_entry_id INTEGER PRIMARY KEY, pass_id INT, transponder_id INT, rtc_time INT,
+                             strength INT, hits INT, flags INT, decoder_id INT, UNIQUE (decoder_id, pass_id));
+        CREATE TABLE laps (heat_id INT, pass_id INT, transponder_id INT, rtc_time INT, decoder_id INT,
+                           PRIMARY KEY (decoder_id, pass_id));
+        CREATE TABLE heats (heat_id INTEGER PRIMARY KEY, heat_finished INT DEFAULT 0, first_pass_id INT,
+                            last_pass_id INT, rtc_time_start INT, rtc_time_end INT, race_flag INT DEFAULT 0,
+                            rtc_time_max_end INT);
+        CREATE INDEX laps_transponder ON laps (heat_id, transponder_id, rtc_time);
+    """)
+    db.executemany("INSERT INTO passes VALUES (NULL, ?, ?, ?, 100, 20, 0, 1)", passes)
+    return db
+
+
+class SQLiteCursor:
+    """sqlite3 cursor accepting the MySQL dialect used by Heat"""
+    # SQLite does not allow a parenthesized SELECT ... LIMIT as a UNION member.
+    UNION_LIMIT = re.compile(r'union all \(\s*(select .*? limit 1)\s*\)', re.S)
+
+    def __init__(self, db):
+        self.cursor = db.cursor()
+
+    def execute(self, query, params=()):
+        return self.cursor.execute(self.UNION_LIMIT.sub(r'union all select * from (\1)', query), params)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+
+@benchmark('heat.process_heat_passes', ops=N_TRANSPONDERS * (N_LAPS + 1))
+def bench_process_heat_passes():
+    import amb_laps
+    from AmbP3.time_server import DecoderTime
+    amb_laps.sleep = lambda seconds: None  # process_heat_passes waits 0.5 s for the DB per call
+    passes = synthetic_passes()
+    db = heat_database(passes)
+    heat = amb_laps.Heat.__new__(amb_laps.Heat)
+    heat.heat_id = 1
+    heat.heat_duration = amb_laps.DEFAULT_HEAT_DURATION
+    heat.heat_cooldown = amb_laps.DEFAULT_HEAT_COOLDOWN
+    heat.minimum_lap_time = amb_laps.DEFAULT_MINIMUM_LAP_TIME
+    heat.lap_pass_filter = amb_laps.lap_pass_filter({})
+    heat.first_pass_id = passes[0][0]
+    heat.rtc_time_start = passes[0][2]
+    heat.rtc_time_end = heat.rtc_time_start + heat.heat_duration * 1000000
+    heat.heat_finished = 0
+    heat.race_flag = 0
+    heat.dt = DecoderTime(heat.rtc_time_start)
+    heat.cursor = SQLiteCursor(db)
+    heat.mycon = (db, heat.cursor)
+
+    def process():
+        db.execute("DELETE FROM laps")
+        heat.process_heat_passes()
+    return process
+
+
+# --- Web ---
+def web_app_with_session():
+    import web_app
+    web_app.ponder_data.clear()
+    web_app.all_laps_sorted.clear()
+    web_app.response_cache.reset()
+    with web_app.data_lock:
+        web_app.bump_version()
+        for _, transponder_id, rtc_time in synthetic_passes(n_transponders=40, n_laps=200):
+            lap_time = web_app.lap_time_for_pass(transponder_id, rtc_time)
+            web_app.apply_pass(transponder_id, None, rtc_time, lap_time)
+        web_app.publish_view()
+    return web_app
+
+
+@benchmark('web.lap_stats_update', ops=1000)
+def bench_lap_stats():
+    lap_times = [random.Random(1).gauss(30.0, 1.0) for _ in range(1000)]
+
+    def update():
+        stats = LapStats()
+        for lap_time in lap_times:
+            stats.update(lap_time)
+    return update
+
+
+@benchmark('web.apply_pass', ops=N_TRANSPONDERS * (N_LAPS + 1))
+def bench_apply_pass():
+    import web_app
+    passes = synthetic_passes()
+
+    def apply():
+        web_app.ponder_data.clear()
+        web_app.all_laps_sorted.clear()
+        with web_app.data_lock:
+            web_app.bump_version()
+            for _, transponder_id, rtc_time in passes:
+                lap_time = web_app.lap_time_for_pass(transponder_id, rtc_time)
+                web_app.apply_pass(transponder_id, None, rtc_time, lap_time)
+            web_app.publish_view()
+    return apply
+
+
+@benchmark('web.api_all_laps_cached')
+def bench_api_all_laps_cached():
+    client = web_app_with_session().app.test_client()
+    return lambda: client.get('/api/all_laps')
+
+
+@benchmark('web.api_all_laps_rebuild')
+def bench_api_all_laps_rebuild():
+    web_app = web_app_with_session()
+    client = web_app.app.test_client()
+
+    def rebuild():
+        with web_app.data_lock:
+            web_app.bump_version()
+            web_app.publish_view()
+        client.get('/api/all_laps')
+    return rebuild
+
+
+@benchmark('web.api_laps_full_rebuild')
+def bench_api_laps_rebuild():
+    web_app = web_app_with_session()
+    client = web_app.app.test_client()
+    transponder_id = next(iter(web_app.ponder_data))
+
+    def rebuild():
+        with web_app.data_lock:
+            web_app.bump_version(web_app.ponder_data[transponder_id])
+            web_app.publish_view()
+        client.get(f'/api/laps/{transponder_id}')
+    return rebuild
+
+
+def main():
+    global ARGS
+    ARGS = get_args()
+    logging.disable(logging.CRITICAL)
+    benchmark(f'framing.split_records_x{ARGS.scale}')(bench_split_records_large)
+    names = [name for name in harness.BENCHMARKS if ARGS.filter in name]
+    if ARGS.list:
+        print('\n'.join(names))
+        return
+    results = harness.run(names, min_time=ARGS.min_time, rounds=ARGS.rounds)
+    regressions = harness.compare(ARGS.compare, results) if ARGS.compare else []
+    if ARGS.save:
+        harness.save_baseline(ARGS.save, results)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Request latency of the web_app API while the updater applies passes.
+
+Reader threads call /api/all_laps and /api/laps/<id> through the Flask test
+client while a writer thread applies batches of passes the way the updater
+does. "locked" wraps every API handler in data_lock, as the handlers did before
+they read the published ReadView; "view" serves the current code path, where
+readers never wait for the writer.
+
+Readers pause between requests (--think) like polling browsers; with --think 0
+they saturate the GIL and the tail is dominated by thread scheduling instead.
+
+    python benchmarks/web_contention.py --readers 8 --batch 2000 --seconds 5
+"""
+import os
+import sys
+import random
+import threading
+from functools import wraps
+from time import perf_counter, sleep
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import web_app  # noqa: E402
+
+BASE_RTC = 1_700_000_000_000_000
+API_ENDPOINTS = ('api_all_laps', 'api_lap_details')
+
+
+def get_args():
+    parser = ArgumentParser()
+    parser.add_argument("-p", "--ponders", help="transponders on track", default=40, type=int)
+    parser.add_argument("-l", "--laps", help="laps of history per transponder", default=2000, type=int)
+    parser.add_argument("-r", "--readers", help="concurrent request threads", default=8, type=int)
+    parser.add_argument("-b", "--batch", help="passes applied per writer batch", default=2000, type=int)
+    parser.add_argument("-i", "--interval", help="seconds between writer batches", default=0.05, type=float)
+    parser.add_argument("-t", "--think", help="seconds each reader waits between requests", default=0.005, type=float)
+    parser.add_argument("-s", "--seconds", help="duration of each mode", default=5, type=float)
+    parser.add_argument("-m", "--mode", choices=['locked', 'view', 'both'], default='both')
+    return parser.parse_args()
+
+
+class Track:
+    """Generates passes for every transponder with slightly different lap times"""
+
+    def __init__(self, n_ponders):
+        self.next_pass = {1000 + i: BASE_RTC + i * 100_000 for i in range(n_ponders)}
+
+    def passes(self, count):
+        result = []
+        for _ in range(count):
+            ponder_id = min(self.next_pass, key=self.next_pass.get)
+            rtc_time = self.next_pass[ponder_id]
+            self.next_pass[ponder_id] = rtc_time + int(random.gauss(32.0, 1.0) * 1e6)
+            result.append((ponder_id, rtc_time))
+        return result
+
+
+def apply_batch(passes):
+    """What update_data_from_db does with a fetched batch, without the database and voice."""
+    with web_app.data_lock:
+        web_app.bump_version()
+        for ponder_id, rtc_time in passes:
+            lap_time = web_app.lap_time_for_pass(ponder_id, rtc_time)
+            web_app.apply_pass(ponder_id, None, rtc_time, lap_time)
+        web_app.last_processed_rtc_time = passes[-1][1]
+        web_app.publish_view()
+
+
+def reset_store(track, n_ponders, n_laps):
+    web_app.ponder_data.clear()
+    web_app.all_laps_sorted.clear()
+    web_app.response_cache.reset()
+    apply_batch(track.passes(n_ponders * (n_laps + 1)))
+
+
+def locked(view_function):
+    @wraps(view_function)
+    def wrapper(*args, **kwargs):
+        with web_app.data_lock:
+            return view_function(*args, **kwargs)
+    return wrapper
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def run_mode(mode, args):
+    random.seed(1)
+    track = Track(args.ponders)
+    reset_store(track, args.ponders, args.laps)
+    ponder_ids = list(web_app.ponder_data)
+
+    originals = {name: web_app.app.view_functions[name] for name in API_ENDPOINTS}
+    if mode == 'locked':
+        for name, view_function in originals.items():
+            web_app.app.view_functions[name] = locked(view_function)
+
+    stop = threading.Event()
+    latencies = []
+    batches = []
+
+    def reader(seed):
+        rng = random.Random(seed)
+        client = web_app.app.test_client()
+        local = []
+        while not stop.is_set():
+            if rng.random() < 0.5:
+                url = '/api/all_laps'
+            else:
+                url = f'/api/laps/{rng.choice(ponder_ids)}?summary=1' if rng.random() < 0.5 \
+                    else f'/api/laps/{rng.choice(ponder_ids)}?since_lap={args.laps - 20}'
+            start = perf_counter()
+            client.get(url)
+            local.append(perf_counter() - start)
+            sleep(args.think)
+        latencies.extend(local)
+
+    def writer():
+        while not stop.is_set():
+            passes = track.passes(args.batch)
+            start = perf_counter()
+            apply_batch(passes)
+            batches.append(perf_counter() - start)
+            sleep(args.interval)
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    web_app.app.view_functions.update(originals)
+
+    latencies.sort()
+    print(f"{mode:>7} {len(latencies) / args.seconds:>10.0f} "
+          f"{percentile(latencies, 0.5) * 1e3:>8.2f} {percentile(latencies, 0.99) * 1e3:>8.2f} "
+          f"{latencies[-1] * 1e3:>8.2f} {len(batches):>8} {sum(batches) / len(batches) * 1e3:>9.2f}")
+
+
+def main():
+    args = get_args()
+    print(f"{args.ponders} ponders x {args.laps} laps, {args.readers} readers, "
+          f"{args.batch} passes per batch every {args.interval}s")
+    print(f"{'mode':>7} {'req/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'batches':>8} {'batch ms':>9}")
+    for mode in (['locked', 'view'] if args.mode == 'both' else [args.mode]):
+        run_mode(mode, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,16 @@
 #!/usr/bin/env python
 
 import socket
-from time import sleep
+import threading
+from time import sleep, monotonic
 from argparse import ArgumentParser
-from AmbP3.decoder import hex_to_binary
 from AmbP3.decoder import p3decode
+from AmbP3.encoder import crc_ok
 
 INPUT_FILE = "amb.out"
 ADDR = '127.0.0.1'
 PORT = 12001
+MAX_JUMP = 3600  # Seconds; longer RTC_TIME jumps are taken as clock glitches, not pauses
 
 
 def get_args():
@@ -16,56 +18,105 @@ def get_args():
     parser.add_argument("INPUT_FILE", help="amb.out HEX file location", default=INPUT_FILE, nargs='?')
     parser.add_argument("-l", "--listen-address", help="IP address to bind on",  default=ADDR, dest='ADDR')
     parser.add_argument("-p", "--listen-port", help="PORT to bind on",  default=PORT, dest='PORT', type=int)
-    parser.add_argument("-i", "--interval", help="interval to send data", default=0.5, dest='INTERVAL', type=float)
+    parser.add_argument("-s", "--speed", help="replay speed factor by RTC_TIME, 0 sends as fast as possible",
+                        default=1.0, dest='SPEED', type=float)
+    parser.add_argument("-i", "--interval", help="ignore RTC_TIME and send one timestamp every INTERVAL seconds",
+                        dest='INTERVAL', type=float)
+    parser.add_argument("-g", "--max-gap", help=f"shorten pauses between timestamps to at most MAX_GAP seconds (default {MAX_JUMP})",
+                        dest='MAX_GAP', type=float)
+    parser.add_argument("-v", "--verbose", help="print every frame sent", action='store_true')
     args = parser.parse_args()
     return args
 
 
+def load_capture(INPUT_FILE, MAX_GAP=None):
+    """
+    Parse the capture once into a schedule of (seconds since the first frame, bytes).
+    Frames without RTC_TIME (e.g. STATUS) or with a bad CRC take the time of the
+    frame before them, and consecutive frames with the same time are joined into
+    one send. Pauses longer than MAX_GAP seconds (MAX_JUMP by default) are
+    shortened to it; when RTC_TIME goes backwards, e.g. after a decoder clock
+    reset, the frame is sent without waiting and pacing follows the new clock.
+    """
+    schedule = []
+    max_step = int((MAX_GAP if MAX_GAP is not None else MAX_JUMP) * 1_000_000)
+    last_rtc = None
+    elapsed = 0  # Microseconds of replay time up to last_rtc
+    with open(INPUT_FILE, "r") as fd:
+        for line in fd:
+            data = line.strip()
+            if not data:
+                continue
+            data_bytes = bytes.fromhex(data)
+            rtc_time = None
+            if crc_ok(data_bytes):
+                try:
+                    decoded_header, decoded_body = p3decode(data_bytes)
+                    rtc_time = decoded_body.get('RESULT', {}).get('RTC_TIME') if decoded_body else None
+                except (ValueError, IndexError, KeyError):
+                    pass
+            if rtc_time:
+                rtc_time = int(rtc_time, 16)
+                if last_rtc is not None:
+                    elapsed += min(max(rtc_time - last_rtc, 0), max_step)
+                last_rtc = rtc_time  # Frames read before the first one are sent together with it, at 0.0
+            offset = elapsed / 1_000_000
+            if schedule and schedule[-1][0] == offset:
+                schedule[-1] = (offset, schedule[-1][1] + data_bytes)
+            else:
+                schedule.append((offset, data_bytes))
+    return schedule
+
+
 def create_sock(ADDR, PORT):
     s = socket.socket()
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     s.bind((ADDR, PORT))
-    s.listen(1)
-    print("Listening, waiting for connection")
-    conn, addr = s.accept()
-    print("Accepted connection")
-    return conn, s
+    s.listen(5)
+    print("Listening, waiting for connections")
+    return s
 
 
-def send_net(ADDR, PORT, INPUT_FILE, INTERVAL=0.5):
-    conn, s = create_sock(ADDR, PORT)
-    with open(INPUT_FILE, "r") as fd:
-        while True:
-            data = "{}".format(fd.readline()).rstrip()
-            data_bytes = bytes.fromhex(data)
-            last_entry_timestamp = int(p3decode(hex_to_binary(data))[1]['RESULT']['RTC_TIME'], 16)
-            print(last_entry_timestamp)
-            try:
-                if data_bytes is not None:
-                    conn.send(data_bytes)
-                    print("sending: {}".format(data))
-                    print("sending bytes: {}".format(data_bytes))
-                    sleep(INTERVAL)
-            except (ConnectionResetError, BrokenPipeError) as error:
-                print("socket connection error: {}".format(error))
-                conn.close()
-                s.close()
-                break
-            except (KeyboardInterrupt, TypeError) as error:
-                print("closing socket, connection: {}".format(error))
-                conn.close()
-                s.close()
-                break
-
-    conn.close()
-    s.close()
+def send_net(conn, addr, schedule, SPEED=1.0, INTERVAL=None, verbose=False):
+    """Replay the schedule to one client"""
+    print(f"Accepted connection from {addr}")
+    started = monotonic()
+    sent = 0
+    try:
+        for number, (offset, data_bytes) in enumerate(schedule):
+            due = number * INTERVAL if INTERVAL is not None else offset / SPEED if SPEED > 0 else 0.0
+            delay = due - (monotonic() - started)
+            if delay > 0:
+                sleep(delay)
+            conn.sendall(data_bytes)
+            sent += 1
+            if verbose:
+                print(f"{addr} sending: {data_bytes.hex()}")
+    except (ConnectionResetError, BrokenPipeError) as error:
+        print("socket connection error: {}".format(error))
+    finally:
+        conn.close()
+    elapsed = monotonic() - started
+    print(f"{addr}: replayed {sent} of {len(schedule)} sends ({schedule[-1][0]:.1f}s of decoder time) in {elapsed:.1f}s")
 
 
 def main():
     args = get_args()
-    while True:
-        print("Starting server")
-        send_net(args.ADDR, args.PORT, args.INPUT_FILE, args.INTERVAL)
+    schedule = load_capture(args.INPUT_FILE, args.MAX_GAP)
+    if not schedule:
+        print(f"No frames in {args.INPUT_FILE}")
+        return
+    print(f"Loaded {args.INPUT_FILE}: {len(schedule)} sends covering {schedule[-1][0]:.1f}s of decoder time")
+    s = create_sock(args.ADDR, args.PORT)
+    try:
+        while True:
+            conn, addr = s.accept()
+            threading.Thread(target=send_net, args=(conn, addr, schedule, args.SPEED, args.INTERVAL, args.verbose),
+                             daemon=True).start()
+    except KeyboardInterrupt:
+        print("closing socket")
+    finally:
+        s.close()
 
 
 if __name__ == "__main__":
@@ -1,15 +1,33 @@
 #!/usr/bin/env python
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response, json
 import mysql.connector
-from datetime import datetime
 import time
 import threading
+import atexit
+import copy
+from collections import namedtuple
+from argparse import ArgumentParser
 import numpy as np
-from AmbP3.voice_announcer import VoiceAnnouncer
+from AmbP3.voice_announcer import VoiceAnnouncer, LapTimeMonitor, LapEvent
+from AmbP3.voice_cache import DEFAULT_CACHE_DIR
+from AmbP3.announcement_queue import PRIORITY_ROUTINE, PRIORITY_BEST_LAP, DEFAULT_MAX_AGE
+from AmbP3.lap_stats import LapStats
+from AmbP3.lap_history import LapHistory
+from AmbP3.leaderboard import LatestLaps
+from AmbP3.response_cache import ResponseCache
+from AmbP3.broadcast import Broadcaster, RESYNC
+from AmbP3.state_snapshot import read_snapshot, write_snapshot
+from AmbP3.operator_state import OperatorState
+from AmbP3.analytics import SeasonAnalytics, DatabaseSource, PERIODS, to_rows
+from AmbP3.sectors import TrackLayout, SectorTimer, recompute, best_times
+from AmbP3.snapshot_bus import BusPublisher, BusSubscriber
+from AmbP3 import metrics
+from AmbP3 import tracing
 
 # --- Initialization ---
 app = Flask(__name__)
-voice_announcer = VoiceAnnouncer(enabled=True, engine='auto')
+voice_announcer = None # Created at startup, only in the process that computes laps.
+lap_monitor = None     # Standings fed one LapEvent per completed lap; served by /api/standings.
 
 # --- Database Configuration ---
 DB_CONFIG = {
@@ -26,198 +44,587 @@ def get_db_connection():
 
 # --- In-Memory Data Store ---
 # These global variables will hold the entire state of the application.
-all_laps_sorted = []  # A list of the most recent lap from each ponder, sorted by time.
+# They are only touched by writers (updater, settings changes, bus), which serialize on data_lock.
+all_laps_sorted = LatestLaps()  # The most recent lap from each ponder, newest first.
 ponder_data = {}      # A dictionary holding detailed statistics and history for each ponder.
-data_lock = threading.Lock() # A lock to ensure thread-safe access to the data.
+data_lock = threading.Lock() # Serializes writers. API readers never take it.
+
+# --- Published Read View ---
+# After every batch of changes the writer publishes an immutable ReadView by swapping a single
+# reference, so request handlers read a consistent state without locking.
+# Views are never mutated once published; unchanged ponders share their PonderView with the previous view.
+PonderView = namedtuple('PonderView', ['version', 'summary', 'row', 'lap_history', 'lap_count'])
+ReadView = namedtuple('ReadView', ['version', 'rows', 'ponders'])
+current_view = ReadView(0, (), {})
 last_processed_rtc_time = 0 # The timestamp of the last processed record to avoid redundant work.
+session_start_rtc = 0 # History before this RTC time is not loaded (0 loads everything).
+session_key = ('all', None) # The --heat/--session-hours request, which snapshots are matched on.
+operator_state = None # Durable voice/nickname settings (OperatorState), opened at startup.
+bus_publisher = None  # Aggregator mode: sends state and deltas to serving workers.
+bus_subscriber = None # Worker mode: receives state from the aggregator instead of reading the DB.
+pending_events = []   # (topic, event) of stream events waiting for the next publish_view().
+pending_settings = {} # Worker mode: the aggregator's operator settings for ponders not created here yet.
+data_version = 0      # Incremented on every change so API responses can be cached per version.
+response_cache = ResponseCache() # Pre-serialized API bodies, rebuilt only when data_version moves.
+live_events = Broadcaster()      # Pushes lap deltas to every /api/stream client.
+last_update_time = None # time.monotonic() of the updater's last successful poll.
+track_layout = None   # TrackLayout from --track; without one every pass is a finish line crossing.
+sector_timer = None   # Live sector splits and pit events, replayed from history and fed every pass by the updater.
+
+UPDATE_SECONDS = metrics.histogram('amb_web_update_seconds', 'Duration of one updater poll, query included')
+PASSES_APPLIED = metrics.counter('amb_web_passes_applied_total', 'Passes applied to the in-memory lap data')
+UPDATE_ERRORS = metrics.counter('amb_web_update_errors_total', 'Updater polls that failed')
+UPDATER_LAG = metrics.gauge('amb_web_updater_lag_seconds', 'Seconds since the updater last read the database')
+UPDATER_LAG.set_function(lambda: None if last_update_time is None else time.monotonic() - last_update_time)
+DATA_VERSION = metrics.gauge('amb_web_data_version', 'Version of the published lap data')
+DATA_VERSION.set_function(lambda: current_view.version)
+PONDERS = metrics.gauge('amb_web_ponders', 'Ponders with lap data')
+PONDERS.set_function(lambda: len(current_view.ponders))
+ANNOUNCEMENT_QUEUE_DEPTH = metrics.gauge('amb_announcement_queue_depth', 'Announcements waiting to be spoken')
+ANNOUNCEMENT_QUEUE_DEPTH.set_function(
+    lambda: None if voice_announcer is None else voice_announcer.get_metrics().get('depth'))
+
+STREAM_KEEPALIVE = 15            # Seconds between keep-alive comments on idle streams.
+# Internal bookkeeping that /api/laps never sends as-is: the lap history object, statistics and versions.
+LAP_DETAILS_EXCLUDED = ('lap_history', 'stats', 'version')
+MIN_LAP_TIME = 10.0   # Laps outside (MIN_LAP_TIME, MAX_LAP_TIME) seconds are pit stops or misreads.
+MAX_LAP_TIME = 300.0
+MOVING_AVG_WINDOW = 10
+PASS_FETCH_CHUNK = 50000 # Rows fetched per round trip while streaming history at startup.
+DEFAULT_OPERATOR_STATE_FILE = 'operator_state.jsonl'
+DEFAULT_BUS_ADDRESS = '/tmp/amb_web.sock'
+# Season analytics read finished heats from the DB once; only the running heat is re-read.
+analytics = SeasonAnalytics(DatabaseSource(get_db_connection), MIN_LAP_TIME, MAX_LAP_TIME)
 
 
 # --- Data Processing Logic ---
-def calculate_stats(laps):
-    """Calculates standard deviation and moving average for a list of lap times."""
-    if not laps:
-        return None, None
-    
-    std_dev = np.std(laps) if len(laps) > 1 else 0.0
-    
-    # Use all available laps for average if fewer than 10
-    num_laps_for_avg = min(len(laps), 10)
-    moving_avg = np.mean(laps[-num_laps_for_avg:])
-        
-    return std_dev, moving_avg
+def new_ponder_record(ponder_id, car_number):
+    """Creates the in-memory record for a ponder seen for the first time."""
+    car_number = car_number or 'Unknown'
+    record = {
+        'transponder_id': ponder_id,
+        'car_number': car_number,
+        'last_pass_time': None,
+        'lap_history': LapHistory(ponder_id, car_number), # Columnar, append-only
+        'best_lap': float('inf'),
+        'latest_lap': None,
+        'moving_avg_10': None,
+        'std_dev': None,
+        'stats': LapStats(window=MOVING_AVG_WINDOW),
+        'version': data_version,
+        'voice_enabled': False, # Voice is off by default for all ponders.
+        'nickname': '' # Nickname for voice announcements
+    }
+    # Restore what the operator set for this ponder in a previous run (workers get it from the aggregator).
+    saved = operator_state.get(ponder_id) if operator_state is not None else pending_settings.pop(ponder_id, {})
+    record['voice_enabled'] = saved.get('voice_enabled', False)
+    record['nickname'] = saved.get('nickname', '')
+    return record
+
+def bump_version(pd=None, version=None):
+    """
+    Marks the data store (and optionally one ponder) as changed. Must be called with data_lock held.
+    Workers pass the aggregator's version, so every process serves the same ETags.
+    """
+    global data_version
+    data_version = data_version + 1 if version is None else version
+    if pd is not None:
+        pd['version'] = data_version
+
+def format_event(event, data):
+    """Serializes one Server-Sent Event. Done once per event, not once per client."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def publish_ponder_event(event, pd, lap_record=None):
+    """
+    Queues a ponder's dashboard row (and its new lap, if any) for live stream clients.
+    The event goes out from publish_view(), so a client that reacts to it already reads the new view.
+    """
+    latest_lap = all_laps_sorted.get(pd['transponder_id'])
+    if latest_lap is None:
+        return
+    data = {'version': data_version, 'row': all_laps_row(pd, latest_lap)}
+    if lap_record is not None:
+        data['lap'] = lap_record
+    pending_events.append((pd['transponder_id'], (data_version, format_event(event, data))))
+
+def record_lap(pd, lap_time, rtc_time):
+    """Appends a completed lap to a ponder's history and statistics. Returns the new lap record."""
+    history = pd['lap_history']
+    history.append(lap_time, rtc_time)
+    update_stats(pd, lap_time)
+    return history[-1]
+
+def update_stats(pd, lap_time):
+    """Feeds a new lap into the ponder's running statistics and copies the results into its record."""
+    pd['stats'].update(lap_time)
+    copy_stats(pd)
+
+def copy_stats(pd):
+    """Copies the running statistics into the fields served by the API."""
+    stats = pd['stats']
+    pd['std_dev'] = stats.std_dev
+    pd['moving_avg_10'] = stats.moving_avg
+    pd['best_lap'] = stats.best
+    pd['latest_lap'] = stats.latest
+
+def add_laps(pd, lap_times, rtc_times):
+    """
+    Appends many laps (NumPy arrays) to a ponder at once.
+    For a ponder without history the statistics are computed vectorized; otherwise
+    the (short) tail is fed through the running statistics lap by lap.
+    """
+    if len(lap_times) == 0:
+        return
+    history = pd['lap_history']
+    if len(history) == 0:
+        history.extend(lap_times, rtc_times)
+        mean = float(lap_times.mean())
+        pd['stats'] = LapStats.from_summary(
+            len(lap_times), mean, float(((lap_times - mean) ** 2).sum()),
+            float(lap_times.min()), float(lap_times.max()),
+            lap_times[-MOVING_AVG_WINDOW:].tolist(), window=MOVING_AVG_WINDOW)
+        copy_stats(pd)
+    else:
+        for lap_time, rtc_time in zip(lap_times.tolist(), rtc_times.tolist()):
+            record_lap(pd, lap_time, rtc_time)
+
+def lap_time_for_pass(ponder_id, rtc_time):
+    """
+    Returns the lap completed by this pass in seconds, or None if it is the ponder's
+    first pass or an unrealistic lap (pit stop, misread). Must be called with data_lock held.
+    """
+    pd = ponder_data.get(ponder_id)
+    if pd is None or pd['last_pass_time'] is None:
+        return None
+    # A lap is the time between two consecutive passes.
+    lap_time = (rtc_time - pd['last_pass_time']) / 1000000.0
+    # Filter out unrealistic lap times (e.g., pit stops, errors).
+    if MIN_LAP_TIME < lap_time < MAX_LAP_TIME:
+        return lap_time
+    return None
+
+def apply_pass(ponder_id, car_number, rtc_time, lap_time):
+    """
+    Applies one pass, and the lap it completed if lap_time is set, to the store.
+    Used by the updater and, with the aggregator's results, by serving workers.
+    Must be called with data_lock held. Returns the ponder record.
+    """
+    # Initialize a data structure for a ponder if it's the first time we see it.
+    if ponder_id not in ponder_data:
+        ponder_data[ponder_id] = new_ponder_record(ponder_id, car_number)
+
+    pd = ponder_data[ponder_id]
+    pd['version'] = data_version
+
+    if lap_time is not None:
+        # Update the ponder's data with the new lap.
+        new_lap_record = record_lap(pd, lap_time, rtc_time)
+
+        # Replace the old "latest lap" for this ponder and move it to the very top.
+        all_laps_sorted.update(ponder_id, new_lap_record)
+        publish_ponder_event('lap', pd, new_lap_record)
+
+    # Update the last pass time to the current one for the next calculation.
+    pd['last_pass_time'] = rtc_time
+    return pd
+
+def apply_settings(transponder_id, values, version=None):
+    """Applies operator settings (voice_enabled, nickname) to a ponder. Must be called with data_lock held."""
+    pd = ponder_data[transponder_id]
+    pd.update(values)
+    bump_version(pd, version)
+    publish_ponder_event('ponder', pd)
+
+def change_settings(transponder_id, values):
+    """
+    Applies operator settings in the process that owns the data: persists them and
+    forwards them to serving workers. Must be called with data_lock held.
+    """
+    apply_settings(transponder_id, values)
+    publish_view()
+    if operator_state is not None:
+        operator_state.set(transponder_id, **values)
+    if bus_publisher is not None:
+        bus_publisher.publish(('settings', data_version, transponder_id, values))
+    if voice_announcer is not None and values.get('nickname'):
+        voice_announcer.prerender([values['nickname']])
+
+def spoken_identifier(pd):
+    """Use nickname if available, otherwise use car_number"""
+    return pd['nickname'] if pd['nickname'] else str(pd['car_number'])
+
+def monitor_lap(pd, lap_time):
+    """
+    Feeds a completed lap to the lap monitor as a LapEvent. Returns whether the monitor
+    found it to be a new personal best. Must be called right after apply_pass, with data_lock held.
+    """
+    if lap_monitor is None:
+        return False
+    lap_us = int(round(lap_time * 1e6))  # lap_time was computed from microsecond RTC times
+    return lap_monitor.on_lap(LapEvent(pd['transponder_id'], len(pd['lap_history']), lap_us,
+                                       car_number=pd['car_number']))
+
+def reset_lap_monitor():
+    """
+    Starts a new lap monitor from the laps in the store, at startup and when a worker
+    receives a full state. Must be called with data_lock held.
+    """
+    global lap_monitor
+    # Laps are announced by announce_lap (nicknames, per-ponder toggle); the monitor keeps the standings.
+    lap_monitor = LapTimeMonitor(voice_announcer, MIN_LAP_TIME, MAX_LAP_TIME, announce_laps=False)
+    for ponder_id, pd in ponder_data.items():
+        history = pd['lap_history']
+        best_lap_us = int(round(pd['best_lap'] * 1e6)) if len(history) else None
+        lap_monitor.seed(ponder_id, len(history), best_lap_us, pd['car_number'])
+
+def announce_lap(pd, lap_time, is_best=False, trace=None):
+    """Announces a lap time for a ponder with voice enabled. trace is the tracing key of the pass."""
+    identifier = spoken_identifier(pd)
+    # Format time in Japanese style: 12.24 -> "12秒24" (じゅうにびょう にーよん)
+    seconds = int(lap_time)
+    hundredths = int((lap_time - seconds) * 100)
+    if hundredths > 0:
+        announcement = f"{identifier}、{seconds}秒{hundredths:02d}"
+    else:
+        announcement = f"{identifier}、{seconds}秒"
+    # A new personal best outranks routine laps; only the newest pending lap per ponder is spoken.
+    priority = PRIORITY_BEST_LAP if is_best else PRIORITY_ROUTINE
+    voice_announcer.announce(announcement, priority, key=pd['transponder_id'], trace=trace)
 
 def update_data_from_db():
     """
     This function runs in a background thread.
     It periodically fetches ONLY NEW passes from the database and updates the in-memory store.
     """
-    global last_processed_rtc_time
+    global last_processed_rtc_time, last_update_time
     print("Starting background data updater...")
     
     while True:
+        started = time.perf_counter()
         try:
             conn = get_db_connection()
             cursor = conn.cursor(dictionary=True)
 
             # Fetch only records newer than the last one we processed.
             cursor.execute(
-                "SELECT p.transponder_id, p.rtc_time, c.car_number, c.name "
+                "SELECT p.transponder_id, p.rtc_time, p.decoder_id, c.car_number, c.name "
                 "FROM passes p LEFT JOIN cars c ON p.transponder_id = c.transponder_id "
                 "WHERE p.rtc_time > %s ORDER BY p.rtc_time ASC",
                 (last_processed_rtc_time,)
             )
             new_passes = cursor.fetchall()
             conn.close()
+            last_update_time = time.monotonic()
+            picked_up_at = time.time()
 
             if new_passes:
                 with data_lock:
                     # The last pass in the fetched list is the most recent one.
                     last_processed_rtc_time = new_passes[-1]['rtc_time']
+                    bump_version()
+                    # Stream events go out while the passes are applied, so register them for api_serve first.
+                    tracing.TRACER.published(data_version, [(p['transponder_id'], p['rtc_time']) for p in new_passes])
 
+                    applied = []
+                    created = {} # Operator settings of ponders seen for the first time, for the workers
+                    crossings = [] # Every pass, for the workers' sector timers
                     for p_pass in new_passes:
                         ponder_id = p_pass['transponder_id']
                         rtc_time = p_pass['rtc_time']
+                        if sector_timer is not None:
+                            sector_timer.update(ponder_id, p_pass['decoder_id'], rtc_time)
+                            crossings.append((ponder_id, p_pass['decoder_id'], rtc_time))
+                            # Only finish line crossings make laps; sector and pit loops are timed above.
+                            if track_layout.positions.get(p_pass['decoder_id']) != 0:
+                                continue
+                        tracing.mark((ponder_id, rtc_time), 'updater', picked_up_at)
+                        lap_time = lap_time_for_pass(ponder_id, rtc_time)
+                        is_new = ponder_id not in ponder_data
+                        pd = apply_pass(ponder_id, p_pass['car_number'], rtc_time, lap_time)
+                        applied.append((ponder_id, p_pass['car_number'], rtc_time, lap_time))
+                        if is_new:
+                            created[ponder_id] = {'voice_enabled': pd['voice_enabled'], 'nickname': pd['nickname']}
+
+                        if lap_time is None:
+                            continue
+                        # Monitoring costs one event per completed lap, not a scan of every ponder.
+                        is_best = monitor_lap(pd, lap_time)
+                        # Announce the lap time if voice is enabled for this ponder.
+                        if pd['voice_enabled'] and voice_announcer is not None:
+                            announce_lap(pd, lap_time, is_best, trace=(ponder_id, rtc_time))
 
-                        # Initialize a data structure for a ponder if it's the first time we see it.
-                        if ponder_id not in ponder_data:
-                            ponder_data[ponder_id] = {
-                                'transponder_id': ponder_id,
-                                'car_number': p_pass['car_number'] or 'Unknown',
-                                'last_pass_time': None,
-                                'laps': [],
-                                'lap_history': [],
-                                'best_lap': float('inf'),
-                                'latest_lap': None,
-                                'moving_avg_10': None,
-                                'std_dev': None,
-                                'voice_enabled': False, # Voice is off by default for all ponders.
-                                'nickname': '' # Nickname for voice announcements
-                            }
-                        
-                        pd = ponder_data[ponder_id]
-
-                        # A lap is the time between two consecutive passes.
-                        if pd['last_pass_time'] is not None:
-                            lap_time = (rtc_time - pd['last_pass_time']) / 1000000.0
-                            
-                            # Filter out unrealistic lap times (e.g., pit stops, errors).
-                            if 10.0 < lap_time < 300.0:
-                                timestamp = datetime.fromtimestamp(rtc_time / 1000000.0)
-                                
-                                # Update the ponder's data with the new lap.
-                                pd['laps'].append(lap_time)
-                                std_dev, moving_avg = calculate_stats(pd['laps'])
-                                pd['std_dev'] = std_dev
-                                pd['moving_avg_10'] = moving_avg
-                                pd['best_lap'] = min(pd['best_lap'], lap_time)
-                                pd['latest_lap'] = lap_time
-
-                                new_lap_record = {
-                                    'lap_number': len(pd['laps']),
-                                    'lap_time': lap_time,
-                                    'timestamp': timestamp,
-                                    'ponder_id': ponder_id,
-                                    'car_number': pd['car_number']
-                                }
-                                pd['lap_history'].append(new_lap_record)
-
-                                # Remove the old "latest lap" for this ponder from our sorted list.
-                                global all_laps_sorted
-                                all_laps_sorted = [l for l in all_laps_sorted if l['ponder_id'] != ponder_id]
-                                # Add the new lap to the very top of the list.
-                                all_laps_sorted.insert(0, new_lap_record)
-
-                                # Announce the lap time if voice is enabled for this ponder.
-                                if pd['voice_enabled']:
-                                    # Use nickname if available, otherwise use car_number
-                                    identifier = pd['nickname'] if pd['nickname'] else pd['car_number']
-                                    # Format time in Japanese style: 12.24 -> "12秒24" (じゅうにびょう にーよん)
-                                    seconds = int(lap_time)
-                                    hundredths = int((lap_time - seconds) * 100)
-                                    if hundredths > 0:
-                                        announcement = f"{identifier}、{seconds}秒{hundredths:02d}"
-                                    else:
-                                        announcement = f"{identifier}、{seconds}秒"
-                                    voice_announcer.announce(announcement)
-
-                        # Update the last pass time to the current one for the next calculation.
-                        pd['last_pass_time'] = rtc_time
+                    publish_view()
+                    # Serving workers apply exactly the laps computed here.
+                    if bus_publisher is not None:
+                        bus_publisher.publish(('passes', data_version, applied, created, crossings))
+                PASSES_APPLIED.inc(len(new_passes))
+            UPDATE_SECONDS.observe(time.perf_counter() - started)
 
         except Exception as e:
             print(f"Error in background thread: {e}")
+            UPDATE_ERRORS.inc()
         
         time.sleep(1) # Wait for 1 second before checking for new data again.
 
-def initialize_data():
+def fetch_car_numbers(conn):
+    """Returns {transponder_id: car_number} from the cars table."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT transponder_id, car_number FROM cars")
+    car_numbers = {transponder_id: car_number for transponder_id, car_number in cursor.fetchall()}
+    cursor.close()
+    return car_numbers
+
+def track_signature():
+    """The loops of the loaded track layout, which the sector state in a snapshot depends on."""
+    if track_layout is None:
+        return None
+    return sorted(track_layout.positions.items()), sorted(track_layout.pit_loops.items())
+
+def stream_passes(conn, after_rtc_time):
+    """
+    Yields (transponder_ids, decoder_ids, rtc_times) arrays of every pass after after_rtc_time, in RTC order.
+    Rows are streamed from the server in chunks by an unbuffered cursor and each chunk
+    is packed into NumPy arrays, so the full result never exists in memory at once.
+    """
+    cursor = conn.cursor(buffered=False)
+    cursor.execute(
+        "SELECT transponder_id, decoder_id, rtc_time FROM passes WHERE rtc_time > %s ORDER BY rtc_time ASC",
+        (after_rtc_time,)
+    )
+    try:
+        while True:
+            rows = cursor.fetchmany(PASS_FETCH_CHUNK)
+            if not rows:
+                break
+            passes = np.array(rows, dtype=np.int64)
+            yield passes[:, 0], passes[:, 1], passes[:, 2]
+    finally:
+        cursor.close()
+
+def load_crossings(ponder_ids, decoder_ids, rtc_times, car_numbers):
+    """
+    Applies a chunk of RTC-ordered passes of every loop at startup: all of them feed the
+    sector timer, and the finish line crossings become laps. Must be called with data_lock held.
+    """
+    if sector_timer is None:
+        load_passes(ponder_ids, rtc_times, car_numbers)
+        return
+    for ponder_id, decoder_id, rtc_time in zip(ponder_ids.tolist(), decoder_ids.tolist(), rtc_times.tolist()):
+        sector_timer.update(ponder_id, decoder_id, rtc_time)
+    finish = np.isin(decoder_ids, track_layout.finish_decoder_ids)
+    load_passes(ponder_ids[finish], rtc_times[finish], car_numbers)
+
+def load_passes(ponder_ids, rtc_times, car_numbers):
+    """
+    Turns RTC-ordered pass columns into laps for every ponder, vectorized per ponder.
+    Continues from each ponder's last_pass_time, so it can also apply a tail after a snapshot.
+    Must be called with data_lock held.
+    """
+    if len(ponder_ids) == 0:
+        return
+    # A stable sort groups the passes by ponder while keeping them in RTC order.
+    order = np.argsort(ponder_ids, kind='stable')
+    ponder_ids = ponder_ids[order]
+    rtc_times = rtc_times[order]
+    group_starts = np.flatnonzero(np.diff(ponder_ids)) + 1
+    for start, stop in zip(np.r_[0, group_starts], np.r_[group_starts, len(ponder_ids)]):
+        ponder_id = int(ponder_ids[start])
+        if ponder_id not in ponder_data:
+            ponder_data[ponder_id] = new_ponder_record(ponder_id, car_numbers.get(ponder_id))
+        pd = ponder_data[ponder_id]
+
+        passes_rtc = rtc_times[start:stop]
+        if pd['last_pass_time'] is not None:
+            passes_rtc = np.r_[pd['last_pass_time'], passes_rtc]
+        # A lap is the time between two consecutive passes.
+        lap_times = np.diff(passes_rtc) / 1000000.0
+        valid = (lap_times > MIN_LAP_TIME) & (lap_times < MAX_LAP_TIME)
+        add_laps(pd, lap_times[valid], passes_rtc[1:][valid])
+        pd['last_pass_time'] = int(passes_rtc[-1])
+
+def rebuild_leaderboard():
+    """Orders the leaderboard by each ponder's latest lap. Must be called with data_lock held."""
+    with_laps = [pd for pd in ponder_data.values() if len(pd['lap_history'])]
+    # Add oldest first so the newest one ends up on top.
+    for pd in sorted(with_laps, key=lambda pd: pd['lap_history'].rtc_times[-1]):
+        all_laps_sorted.update(pd['transponder_id'], pd['lap_history'][-1])
+
+def ponder_view(pd):
+    """Freezes what the API serves for one ponder. lap_count bounds its (append-only) history."""
+    history = pd['lap_history']
+    summary = {k: v for k, v in pd.items() if k not in LAP_DETAILS_EXCLUDED}
+    summary['total_laps'] = len(history)
+    latest_lap = all_laps_sorted.get(pd['transponder_id'])
+    row = all_laps_row(pd, latest_lap) if latest_lap is not None else None
+    return PonderView(pd['version'], summary, row, history, len(history))
+
+def publish_view():
+    """
+    Publishes the store as a new ReadView for API readers. Must be called with data_lock held,
+    after a batch of changes. Only ponders whose version moved get a new PonderView.
+    """
+    global current_view
+    previous = current_view.ponders
+    ponders = {}
+    for ponder_id, pd in ponder_data.items():
+        view = previous.get(ponder_id)
+        if view is None or view.version != pd['version'] or view.lap_history is not pd['lap_history']:
+            view = ponder_view(pd)
+        ponders[ponder_id] = view
+    rows = tuple(ponders[lap['ponder_id']].row for lap in all_laps_sorted.snapshot() if lap['ponder_id'] in ponders)
+    # A single reference swap: readers see either the old or the new view, never a mix.
+    current_view = ReadView(data_version, rows, ponders)
+    # Only now may stream clients hear about the changes, so their follow-up requests see them.
+    for topic, event in pending_events:
+        live_events.publish(event, topic=topic)
+    pending_events.clear()
+
+def snapshot_state():
+    """Copies the lap store into a picklable dict. Must be called with data_lock held."""
+    return {
+        'watermark': last_processed_rtc_time,
+        'session_start_rtc': session_start_rtc,
+        'session': session_key,
+        'track': track_signature(),
+        # Copied here because the updater keeps changing it while the snapshot is pickled.
+        'sector_timer': copy.deepcopy(sector_timer),
+        'ponders': {
+            ponder_id: {
+                'car_number': pd['car_number'],
+                'last_pass_time': pd['last_pass_time'],
+                'voice_enabled': pd['voice_enabled'],
+                'nickname': pd['nickname'],
+                'lap_times': pd['lap_history'].lap_times[:],
+                'rtc_times': pd['lap_history'].rtc_times[:],
+            } for ponder_id, pd in ponder_data.items()
+        }
+    }
+
+def restore_state(state, car_numbers):
+    """Rebuilds ponder_data (and the sector timer) from a snapshot. Must be called with data_lock held."""
+    global sector_timer, track_layout
+    sector_timer = state.get('sector_timer')
+    if sector_timer is not None:
+        # Workers have no --track of their own; they time sectors with the aggregator's layout.
+        track_layout = sector_timer.layout
+    for ponder_id, saved in state['ponders'].items():
+        pd = new_ponder_record(ponder_id, car_numbers.get(ponder_id, saved['car_number']))
+        add_laps(pd, np.frombuffer(saved['lap_times'], dtype=np.float64),
+                 np.frombuffer(saved['rtc_times'], dtype=np.int64))
+        pd['last_pass_time'] = saved['last_pass_time']
+        if operator_state is None:
+            # Workers take the operator settings from the aggregator's state.
+            pd['voice_enabled'] = saved.get('voice_enabled', pd['voice_enabled'])
+            pd['nickname'] = saved.get('nickname', pd['nickname'])
+        ponder_data[ponder_id] = pd
+
+def write_snapshots(path, interval):
+    """
+    This function runs in a background thread.
+    It periodically writes the lap store to disk so the next start only reads the DB tail.
+    """
+    while True:
+        time.sleep(interval)
+        try:
+            with data_lock:
+                state = snapshot_state()
+            write_snapshot(path, state)
+        except Exception as e:
+            print(f"Error writing snapshot: {e}")
+
+def snapshot_matches(snapshot, key, start):
+    """
+    Whether a snapshot can seed the session requested with key, whose history begins at start.
+    A --session-hours window is computed from the newest pass and moves on every start, so a
+    snapshot of the same window is used as long as it still reaches into the new window.
+    """
+    if snapshot.get('session') != key:
+        return False
+    if key[0] == 'hours':
+        return snapshot['watermark'] >= start
+    return snapshot['session_start_rtc'] == start
+
+def session_start_rtc_time(conn, heat=None, session_hours=None):
+    """
+    Returns the RTC time (microseconds) startup history begins at, or 0 for all of it.
+    heat is a heat_id or 'current' for the latest heat; session_hours counts back from the newest pass.
+    """
+    cursor = conn.cursor()
+    start = 0
+    if heat is not None:
+        if heat == 'current':
+            cursor.execute("SELECT rtc_time_start FROM heats ORDER BY heat_id DESC LIMIT 1")
+        else:
+            cursor.execute("SELECT rtc_time_start FROM heats WHERE heat_id = %s", (int(heat),))
+        row = cursor.fetchone()
+        if row is None:
+            print(f"Heat {heat} not found, loading all history.")
+        else:
+            start = row[0]
+    elif session_hours is not None:
+        cursor.execute("SELECT MAX(rtc_time) FROM passes")
+        row = cursor.fetchone()
+        if row and row[0]:
+            start = max(row[0] - int(session_hours * 3600 * 1000000), 0)
+    cursor.close()
+    return start
+
+def initialize_data(heat=None, session_hours=None, snapshot_path=None):
     """
     Pre-populates the in-memory data store on application startup.
-    This function performs one large read to build the initial state.
+    History is streamed from the database and turned into laps with NumPy; with a track
+    layout the sector timer is replayed over the same passes. With a snapshot, only the
+    passes after the snapshot's watermark are read from the database.
     """
-    global last_processed_rtc_time
+    global last_processed_rtc_time, session_start_rtc, session_key
     print("Initializing data from database...")
+    started = time.time()
     try:
         conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(
-            "SELECT p.transponder_id, p.rtc_time, c.car_number, c.name "
-            "FROM passes p LEFT JOIN cars c ON p.transponder_id = c.transponder_id "
-            "ORDER BY p.rtc_time ASC"
-        )
-        all_passes = cursor.fetchall()
-        conn.close()
+        car_numbers = fetch_car_numbers(conn)
+        session_start_rtc = session_start_rtc_time(conn, heat, session_hours)
+        session_key = ('heat', str(heat)) if heat is not None else \
+            ('hours', session_hours) if session_hours is not None else ('all', None)
+        # Passes are selected with "rtc_time > watermark".
+        watermark = session_start_rtc - 1 if session_start_rtc else 0
 
-        if not all_passes:
-            print("No historical pass data found in the database.")
-            return
+        snapshot = read_snapshot(snapshot_path) if snapshot_path else None
+        if snapshot is not None and not snapshot_matches(snapshot, session_key, session_start_rtc):
+            print("Snapshot was taken for a different session window, ignoring it.")
+            snapshot = None
+        elif snapshot is not None and snapshot.get('track') != track_signature():
+            print("Snapshot was taken with a different track layout, ignoring it.")
+            snapshot = None
 
         with data_lock:
-            last_processed_rtc_time = all_passes[-1]['rtc_time']
-            
-            # Group all passes by their transponder ID first.
-            passes_by_ponder = {}
-            for p_pass in all_passes:
-                ponder_id = p_pass['transponder_id']
-                if ponder_id not in passes_by_ponder:
-                    passes_by_ponder[ponder_id] = []
-                passes_by_ponder[ponder_id].append(p_pass)
-
-            # Process the history for each ponder.
-            for ponder_id, passes in passes_by_ponder.items():
-                if ponder_id not in ponder_data:
-                     ponder_data[ponder_id] = {
-                        'transponder_id': ponder_id, 'car_number': passes[0]['car_number'] or 'Unknown',
-                        'last_pass_time': None, 'laps': [], 'lap_history': [], 'best_lap': float('inf'),
-                        'latest_lap': None, 'moving_avg_10': None, 'std_dev': None, 'voice_enabled': False,
-                        'nickname': ''
-                    }
-                pd = ponder_data[ponder_id]
-
-                # Calculate all historical laps.
-                for i in range(1, len(passes)):
-                    lap_time = (passes[i]['rtc_time'] - passes[i-1]['rtc_time']) / 1000000.0
-                    if 10.0 < lap_time < 300.0:
-                        pd['laps'].append(lap_time)
-                        pd['lap_history'].append({
-                            'lap_number': len(pd['laps']), 'lap_time': lap_time,
-                            'timestamp': datetime.fromtimestamp(passes[i]['rtc_time'] / 1000000.0),
-                            'ponder_id': ponder_id, 'car_number': pd['car_number']
-                        })
-                
-                # After processing all laps, calculate the final statistics.
-                if pd['laps']:
-                    std_dev, moving_avg = calculate_stats(pd['laps'])
-                    pd['std_dev'] = std_dev
-                    pd['moving_avg_10'] = moving_avg
-                    pd['best_lap'] = min(pd['laps'])
-                    pd['latest_lap'] = pd['laps'][-1]
-                    
-                    # Add its most recent lap to the global sorted list.
-                    all_laps_sorted.append(pd['lap_history'][-1])
-
-        # Finally, sort the list of latest laps by timestamp to ensure the newest is first.
+            if snapshot is not None:
+                restore_state(snapshot, car_numbers)
+                watermark = snapshot['watermark']
+                # The restored session keeps its own start, so the next snapshot still matches.
+                session_start_rtc = snapshot['session_start_rtc']
+                print(f"Restored {len(ponder_data)} ponders from snapshot, reading passes after {watermark}.")
+
+        # Each chunk is turned into laps as soon as it arrives; the full history never exists as one array.
+        pass_count = 0
+        last_processed_rtc_time = watermark
+        for ponder_ids, decoder_ids, rtc_times in stream_passes(conn, watermark):
+            with data_lock:
+                load_crossings(ponder_ids, decoder_ids, rtc_times, car_numbers)
+                last_processed_rtc_time = int(rtc_times[-1])
+            pass_count += len(rtc_times)
+        conn.close()
+
         with data_lock:
-            all_laps_sorted.sort(key=lambda x: x['timestamp'], reverse=True)
-        print(f"Initialization complete. Loaded {len(all_laps_sorted)} final laps.")
+            rebuild_leaderboard()
+            bump_version()
+            publish_view()
+
+        if not ponder_data:
+            print("No historical pass data found in the database.")
+            return
+        print(f"Initialization complete. Loaded {len(all_laps_sorted)} final laps from {pass_count} passes "
+              f"in {time.time() - started:.1f}s.")
 
     except Exception as e:
         print(f"Error during data initialization: {e}")
@@ -234,72 +641,436 @@ def lap_details(transponder_id):
     """Serves the detail page for a single ponder."""
     return render_template('laps.html', transponder_id=transponder_id)
 
+def cached_json_response(key, version, build):
+    """Serves build()'s data as JSON, serialized at most once per version."""
+    return cached_response(key, version, lambda: json.dumps(build()).encode('utf-8'))
+
+def cached_response(key, version, build_body):
+    """
+    Serves a JSON body from the response cache.
+    The body is only built when the version changed; clients that already
+    hold the current version (If-None-Match) get an empty 304.
+    """
+    entry = response_cache.get(key, version, build_body)
+    if request.if_none_match.contains_weak(entry.etag):
+        response = Response(status=304)
+    elif entry.gzip_body is not None and request.accept_encodings['gzip']:
+        response = Response(entry.gzip_body, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(entry.body, mimetype='application/json')
+    response.set_etag(entry.etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+def all_laps_row(pd, lap_record):
+    """Formats one dashboard row from a ponder record and its latest lap."""
+    return {
+        'ponder_id': pd['transponder_id'],
+        'car_number': pd['car_number'],
+        'latest_lap_time': f"{pd['latest_lap']:.3f}" if pd['latest_lap'] is not None else '-',
+        'best_lap_time': f"{pd['best_lap']:.3f}" if pd['best_lap'] != float('inf') else '-',
+        'moving_avg_10': f"{pd['moving_avg_10']:.3f}" if pd['moving_avg_10'] is not None else '-',
+        'std_dev': f"{pd['std_dev']:.3f}" if pd['std_dev'] is not None else '-',
+        'timestamp': lap_record['timestamp'].strftime('%H:%M:%S'),
+        'voice_enabled': pd['voice_enabled'],
+        'nickname': pd['nickname']
+    }
+
 @app.route('/api/all_laps')
 def api_all_laps():
     """API endpoint for the main page. Returns the sorted list of latest laps with all stats."""
-    response_data = []
+    view = current_view
+    response = cached_json_response('all_laps', view.version, lambda: list(view.rows))
+    tracing.TRACER.served(view.version)
+    return response
+
+def lap_details_body(view, start, stop, summary_only):
+    """
+    Builds the /api/laps body from a PonderView.
+    Only the small summary is serialized per request; laps come from the history's
+    cached JSON blocks, up to the lap count the view was published with.
+    """
+    if summary_only:
+        return json.dumps(view.summary).encode('utf-8')
+    stop = view.lap_count if stop is None else min(stop, view.lap_count)
+    # Splice the laps into the summary object as its last key.
+    summary_json = json.dumps(view.summary)
+    laps_json = view.lap_history.to_json(start, stop)
+    return f'{summary_json[:-1]}, "lap_history": {laps_json}}}'.encode('utf-8')
+
+def standings_rows():
+    """The lap monitor's standings with lap times in seconds. Takes data_lock."""
     with data_lock:
-        for lap_record in all_laps_sorted:
-            ponder_id = lap_record['ponder_id']
-            pd = ponder_data.get(ponder_id)
-            if pd:
-                response_data.append({
-                    'ponder_id': ponder_id,
-                    'car_number': pd['car_number'],
-                    'latest_lap_time': f"{pd['latest_lap']:.3f}" if pd['latest_lap'] is not None else '-',
-                    'best_lap_time': f"{pd['best_lap']:.3f}" if pd['best_lap'] != float('inf') else '-',
-                    'moving_avg_10': f"{pd['moving_avg_10']:.3f}" if pd['moving_avg_10'] is not None else '-',
-                    'std_dev': f"{pd['std_dev']:.3f}" if pd['std_dev'] is not None else '-',
-                    'timestamp': lap_record['timestamp'].strftime('%H:%M:%S'),
-                    'voice_enabled': pd['voice_enabled'],
-                    'nickname': pd['nickname']
-                })
-    return jsonify(response_data)
+        table = lap_monitor.standings_table() if lap_monitor is not None else []
+    for row in table:
+        best_lap_us = row.pop('best_lap_us')
+        row['best_lap_time'] = round(best_lap_us / 1e6, 3) if best_lap_us is not None else None
+    return table
+
+@app.route('/api/standings')
+def api_standings():
+    """API endpoint for the race order: most laps first, then best lap."""
+    view = current_view
+    response = cached_json_response('standings', view.version, standings_rows)
+    tracing.TRACER.served(view.version)
+    return response
 
 @app.route('/api/laps/<int:transponder_id>')
 def api_lap_details(transponder_id):
-    """API endpoint for the detail page. Returns all historical data for a single ponder."""
+    """
+    API endpoint for the detail page. Returns the history and statistics for a single ponder.
+
+    Optional query parameters:
+      since_lap=<n>   only laps after lap number n (delta updates)
+      limit=<n>       at most n laps, starting at page=<p> (1-based)
+      summary=1       statistics only, without lap_history
+    """
+    since_lap = request.args.get('since_lap', default=0, type=int)
+    limit = request.args.get('limit', type=int)
+    page = request.args.get('page', default=1, type=int)
+    summary_only = request.args.get('summary', '') in ('1', 'true')
+    if since_lap < 0 or page < 1 or (limit is not None and limit < 1):
+        return jsonify({'error': 'Invalid since_lap, page or limit'}), 400
+
+    # Lap n is stored at index n - 1, so since_lap is also the first index to return.
+    start = since_lap
+    stop = None
+    if limit is not None:
+        start += (page - 1) * limit
+        stop = start + limit
+    # Only the plain full request is shared by enough clients to be worth caching.
+    cache_key = ('laps', transponder_id) if start == 0 and stop is None and not summary_only else None
+
+    view = current_view.ponders.get(transponder_id)
+    if view is None:
+        return jsonify({'error': 'Transponder not found'}), 404
+    return cached_response(cache_key, view.version, lambda: lap_details_body(view, start, stop, summary_only))
+
+@app.route('/api/stream')
+def api_stream():
+    """
+    Server-Sent Events stream of lap deltas for the dashboard and detail pages.
+    Pass ?transponder_id=<id> to receive only one ponder's events.
+    Clients that fall too far behind get a 'resync' event and should reload the full state.
+    """
+    subscription = live_events.subscribe(topic=request.args.get('transponder_id', type=int))
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                message = subscription.get(timeout=STREAM_KEEPALIVE)
+                if message is None:
+                    yield ": keepalive\n\n"
+                elif message is RESYNC:
+                    yield format_event('resync', {'version': current_view.version})
+                else:
+                    # Messages are (data version, event); the passes of that version reach a client now.
+                    version, event = message
+                    yield event
+                    tracing.TRACER.served(version)
+        finally:
+            live_events.unsubscribe(subscription)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics of this process."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/traces')
+def api_traces():
+    """Per-pass stage timestamps recorded by this process (see amb_trace.py)."""
+    return jsonify(tracing.TRACER.traces())
+
+@app.route('/api/voice_metrics')
+def api_voice_metrics():
+    """API endpoint reporting the announcement queue depth and speech latency."""
+    if voice_announcer is None:
+        return jsonify({'error': 'Voice announcer is not running in this process'}), 404
+    return jsonify(voice_announcer.get_metrics())
+
+def analytics_date_range():
+    """rtc_time range of the since/until (YYYY-MM-DD, until inclusive) query parameters, or None if invalid."""
+    try:
+        since, until = request.args.get('since'), request.args.get('until')
+        since = int(np.datetime64(since, 'us').astype(np.int64)) if since else None
+        until = int((np.datetime64(until, 'D') + 1).astype('datetime64[us]').astype(np.int64)) if until else None
+    except ValueError:
+        return None
+    return since, until
+
+def analytics_response(build):
+    """Serves build()'s columns as JSON rows, or 503 if the database cannot be read."""
+    try:
+        return jsonify(to_rows(build()))
+    except mysql.connector.Error as e:
+        print(f"Analytics query failed: {e}")
+        return jsonify({'error': 'Database unavailable'}), 503
+
+@app.route('/api/analytics/drivers')
+def api_analytics_drivers():
+    """Best, median, p90, mean and std of the lap times and lap count of every ponder, optionally since/until a date."""
+    date_range = analytics_date_range()
+    if date_range is None:
+        return jsonify({'error': 'Invalid since or until date'}), 400
+    return analytics_response(lambda: analytics.drivers(*date_range))
+
+@app.route('/api/analytics/heats/<int:heat_id>')
+def api_analytics_heat(heat_id):
+    """Per-ponder lap statistics of one heat; finished heats are computed once."""
+    try:
+        stats = analytics.heat(heat_id)
+    except mysql.connector.Error as e:
+        print(f"Analytics query failed: {e}")
+        return jsonify({'error': 'Database unavailable'}), 503
+    if stats is None:
+        return jsonify({'error': 'Heat not found'}), 404
+    return jsonify(to_rows(stats))
+
+@app.route('/api/analytics/best_by_heat')
+def api_analytics_best_by_heat():
+    """Per-ponder lap statistics of every heat. Pass ?transponder_id=<id> for a single ponder."""
+    transponder_id = request.args.get('transponder_id', type=int)
+    return analytics_response(lambda: analytics.best_by_heat(transponder_id))
+
+@app.route('/api/analytics/progression')
+def api_analytics_progression():
+    """Per-ponder lap statistics by ?period=week (default) or day; period_start is an RTC time."""
+    period = request.args.get('period', 'week')
+    date_range = analytics_date_range()
+    if period not in PERIODS or date_range is None:
+        return jsonify({'error': 'Invalid period, since or until'}), 400
+    transponder_id = request.args.get('transponder_id', type=int)
+    return analytics_response(lambda: analytics.progression(period, transponder_id, *date_range))
+
+@app.route('/api/analytics/consistency')
+def api_analytics_consistency():
+    """Ponders with at least ?min_laps=<n> (default 10) laps, ranked by lap time std."""
+    min_laps = request.args.get('min_laps', default=10, type=int)
+    date_range = analytics_date_range()
+    if date_range is None:
+        return jsonify({'error': 'Invalid since or until date'}), 400
+    return analytics_response(lambda: analytics.consistency(min_laps, *date_range))
+
+@app.route('/api/sectors/<int:transponder_id>')
+def api_sectors(transponder_id):
+    """Live sector splits of one ponder: current lap, last lap, best splits, theoretical best and pit state."""
+    if sector_timer is None:
+        return jsonify({'error': 'No track layout loaded in this process (--track)'}), 404
+    summary = sector_timer.summary(transponder_id)
+    if summary is None:
+        return jsonify({'error': 'Transponder not found'}), 404
+    return jsonify(summary)
+
+def split_dict(splits):
+    """Named splits of one recompute() row, None where not timed."""
+    return {name: None if np.isnan(value) else round(float(value), 3)
+            for name, value in zip(track_layout.split_names, splits)}
+
+@app.route('/api/sectors/heats/<int:heat_id>')
+def api_heat_sectors(heat_id):
+    """Laps with sector splits and pit flags, and best/theoretical-best times per ponder, of one heat."""
+    if track_layout is None:
+        return jsonify({'error': 'No track layout loaded in this process (--track)'}), 404
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT rtc_time_start, rtc_time_max_end FROM heats WHERE heat_id = %s", (heat_id,))
+        heat = cursor.fetchone()
+        if heat is None:
+            return jsonify({'error': 'Heat not found'}), 404
+        cursor.execute("SELECT transponder_id, decoder_id, rtc_time FROM passes WHERE rtc_time >= %s AND rtc_time <= %s",
+                       heat)
+        passes = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 3)
+        cursor.close()
+    finally:
+        conn.close()
+    laps = recompute(track_layout, passes[:, 0], passes[:, 1], passes[:, 2], MIN_LAP_TIME)
+    best = best_times(track_layout, laps)
+    return jsonify({
+        'laps': [{'transponder_id': int(transponder_id), 'rtc_time': int(rtc_time), 'lap_time': round(float(lap_time), 3),
+                  'pit': bool(pit), 'splits': split_dict(splits)}
+                 for transponder_id, rtc_time, lap_time, pit, splits in
+                 zip(laps['transponder_id'], laps['rtc_time'], laps['lap_time'], laps['pit'], laps['splits'])],
+        'best': [{'transponder_id': int(transponder_id), 'best_lap': round(float(best_lap), 3),
+                  'best_splits': split_dict(splits),
+                  'theoretical_best': None if np.isnan(theoretical) else round(float(theoretical), 3)}
+                 for transponder_id, best_lap, splits, theoretical in
+                 zip(best['transponder_id'], best['best_lap'], best['best_splits'], best['theoretical_best'])],
+    })
+
+def update_settings_response(transponder_id, values):
+    """Changes operator settings locally, or forwards them to the aggregator in worker mode."""
     with data_lock:
-        data = ponder_data.get(transponder_id)
-        if data:
-            # Create a copy to avoid sending the raw 'laps' list, which can be large.
-            response = {k: v for k, v in data.items() if k != 'laps'}
-            return jsonify(response)
-        else:
-            return jsonify({'error': 'Transponder not found'}), 404
+        if transponder_id not in ponder_data:
+            return None
+        if bus_subscriber is None:
+            change_settings(transponder_id, values)
+            return True
+    # The aggregator persists the change and sends it back to every worker, including this one.
+    return bus_subscriber.send(('settings', transponder_id, values))
 
 @app.route('/api/voice_toggle/<int:transponder_id>', methods=['POST'])
 def api_voice_toggle(transponder_id):
     """API endpoint to toggle voice announcements for a specific ponder."""
-    with data_lock:
-        if transponder_id in ponder_data:
-            data = request.get_json()
-            new_state = data.get('enabled', False)
-            ponder_data[transponder_id]['voice_enabled'] = new_state
-            print(f"Set voice for ponder {transponder_id} to {new_state}")
-            return jsonify({'status': 'success', 'new_state': new_state})
-        else:
-            return jsonify({'error': 'Transponder not found'}), 404
+    data = request.get_json()
+    new_state = data.get('enabled', False)
+    result = update_settings_response(transponder_id, {'voice_enabled': new_state})
+    if result is None:
+        return jsonify({'error': 'Transponder not found'}), 404
+    if not result:
+        return jsonify({'error': 'Aggregator not reachable'}), 503
+    print(f"Set voice for ponder {transponder_id} to {new_state}")
+    return jsonify({'status': 'success', 'new_state': new_state})
 
 @app.route('/api/nickname/<int:transponder_id>', methods=['POST'])
 def api_nickname_update(transponder_id):
     """API endpoint to update the nickname for a specific ponder."""
+    data = request.get_json()
+    new_nickname = data.get('nickname', '')
+    result = update_settings_response(transponder_id, {'nickname': new_nickname})
+    if result is None:
+        return jsonify({'error': 'Transponder not found'}), 404
+    if not result:
+        return jsonify({'error': 'Aggregator not reachable'}), 503
+    print(f"Set nickname for ponder {transponder_id} to '{new_nickname}'")
+    return jsonify({'status': 'success', 'nickname': new_nickname})
+
+# --- Multi-worker serving ---
+def bus_initial_message():
+    """Full state for a newly connected worker. Called by the bus with data_lock held."""
+    return ('state', response_cache.boot_id, data_version, snapshot_state())
+
+def on_bus_command(command):
+    """Aggregator side: applies a command sent by a worker."""
+    kind = command[0]
+    if kind == 'settings':
+        _, transponder_id, values = command
+        with data_lock:
+            if transponder_id in ponder_data:
+                change_settings(transponder_id, values)
+    else:
+        print(f"Ignoring unknown bus command: {kind}")
+
+def on_bus_message(message):
+    """Worker side: applies a state or delta message from the aggregator."""
+    global last_processed_rtc_time
+    kind = message[0]
     with data_lock:
-        if transponder_id in ponder_data:
-            data = request.get_json()
-            new_nickname = data.get('nickname', '')
-            ponder_data[transponder_id]['nickname'] = new_nickname
-            print(f"Set nickname for ponder {transponder_id} to '{new_nickname}'")
-            return jsonify({'status': 'success', 'nickname': new_nickname})
+        if kind == 'state':
+            _, boot_id, version, state = message
+            ponder_data.clear()
+            all_laps_sorted.clear()
+            pending_settings.clear()
+            restore_state(state, {})
+            rebuild_leaderboard()
+            reset_lap_monitor()
+            last_processed_rtc_time = state['watermark']
+            bump_version(version=version)
+            publish_view()
+            response_cache.reset(boot_id)
+            # Whatever this worker's stream clients had may be stale now.
+            live_events.publish((data_version, format_event('resync', {'version': data_version})))
+            print(f"Received state for {len(ponder_data)} ponders at version {version}")
+        elif kind == 'passes':
+            _, version, passes, settings, crossings = message
+            # Ponders created by these passes start with the aggregator's operator settings.
+            pending_settings.update(settings)
+            bump_version(version=version)
+            if sector_timer is not None:
+                for ponder_id, decoder_id, rtc_time in crossings:
+                    sector_timer.update(ponder_id, decoder_id, rtc_time)
+            tracing.TRACER.published(version, [(ponder_id, rtc_time) for ponder_id, _, rtc_time, _ in passes])
+            for ponder_id, car_number, rtc_time, lap_time in passes:
+                pd = apply_pass(ponder_id, car_number, rtc_time, lap_time)
+                if lap_time is not None:
+                    monitor_lap(pd, lap_time)
+                last_processed_rtc_time = rtc_time
+            publish_view()
+        elif kind == 'settings':
+            _, version, transponder_id, values = message
+            if transponder_id in ponder_data:
+                apply_settings(transponder_id, values, version)
+                publish_view()
+            else:
+                # Kept until the ponder's first pass arrives here.
+                pending_settings.setdefault(transponder_id, {}).update(values)
         else:
-            return jsonify({'error': 'Transponder not found'}), 404
+            print(f"Ignoring unknown bus message: {kind}")
+
+def create_worker_app(bus_address, allow_remote=False):
+    """
+    WSGI entry point for serving workers, e.g.:
+      gunicorn -w 4 -k gthread --threads 16 -b 0.0.0.0:5000 "web_app:create_worker_app('/tmp/amb_web.sock')"
+    Each worker keeps a copy of the data fed by the aggregator (web_app.py --role aggregator)
+    and never touches the database. Do not use --preload: the bus thread must start in each worker.
+    allow_remote permits a non-loopback TCP bus address (see AmbP3/snapshot_bus.py).
+    """
+    global bus_subscriber
+    bus_subscriber = BusSubscriber(bus_address, on_bus_message, allow_remote=allow_remote)
+    bus_subscriber.start()
+    return app
 
 # --- Main Execution ---
+def get_args():
+    parser = ArgumentParser()
+    parser.add_argument("--heat", help="only load history from this heat_id (or 'current') onwards")
+    parser.add_argument("--session-hours", help="only load the last N hours of history", type=float)
+    parser.add_argument("--snapshot", help="snapshot file used for fast warm starts")
+    parser.add_argument("--snapshot-interval", help="seconds between snapshot writes", default=60, type=float)
+    parser.add_argument("--operator-state", help="file keeping voice toggles and nicknames across restarts",
+                        default=DEFAULT_OPERATOR_STATE_FILE)
+    parser.add_argument("--role", help="'aggregator' also feeds serving workers over --bus (see create_worker_app)",
+                        choices=['standalone', 'aggregator'], default='standalone')
+    parser.add_argument("--bus", help="Unix socket path or host:port for the worker bus", default=DEFAULT_BUS_ADDRESS)
+    parser.add_argument("--bus-allow-remote", help="allow a non-loopback host:port for --bus; only on a trusted network",
+                        action='store_true')
+    parser.add_argument("--port", help="HTTP port", default=5000, type=int)
+    parser.add_argument("--track", help="track layout YAML with sector and pit loops (see AmbP3/sectors.py)")
+    parser.add_argument("--trace-dump", help="write pass latency traces here on exit and SIGUSR1 (see amb_trace.py)")
+    parser.add_argument("--voice-cache", help="directory of cached speech clips (gTTS)", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--voice-cache-mb", help="size cap of the speech clip cache in MB", default=64, type=int)
+    parser.add_argument("--voice-max-age", help="seconds after which a pending announcement is dropped",
+                        default=DEFAULT_MAX_AGE, type=float)
+    return parser.parse_args()
+
 if __name__ == '__main__':
-    initialize_data()
+    args = get_args()
+    if args.trace_dump:
+        tracing.dump_on_exit(args.trace_dump)
+    if args.track:
+        track_layout = TrackLayout.load(args.track)
+        sector_timer = SectorTimer(track_layout, MIN_LAP_TIME)
+        print(f"Track layout: {track_layout.sectors} sector loops, splits {', '.join(track_layout.split_names)}")
+    # Operator settings are loaded before (and independently of) lap history.
+    operator_state = OperatorState(args.operator_state)
+    atexit.register(operator_state.flush)
+    print(f"Loaded operator settings for {len(operator_state.settings)} ponders from {args.operator_state}")
+    voice_announcer = VoiceAnnouncer(enabled=True, engine='auto', cache_dir=args.voice_cache,
+                                     cache_max_bytes=args.voice_cache_mb * 1024 * 1024,
+                                     max_age=args.voice_max_age)
+    initialize_data(heat=args.heat, session_hours=args.session_hours, snapshot_path=args.snapshot)
+    with data_lock:
+        reset_lap_monitor()
+    # Names are rendered while the track is quiet, so the first callout needs no network.
+    voice_announcer.prerender([spoken_identifier(pd) for pd in ponder_data.values()])
+    if args.role == 'aggregator':
+        # Serving workers connect here; this process keeps computing laps and announcing.
+        bus_publisher = BusPublisher(args.bus, bus_initial_message, data_lock, on_command=on_bus_command,
+                                     allow_remote=args.bus_allow_remote)
+        bus_publisher.start()
     # Start the background thread to fetch data continuously.
     # 'daemon=True' ensures the thread exits when the main app does.
     update_thread = threading.Thread(target=update_data_from_db, daemon=True)
     update_thread.start()
+    if args.snapshot:
+        snapshot_thread = threading.Thread(target=write_snapshots, args=(args.snapshot, args.snapshot_interval),
+                                           daemon=True)
+        snapshot_thread.start()
     # 'use_reloader=False' is important when running background threads with Flask's dev server.
-    app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
+    app.run(host='0.0.0.0', port=args.port, debug=True, use_reloader=False)